@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+"""Streaming anomaly scoring of an event feed
+
+`predict_model(iforest, data = data)` takes a whole DataFrame and returns a
+copy of it with `Anomaly` and `Anomaly_Score`, running the pipeline and the
+detector twice on the way (once for `predict`, once for `decision_function`).
+`score_stream` scores a pipeline saved with `save_model` over a continuous
+feed instead:
+
+- events come from an iterator (of records or DataFrames), a CSV/Parquet
+  file, a `queue.Queue` or a local TCP socket (one JSON record per line),
+- they are grouped into micro-batches of at most `batch_size` events,
+  closed after `max_wait_ms` when the feed is slower,
+- every batch is transformed once and scored once; the label is the score
+  compared with the detector's `threshold_`, as `predict` does,
+- scored batches (`Anomaly`, `Anomaly_Score` and the `keep_columns`) are
+  yielded one at a time and the socket feed goes through a bounded queue,
+  so memory does not grow with the stream,
+- `StreamStats` counts events and batches and reports events per second
+  every `report_every` seconds.
+
+Usage:
+
+```
+from anomaly_stream import score_stream, StreamStats
+
+loaded_pipeline = load_model('iforest_pipeline')
+stats = StreamStats()
+for scored in score_stream(loaded_pipeline, events, batch_size = 1000, stats = stats):
+    alerts = scored[scored['Anomaly'] == 1]
+stats.summary()
+```
+
+`python anomaly_stream.py iforest_pipeline tcp://127.0.0.1:9999 --output scores.csv`
+(then send JSON lines to the port) or
+`python anomaly_stream.py iforest_pipeline new_data.csv --compare`.
+"""
+
+import argparse
+import json
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from streaming_predict import ChunkWriter, iter_chunks
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_MAX_WAIT_MS = 50.0
+DEFAULT_QUEUE_SIZE = 100_000
+# put on a queue to end the stream
+END = None
+
+
+class StreamStats:
+    """Events and batches scored, with a periodic events-per-second report."""
+
+    def __init__(self, report_every=None, report=None):
+        self.report_every = report_every
+        self.report = report or (lambda summary: print(json.dumps(summary), file=sys.stderr))
+        self.events = 0
+        self.batches = 0
+        self.score_seconds = 0.0
+        self.start = time.perf_counter()
+        self._last_report = (self.start, 0)
+
+    def add(self, events, seconds):
+        self.events += events
+        self.batches += 1
+        self.score_seconds += seconds
+        if self.report_every is None:
+            return
+        now = time.perf_counter()
+        last_time, last_events = self._last_report
+        if now - last_time >= self.report_every:
+            summary = self.summary()
+            summary["recent_events_per_s"] = round((self.events - last_events) / (now - last_time), 1)
+            self.report(summary)
+            self._last_report = (now, self.events)
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.start
+        return {
+            "events": self.events,
+            "batches": self.batches,
+            "seconds": round(elapsed, 3),
+            "events_per_s": round(self.events / elapsed, 1) if elapsed > 0 else None,
+            "scoring_events_per_s": (round(self.events / self.score_seconds, 1)
+                                     if self.score_seconds > 0 else None),
+            "mean_batch_size": round(self.events / self.batches, 1) if self.batches else 0,
+        }
+
+
+class AnomalyScorer:
+    """Score DataFrames with a saved anomaly pipeline, transforming each once."""
+
+    def __init__(self, pipeline, keep_columns=None):
+        self.preprocess = pipeline[:-1]
+        self.model = pipeline._final_estimator
+        self.keep_columns = keep_columns
+        self.feature_names = getattr(self.model, "feature_names_in_", None)
+        contamination = getattr(self.model, "contamination", None)
+        self.threshold = (getattr(self.model, "threshold_", None)
+                          if isinstance(contamination, (float, int)) else None)
+
+    def score(self, batch):
+        X = self.preprocess.transform(batch)
+        if self.feature_names is not None:
+            X = X[list(self.feature_names)]
+        scores = self.model.decision_function(X)
+        if self.threshold is None:
+            labels = self.model.predict(X)
+        else:
+            labels = (np.ravel(scores) > self.threshold).astype("int")
+        out = batch[self.keep_columns] if self.keep_columns is not None else batch.iloc[:, :0]
+        return out.assign(Anomaly=labels, Anomaly_Score=scores)
+
+
+def _frame(items):
+    """One DataFrame from a list of records (dicts) and DataFrames."""
+    if not any(isinstance(item, pd.DataFrame) for item in items):
+        return pd.DataFrame.from_records(items)
+    return pd.concat([item if isinstance(item, pd.DataFrame) else pd.DataFrame([item])
+                      for item in items], ignore_index=True)
+
+
+def queue_batches(events, batch_size=DEFAULT_BATCH_SIZE, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+    """Micro-batches from a ``queue.Queue`` of records or DataFrames, until ``END`` is put."""
+    max_wait = max_wait_ms / 1000
+    while True:
+        item = events.get()
+        if item is END:
+            return
+        batch, size = [item], len(item) if isinstance(item, pd.DataFrame) else 1
+        deadline = time.monotonic() + max_wait
+        while size < batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                item = events.get(timeout=timeout) if timeout > 0 else events.get_nowait()
+            except queue.Empty:
+                break
+            if item is END:
+                yield _frame(batch)
+                return
+            batch.append(item)
+            size += len(item) if isinstance(item, pd.DataFrame) else 1
+        yield _frame(batch)
+
+
+def iter_batches(source, batch_size=DEFAULT_BATCH_SIZE):
+    """Micro-batches from a CSV/Parquet path, a DataFrame or an iterator of records or DataFrames."""
+    if isinstance(source, (str, os.PathLike, pd.DataFrame)):
+        yield from iter_chunks(source, batch_size)
+        return
+    records = []
+    for item in source:
+        if isinstance(item, pd.DataFrame):
+            if records:
+                yield pd.DataFrame.from_records(records)
+                records = []
+            yield from iter_chunks(item, batch_size)
+            continue
+        records.append(item)
+        if len(records) == batch_size:
+            yield pd.DataFrame.from_records(records)
+            records = []
+    if records:
+        yield pd.DataFrame.from_records(records)
+
+
+def _read_lines(connection, events):
+    with connection, connection.makefile("r", encoding="utf-8") as lines:
+        for line in lines:
+            if not line.strip():
+                continue
+            # one bad event must not drop the rest of the connection
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as ex:
+                print(f"skipping malformed JSON line ({ex}): {line.strip()[:200]}",
+                      file=sys.stderr)
+                continue
+            if not isinstance(record, dict):
+                print(f"skipping JSON line that is not an object: {line.strip()[:200]}",
+                      file=sys.stderr)
+                continue
+            events.put(record)
+
+
+def serve_socket(host="127.0.0.1", port=9999, maxsize=DEFAULT_QUEUE_SIZE, connections=None):
+    """
+    Listen on ``host:port`` and put the JSON records sent over it (one per
+    line) on a bounded queue, for ``queue_batches``. Lines that are not a
+    JSON object are reported on stderr and skipped.
+
+
+    host: str, default = '127.0.0.1'
+        Interface to listen on.
+
+
+    port: int, default = 9999
+        Port to listen on. 0 picks a free one.
+
+
+    maxsize: int, default = 100000
+        Capacity of the queue. Readers block when it is full, which slows the
+        senders down instead of buffering without limit.
+
+
+    connections: int, default = None
+        ``END`` is put on the queue once this many connections are closed.
+        None serves until the process stops.
+
+
+    Returns:
+        ``(queue, (host, port))``.
+
+    """
+    events = queue.Queue(maxsize)
+    server = socket.create_server((host, port))
+
+    def accept():
+        readers = []
+        with server:
+            while connections is None or len(readers) < connections:
+                connection, _ = server.accept()
+                reader = threading.Thread(target=_read_lines, args=(connection, events),
+                                          daemon=True)
+                reader.start()
+                readers.append(reader)
+        for reader in readers:
+            reader.join()
+        events.put(END)
+
+    threading.Thread(target=accept, daemon=True).start()
+    return events, server.getsockname()[:2]
+
+
+def _score_batch(scorer, batch):
+    """Score ``batch``; when it fails, score its events one by one and skip the failing ones."""
+    try:
+        return scorer.score(batch)
+    except Exception as ex:
+        print(f"batch of {len(batch)} events failed ({ex!r}), scoring them one by one",
+              file=sys.stderr)
+    scored = []
+    for i in range(len(batch)):
+        try:
+            scored.append(scorer.score(batch.iloc[[i]]))
+        except Exception as ex:
+            print(f"skipping event {batch.iloc[i].to_dict()!r:.200} ({ex!r})", file=sys.stderr)
+    return pd.concat(scored) if scored else None
+
+
+def score_stream(
+    pipeline,
+    source,
+    batch_size=DEFAULT_BATCH_SIZE,
+    max_wait_ms=DEFAULT_MAX_WAIT_MS,
+    keep_columns=None,
+    stats=None,
+):
+    """
+    Score an event feed with a pipeline from ``load_model``, one
+    micro-batch at a time. Events that cannot be scored are reported on
+    stderr and skipped, the stream goes on.
+
+
+    pipeline: sklearn.pipeline.Pipeline
+        Anomaly pipeline returned by ``load_model``.
+
+
+    source: str, DataFrame, queue.Queue or iterable
+        CSV/Parquet path, frame, queue (e.g. from ``serve_socket``) or
+        iterator of records (dicts) or DataFrames.
+
+
+    batch_size: int, default = 1000
+        Maximum number of events per batch.
+
+
+    max_wait_ms: float, default = 50
+        For a queue, time a batch waits for more events before it is scored.
+
+
+    keep_columns: list of str, default = None
+        Input columns returned next to ``Anomaly`` and ``Anomaly_Score``.
+        None returns only those two.
+
+
+    stats: StreamStats, default = None
+        Updated after every batch.
+
+
+    Returns:
+        Generator of DataFrames, one per batch.
+
+    """
+    scorer = AnomalyScorer(pipeline, keep_columns)
+    if isinstance(source, queue.Queue):
+        batches = queue_batches(source, batch_size, max_wait_ms)
+    else:
+        batches = iter_batches(source, batch_size)
+    for batch in batches:
+        start = time.perf_counter()
+        scored = _score_batch(scorer, batch)
+        if scored is None:
+            continue
+        if stats is not None:
+            stats.add(len(scored), time.perf_counter() - start)
+        yield scored
+
+
+def _write_json_lines(frame, stream=sys.stdout):
+    text = frame.to_json(orient="records", lines=True)
+    stream.write(text if text.endswith("\n") else text + "\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("model", help="model name passed to load_model (without .pkl)")
+    parser.add_argument("source", help="CSV or Parquet file, or tcp://host:port to listen on")
+    parser.add_argument("--output", default=None,
+                        help="CSV or Parquet file to write; JSON lines on stdout if omitted")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--max-wait-ms", type=float, default=DEFAULT_MAX_WAIT_MS)
+    parser.add_argument("--keep-columns", nargs="+", default=None)
+    parser.add_argument("--report-every", type=float, default=10.0)
+    parser.add_argument("--connections", type=int, default=None,
+                        help="stop after this many socket connections are closed")
+    parser.add_argument("--compare", action="store_true",
+                        help="also time predict_model on the same batches (file source)")
+    args = parser.parse_args(argv)
+
+    import lazy_imports
+
+    lazy_imports.install()
+    from pycaret.internal.persistence import load_model
+
+    pipeline = load_model(args.model, verbose=False)
+    source = args.source
+    if source.startswith("tcp://"):
+        host, port = source[len("tcp://"):].rsplit(":", 1)
+        source, address = serve_socket(host, int(port), connections=args.connections)
+        print(f"listening on {address[0]}:{address[1]}", file=sys.stderr)
+
+    stats = StreamStats(args.report_every)
+    scored = score_stream(pipeline, source, args.batch_size, args.max_wait_ms,
+                          args.keep_columns, stats)
+    try:
+        if args.output is None:
+            for frame in scored:
+                _write_json_lines(frame)
+        else:
+            with ChunkWriter(args.output) as writer:
+                for frame in scored:
+                    writer.write(frame)
+    except KeyboardInterrupt:
+        pass
+    result = {"stream": stats.summary()}
+
+    if args.compare and not isinstance(source, queue.Queue):
+        from pycaret.anomaly import AnomalyExperiment
+
+        exp = AnomalyExperiment()
+        events = 0
+        start = time.perf_counter()
+        for batch in iter_batches(source, args.batch_size):
+            exp.predict_model(pipeline, data=batch)
+            events += len(batch)
+        elapsed = time.perf_counter() - start
+        result["predict_model"] = {"events": events, "seconds": round(elapsed, 3),
+                                   "events_per_s": round(events / elapsed, 1)}
+    print(json.dumps(result, indent=2), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+"""Async micro-batching inference server
+
+`create_api(best, api_name = 'my_first_api')` writes a POST endpoint that scores
+one request at a time, synchronously. This server keeps the same
+`POST /predict` contract (one JSON record in, `{"prediction": ...}` out) but:
+
+- loads the pipeline once and shares it with every scoring worker,
+- queues requests on an asyncio event loop and fuses the ones that arrive
+  together into a single vectorized `predict_model` call, bounded by
+  `--max-batch-size` and `--max-wait-ms`,
+- runs the batches on a pool of `--workers` threads so the event loop keeps
+  accepting requests while a batch is scored.
+
+`GET /stats` reports the number of requests, batches and the mean batch size.
+Like the code generated by `create_api` it needs `fastapi` and `uvicorn`.
+
+Usage:
+
+`python batch_server.py my_first_pipeline --port 8000 --max-batch-size 64 --max-wait-ms 5`
+
+and, in another terminal, `python load_test.py --url http://127.0.0.1:8000/predict --data new_data.csv`.
+"""
+
+import argparse
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from streaming_predict import experiment_for
+
+# response key of the endpoint written by create_api
+RESPONSE_KEY = "prediction"
+
+
+class MicroBatcher:
+    """Fuse concurrent single-record requests into batched predict calls.
+
+    ``predict_fn`` takes a list of records and returns a list of predictions
+    in the same order. It runs on a thread pool of ``workers`` threads, at
+    most ``workers`` batches are scored at the same time. When a batch fails,
+    its records are scored one by one, so a bad record only fails its own
+    request.
+    """
+
+    def __init__(self, predict_fn, max_batch_size=64, max_wait_ms=5.0, workers=1):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.workers = workers
+        self.requests = 0
+        self.batches = 0
+        self._queue = None
+        self._task = None
+        self._executor = None
+        self._slots = None
+        self._pending = set()
+
+    async def start(self):
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        self._task = asyncio.create_task(self._collect())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    async def submit(self, record):
+        """Queue one record and wait for its prediction."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((record, future))
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._slots.acquire()
+            task = asyncio.create_task(self._score(batch))
+            self._pending.add(task)
+            task.add_done_callback(self._pending.discard)
+
+    def _predict_each(self, records):
+        """Score ``records`` one at a time, as ``[(prediction, exception)]``."""
+        results = []
+        for record in records:
+            try:
+                results.append((self.predict_fn([record])[0], None))
+            except Exception as ex:
+                results.append((None, ex))
+        return results
+
+    async def _score(self, batch):
+        loop = asyncio.get_running_loop()
+        records = [record for record, _ in batch]
+        try:
+            try:
+                predictions = await loop.run_in_executor(self._executor, self.predict_fn, records)
+                results = [(prediction, None) for prediction in predictions]
+            except Exception:
+                # a bad record fails the whole fused call: find it, so only
+                # its own request gets the error
+                results = await loop.run_in_executor(self._executor, self._predict_each, records)
+            for (_, future), (prediction, error) in zip(batch, results):
+                if future.done():
+                    continue
+                if error is None:
+                    future.set_result(prediction)
+                else:
+                    future.set_exception(error)
+        except Exception as ex:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(ex)
+        finally:
+            self.requests += len(batch)
+            self.batches += 1
+            self._slots.release()
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "mean_batch_size": round(self.requests / self.batches, 2) if self.batches else 0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "workers": self.workers,
+        }
+
+
+def make_predict_fn(pipeline, experiment=None):
+    """Return a function scoring a list of records with ``predict_model``."""
+    experiment = experiment or experiment_for(pipeline)
+
+    def predict(records):
+        data = pd.DataFrame.from_records(records)
+        predictions = experiment.predict_model(pipeline, data=data, verbose=False)
+        return predictions["prediction_label"].tolist()
+
+    return predict
+
+
+def create_app(pipeline, max_batch_size=64, max_wait_ms=5.0, workers=1):
+    """Build the FastAPI application serving ``pipeline``."""
+    from contextlib import asynccontextmanager
+
+    from fastapi import Body, FastAPI, HTTPException
+
+    batcher = MicroBatcher(make_predict_fn(pipeline), max_batch_size, max_wait_ms, workers)
+
+    @asynccontextmanager
+    async def lifespan(app):
+        await batcher.start()
+        yield
+        await batcher.stop()
+
+    app = FastAPI(lifespan=lifespan)
+    app.state.batcher = batcher
+
+    @app.post("/predict")
+    async def predict(data: dict = Body(...)):
+        try:
+            prediction = await batcher.submit(data)
+        except Exception as ex:
+            raise HTTPException(status_code=422, detail=f"{type(ex).__name__}: {ex}")
+        return {RESPONSE_KEY: prediction}
+
+    @app.get("/stats")
+    async def stats():
+        return batcher.stats()
+
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("model", help="model name passed to load_model (without .pkl)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch-size", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--workers", type=int, default=1,
+                        help="threads scoring batches concurrently")
+    args = parser.parse_args(argv)
+
+    import lazy_imports
+
+    lazy_imports.install()
+    import uvicorn
+    from pycaret.internal.persistence import load_model
+
+    start = time.perf_counter()
+    pipeline = load_model(args.model, verbose=False)
+    print(f"Loaded {args.model} in {time.perf_counter() - start:.2f}s")
+    app = create_app(pipeline, args.max_batch_size, args.max_wait_ms, args.workers)
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
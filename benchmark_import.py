@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""Benchmark - Import time
+
+Measures the cold start of the pycaret entry points used by the tutorials
+(`from pycaret.regression import *`, `from pycaret.classification import *`,
+...) in fresh interpreters, with and without the deferred imports of
+`lazy_imports.py`, and fails when the deferred cold start goes over a budget.
+
+For every statement the harness records:
+
+- the median wall time of the import over `--runs` fresh processes (after one
+  discarded run that warms the OS file cache),
+- the number of modules loaded and which `DEFERRED_MODULES` were actually
+  left unexecuted,
+- the time saved by the deferred imports and the deferred / eager ratio.
+
+The process exits with status 1, so it can gate CI, when for a statement:
+
+- the median deferred import takes more than `--max-ratio` times the median
+  eager import measured on the same machine,
+- one of its `EXPECTED_DEFERRED` modules was executed at import time,
+- the median deferred import is over `--budget` seconds, when given.
+
+Usage:
+
+`python benchmark_import.py --statement "from pycaret.regression import *" --max-ratio 0.9 --output bench_import.json`
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from benchmark_regression import write_results
+
+DEFAULT_STATEMENTS = [
+    "from pycaret.regression import *",
+    "from pycaret.classification import *",
+    # model loading of the batch scoring scripts
+    "from pycaret.internal.persistence import load_model",
+]
+
+# maximum median cold start with the deferred imports, as a fraction of the
+# eager cold start measured in the same run
+DEFAULT_MAX_RATIO = 0.9
+
+_PLOTTING = ("matplotlib.pyplot", "plotly.express", "scikitplot", "statsmodels.formula.api")
+# modules each statement must leave unexecuted with the deferred imports
+EXPECTED_DEFERRED = {
+    "from pycaret.regression import *": _PLOTTING,
+    "from pycaret.classification import *": _PLOTTING,
+    "from pycaret.internal.persistence import load_model": ("matplotlib.pyplot",),
+}
+
+_CHILD = """
+import json, sys, time
+sys.path.insert(0, {repo!r})
+start = time.perf_counter()
+if {deferred!r}:
+    import lazy_imports
+    lazy_imports.install()
+exec({statement!r})
+seconds = time.perf_counter() - start
+deferred = []
+if {deferred!r}:
+    deferred = lazy_imports.deferred_modules()
+print(json.dumps({{"seconds": seconds, "modules": len(sys.modules), "deferred": deferred}}))
+"""
+
+
+def time_import(statement, deferred=False, python=None):
+    """Run ``statement`` in a fresh interpreter and return its timing record."""
+    code = _CHILD.format(
+        repo=os.path.dirname(os.path.abspath(__file__)), deferred=deferred, statement=statement
+    )
+    out = subprocess.run(
+        [python or sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def measure(statement, runs=5, python=None):
+    """Median cold start of ``statement``, eager and with the deferred imports."""
+    record = {"statement": statement, "runs": runs}
+    time_import(statement, python=python)  # warm the file cache
+    for mode, deferred in (("eager", False), ("deferred", True)):
+        results = [time_import(statement, deferred, python) for _ in range(runs)]
+        record[f"{mode}_s"] = round(statistics.median(r["seconds"] for r in results), 4)
+        record[f"{mode}_modules"] = results[-1]["modules"]
+        if deferred:
+            record["deferred_modules"] = results[-1]["deferred"]
+    record["saved_s"] = round(record["eager_s"] - record["deferred_s"], 4)
+    record["ratio"] = round(record["deferred_s"] / record["eager_s"], 4)
+    return record
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--statement", nargs="+", default=DEFAULT_STATEMENTS,
+                        help="import statements to time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-ratio", type=float, default=DEFAULT_MAX_RATIO,
+                        help="maximum deferred / eager median cold start")
+    parser.add_argument("--budget", type=float, default=None,
+                        help="optional maximum median cold start in seconds with deferred imports")
+    parser.add_argument("--python", default=None, help="interpreter to benchmark")
+    parser.add_argument("--output", default=None, help="optional JSON file for the results")
+    args = parser.parse_args(argv)
+
+    records = [measure(s, runs=args.runs, python=args.python) for s in args.statement]
+    failures = []
+    for r in records:
+        print("{statement:<45}{eager_s:>8.3f}s eager {deferred_s:>8.3f}s deferred "
+              "({saved_s:+.3f}s, x{ratio:.2f}, {n} modules deferred)".format(
+                  n=len(r["deferred_modules"]), **r))
+        if r["ratio"] > args.max_ratio:
+            failures.append(f"{r['statement']}: deferred is x{r['ratio']:.2f} of eager "
+                            f"(max x{args.max_ratio})")
+        loaded = [m for m in EXPECTED_DEFERRED.get(r["statement"], ())
+                  if m not in r["deferred_modules"]]
+        if loaded:
+            failures.append(f"{r['statement']}: no longer deferred: {', '.join(loaded)}")
+        if args.budget is not None and r["deferred_s"] > args.budget:
+            failures.append(f"{r['statement']}: {r['deferred_s']:.3f}s over the "
+                            f"{args.budget}s budget")
+    if args.output:
+        write_results(args.output, "import", records, runs=args.runs,
+                      max_ratio=args.max_ratio, budget=args.budget)
+    if failures:
+        print("\n".join(failures))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""Benchmark - Regression
+
+Times every stage of the workflow shown in tutorial_regression.py as a
+separate measured case:
+
+### **Setup** ➡️ **Compare Models** ➡️ **Create Model** ➡️ **Tune Model** ➡️ **Prediction** ➡️ **Save Model**
+
+For each stage the harness records wall time, CPU time (this process plus its
+worker processes), peak RSS of the process tree and row throughput, and writes
+everything to a JSON file so nightly runs can be compared over time.
+
+The dataset size is configurable: `get_data('insurance')` is tiled to the
+requested number of rows so scaling curves are visible.
+
+Usage:
+
+`python benchmark_regression.py --rows 1000000 --output bench_regression.json`
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import tempfile
+import threading
+import time
+
+import pandas as pd
+import psutil
+
+# stages of tutorial_regression.py, in the order they run
+STAGES = ["setup", "compare_models", "create_model", "tune_model", "predict_model", "save_model"]
+
+
+def tile_dataset(data, n_rows):
+    """Repeat the rows of ``data`` until the frame has exactly ``n_rows`` rows."""
+    if n_rows is None or n_rows == len(data):
+        return data.copy()
+    reps = -(-n_rows // len(data))  # ceil division
+    tiled = pd.concat([data] * reps, ignore_index=True)
+    return tiled.iloc[:n_rows].reset_index(drop=True)
+
+
+def _process_tree(proc):
+    try:
+        return [proc] + proc.children(recursive=True)
+    except psutil.Error:
+        return [proc]
+
+
+def _cpu_by_pid(proc):
+    cpu = {}
+    for p in _process_tree(proc):
+        try:
+            t = p.cpu_times()
+            cpu[p.pid] = t.user + t.system
+        except psutil.Error:
+            pass
+    return cpu
+
+
+class PeakRSSSampler(threading.Thread):
+    """Background thread sampling the RSS of this process and its children.
+
+    psutil only reports the current RSS, so the peak of a stage is
+    approximated by polling every ``interval`` seconds.
+    """
+
+    def __init__(self, interval=0.01):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = 0
+        self._proc = psutil.Process()
+        self._stop_event = threading.Event()
+
+    def _sample(self):
+        rss = 0
+        for p in _process_tree(self._proc):
+            try:
+                rss += p.memory_info().rss
+            except psutil.Error:
+                pass
+        self.peak = max(self.peak, rss)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self._sample()
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self._sample()
+        return self.peak
+
+
+def measure(name, fn, rows=None, **extra):
+    """Run ``fn()`` and return ``(result, record)`` with the stage measurements.
+
+    ``rows`` is the number of rows the stage processed; it is used to
+    compute the throughput. Extra keyword arguments are stored verbatim in
+    the record.
+    """
+    proc = psutil.Process()
+    sampler = PeakRSSSampler()
+    cpu_start = _cpu_by_pid(proc)
+    sampler.start()
+    wall_start = time.perf_counter()
+    try:
+        result = fn()
+    finally:
+        wall = time.perf_counter() - wall_start
+        peak = sampler.stop()
+    cpu_end = _cpu_by_pid(proc)
+    cpu = sum(v - cpu_start.get(pid, 0.0) for pid, v in cpu_end.items())
+
+    record = {
+        "stage": name,
+        "wall_time_s": round(wall, 4),
+        "cpu_time_s": round(cpu, 4),
+        "peak_rss_mb": round(peak / 2**20, 2),
+        "rows": rows,
+        "rows_per_s": round(rows / wall, 2) if rows and wall > 0 else None,
+    }
+    record.update(extra)
+    return result, record
+
+
+def environment_info():
+    """Describe the machine and library versions the benchmark ran on."""
+    import pycaret
+    import sklearn
+
+    return {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "total_memory_mb": round(psutil.virtual_memory().total / 2**20, 2),
+        "pycaret": pycaret.__version__,
+        "sklearn": sklearn.__version__,
+        "pandas": pd.__version__,
+    }
+
+
+def write_results(path, benchmark, records, **params):
+    """Write the stage records, run parameters and environment to ``path`` as JSON."""
+    payload = {
+        "benchmark": benchmark,
+        "environment": environment_info(),
+        "params": params,
+        "stages": records,
+    }
+    with open(path, "w") as f:
+        json.dump(payload, f, indent=2, default=str)
+    return payload
+
+
+def run_benchmark(
+    data,
+    target="charges",
+    model="catboost",
+    compare_include=None,
+    stages=None,
+    session_id=123,
+    model_dir=None,
+):
+    """Run the regression workflow on ``data`` and measure each stage.
+
+    Stages that depend on a skipped stage fall back to the cheapest
+    equivalent (e.g. ``tune_model`` without ``create_model`` tunes a fresh
+    ``create_model(model)`` that is not measured). The model is not trained
+    at all when no selected stage uses it.
+    """
+    from pycaret.regression import RegressionExperiment
+
+    stages = stages or STAGES
+    records = []
+    exp = RegressionExperiment()
+
+    _, record = measure(
+        "setup",
+        lambda: exp.setup(data, target=target, session_id=session_id, verbose=False),
+        rows=len(data),
+    )
+    if "setup" in stages:
+        records.append(record)
+
+    n_train = len(exp.get_config("X_train"))
+    stages_using_model = {"tune_model", "predict_model", "save_model"}
+
+    if "compare_models" in stages:
+        _, record = measure(
+            "compare_models",
+            lambda: exp.compare_models(include=compare_include, verbose=False),
+            rows=n_train,
+            include=compare_include,
+        )
+        records.append(record)
+
+    if "create_model" in stages:
+        best, record = measure(
+            "create_model",
+            lambda: exp.create_model(model, verbose=False),
+            rows=n_train,
+            model=model,
+        )
+        records.append(record)
+    elif stages_using_model & set(stages):
+        best = exp.create_model(model, verbose=False)
+
+    if "tune_model" in stages:
+        _, record = measure(
+            "tune_model",
+            lambda: exp.tune_model(best, verbose=False),
+            rows=n_train,
+            model=model,
+        )
+        records.append(record)
+
+    if "predict_model" in stages:
+        new_data = data.drop(target, axis=1)
+        _, record = measure(
+            "predict_model",
+            lambda: exp.predict_model(best, data=new_data, verbose=False),
+            rows=len(new_data),
+        )
+        records.append(record)
+
+    if "save_model" in stages:
+        model_dir = model_dir or tempfile.mkdtemp(prefix="pycaret_bench_")
+        model_path = os.path.join(model_dir, "my_first_pipeline")
+        _, record = measure(
+            "save_model",
+            lambda: exp.save_model(best, model_path, verbose=False),
+            rows=len(data),
+        )
+        record["file_size_mb"] = round(os.path.getsize(model_path + ".pkl") / 2**20, 2)
+        records.append(record)
+
+    return records
+
+
+def load_data(path=None):
+    """Load the benchmark dataset from ``path`` or from the pycaret dataset module."""
+    if path:
+        return pd.read_parquet(path) if path.endswith(".parquet") else pd.read_csv(path)
+    from pycaret.datasets import get_data
+
+    return get_data("insurance", verbose=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=None,
+                        help="tile the dataset to this many rows (default: original size)")
+    parser.add_argument("--data", default=None,
+                        help="CSV/Parquet file to use instead of get_data('insurance')")
+    parser.add_argument("--target", default="charges")
+    parser.add_argument("--model", default="catboost",
+                        help="estimator id for create_model/tune_model")
+    parser.add_argument("--compare-include", nargs="+", default=None,
+                        help="estimator ids passed to compare_models(include=...)")
+    parser.add_argument("--stages", nargs="+", default=STAGES, choices=STAGES)
+    parser.add_argument("--session-id", type=int, default=123)
+    parser.add_argument("--output", default="bench_regression.json")
+    args = parser.parse_args(argv)
+
+    data = tile_dataset(load_data(args.data), args.rows)
+    records = run_benchmark(
+        data,
+        target=args.target,
+        model=args.model,
+        compare_include=args.compare_include,
+        stages=args.stages,
+        session_id=args.session_id,
+    )
+    write_results(
+        args.output,
+        "regression",
+        records,
+        rows=len(data),
+        model=args.model,
+        compare_include=args.compare_include,
+        session_id=args.session_id,
+    )
+    for r in records:
+        print("{stage:<16}{wall_time_s:>10.3f}s wall {cpu_time_s:>10.3f}s cpu "
+              "{peak_rss_mb:>10.1f} MB".format(**r))
+    print("Results written to {}".format(args.output))
+
+
+if __name__ == "__main__":
+    main()
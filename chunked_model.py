@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+"""Chunked, compressed model format with memory-mapped arrays
+
+`save_model(best, 'my_first_pipeline')` writes the whole pipeline as one
+pickle. For the ensembles of the tutorials (`stack_models`, `blend_models`,
+`ensemble_model(dt, method = 'Bagging')`, random forests, ...) that file runs
+to hundreds of MB, and `load_model` reads and unpickles it on a single thread.
+
+`save_model` of this module writes a `<model_name>.pcm` directory instead:
+
+- the fitted members of the final estimator (`estimators_`,
+  `final_estimator_`) are pickled in separate chunks, the rest of the
+  pipeline in chunk 0 with references to them,
+- NumPy arrays larger than `min_array_bytes` are taken out of the pickles
+  (pickle protocol 5 out-of-band buffers) and stored after them in the chunk
+  file, 64-byte aligned,
+- every array is compressed with a fast codec (zstd or lz4 when installed,
+  zlib level 1 otherwise); arrays that do not shrink by at least 10% are kept
+  uncompressed and memory-mapped on load instead of read,
+- `load_model` loads the chunks on a thread pool (file reads and
+  decompression release the GIL) and then rebuilds the pipeline.
+
+`manifest.json` describes the chunks. `benchmark` compares file size and load
+time with the joblib pickle written by pycaret's `save_model`.
+
+Usage:
+
+```
+import chunked_model
+
+chunked_model.save_model(stacker, 'my_stacker')
+loaded = chunked_model.load_model('my_stacker')
+```
+
+`python chunked_model.py benchmark my_stacker --output bench_chunked.json`
+"""
+
+import argparse
+import io
+import json
+import mmap
+import os
+import pickle
+import shutil
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+FORMAT = "pycaret-chunked"
+VERSION = 1
+ALIGNMENT = 64
+# arrays that do not compress below this ratio are stored raw and memory-mapped
+MIN_COMPRESSION = 0.9
+
+
+def _zlib():
+    import zlib
+
+    return (lambda data, level: zlib.compress(data, 1 if level is None else level),
+            lambda data: bytearray(zlib.decompress(data)))
+
+
+def _lz4():
+    import lz4.frame
+
+    return (lambda data, level: lz4.frame.compress(data, compression_level=level or 0),
+            lambda data: lz4.frame.decompress(data, return_bytearray=True))
+
+
+def _zstd():
+    import zstandard
+
+    return (lambda data, level: zstandard.compress(data, 3 if level is None else level),
+            lambda data: bytearray(zstandard.decompress(data)))
+
+
+# codec name -> (module to import, factory of (compress, decompress))
+CODECS = {"zstd": ("zstandard", _zstd), "lz4": ("lz4", _lz4), "zlib": ("zlib", _zlib)}
+
+
+def resolve_codec(codec="auto"):
+    """Name of the codec to use: ``auto`` picks zstd, lz4 then zlib, whichever is installed."""
+    import importlib.util
+
+    if codec is None or codec == "zlib":
+        return codec
+    if codec == "auto":
+        return next(
+            name for name, (module, _) in CODECS.items()
+            if importlib.util.find_spec(module) is not None
+        )
+    if codec not in CODECS:
+        raise ValueError(f"codec must be one of auto, None, {', '.join(CODECS)}.")
+    from pycaret.utils._dependencies import _check_soft_dependencies
+
+    _check_soft_dependencies(CODECS[codec][0], extra=None, severity="error")
+    return codec
+
+
+def _final_estimator(model):
+    return model.steps[-1][1] if hasattr(model, "steps") else model
+
+
+def ensemble_members(model):
+    """Fitted sub-estimators of the model's final estimator, in a stable order."""
+    estimator = _final_estimator(model)
+    members, seen = [], set()
+    for attr in ("estimators_", "final_estimator_"):
+        value = getattr(estimator, attr, None)
+        if value is None:
+            continue
+        if isinstance(value, np.ndarray):
+            items = value.ravel().tolist()
+        elif isinstance(value, (list, tuple)):
+            items = list(value)
+        else:
+            items = [value]
+        for item in items:
+            # skip placeholders such as 'drop' / 'passthrough'
+            if hasattr(item, "fit") and id(item) not in seen:
+                seen.add(id(item))
+                members.append(item)
+    return members
+
+
+class _RootPickler(pickle.Pickler):
+    """Pickler replacing the ensemble members by references to their chunk."""
+
+    def __init__(self, file, members, **kwargs):
+        super().__init__(file, protocol=5, **kwargs)
+        self._members = {id(m): i for i, m in enumerate(members)}
+
+    def persistent_id(self, obj):
+        i = self._members.get(id(obj))
+        return None if i is None else ("member", i)
+
+
+class _RootUnpickler(pickle.Unpickler):
+    def __init__(self, file, members, **kwargs):
+        super().__init__(file, **kwargs)
+        self._members = members
+
+    def persistent_load(self, pid):
+        kind, i = pid
+        if kind != "member":
+            raise pickle.UnpicklingError(f"Unknown persistent id {pid!r}.")
+        return self._members[i]
+
+
+def _dump(obj, min_array_bytes, members=None):
+    """Pickle ``obj`` with large buffers out-of-band. Returns ``(skeleton, buffers)``."""
+    buffers = []
+
+    def callback(buffer):
+        if buffer.raw().nbytes < min_array_bytes:
+            return True  # small: keep in-band
+        buffers.append(buffer)
+        return False
+
+    file = io.BytesIO()
+    if members is None:
+        pickle.Pickler(file, protocol=5, buffer_callback=callback).dump(obj)
+    else:
+        _RootPickler(file, members, buffer_callback=callback).dump(obj)
+    return file.getvalue(), buffers
+
+
+def _pad(offset):
+    return -offset % ALIGNMENT
+
+
+def _write_chunk(path, skeleton, buffers, codec, level, pool):
+    """Write one chunk file, returns its manifest entry."""
+    compress = CODECS[codec][1]()[0] if codec else None
+
+    def encode(buffer):
+        raw = buffer.raw()
+        if compress is None:
+            return None, raw
+        packed = compress(raw, level)
+        if len(packed) > MIN_COMPRESSION * raw.nbytes:
+            return None, raw
+        return codec, packed
+
+    encoded = list(pool.map(encode, buffers))
+    entries = []
+    with open(path, "wb") as f:
+        f.write(skeleton)
+        offset = len(skeleton)
+        for buffer, (buffer_codec, data) in zip(buffers, encoded):
+            f.write(b"\0" * _pad(offset))
+            offset += _pad(offset)
+            nbytes = data.nbytes if isinstance(data, memoryview) else len(data)
+            f.write(data)
+            entries.append({"offset": offset, "stored": nbytes,
+                            "nbytes": buffer.raw().nbytes, "codec": buffer_codec})
+            offset += nbytes
+    return {"file": os.path.basename(path), "skeleton": len(skeleton), "buffers": entries}
+
+
+def save_model(model, model_name, codec="auto", level=None, chunks=None,
+               min_array_bytes=1 << 16, n_jobs=None, verbose=True):
+    """
+    Save ``model`` in the chunked format, in the ``<model_name>.pcm`` directory.
+
+
+    model: object
+        Trained model or pipeline, e.g. the output of ``finalize_model``.
+
+
+    model_name: str
+        Name of the directory, ``.pcm`` is appended.
+
+
+    codec: str, default = 'auto'
+        'zstd', 'lz4', 'zlib' or None (no compression, every array is
+        memory-mapped on load). 'auto' picks zstd, lz4 then zlib, whichever is
+        installed.
+
+
+    level: int, default = None
+        Compression level of the codec. None uses a fast default.
+
+
+    chunks: int, default = None
+        Number of chunks the ensemble members are split into. None uses the
+        number of CPUs.
+
+
+    min_array_bytes: int, default = 65536
+        Arrays smaller than this stay inside the pickles.
+
+
+    n_jobs: int, default = None
+        Threads compressing the arrays. None uses the number of CPUs.
+
+
+    verbose: bool, default = True
+        Success message is not printed when verbose is set to False.
+
+
+    Returns:
+        Tuple of the model and the directory it was written to.
+
+    """
+    codec = resolve_codec(codec)
+    path = f"{model_name}.pcm"
+    members = ensemble_members(model)
+    n_chunks = min(len(members), chunks or os.cpu_count() or 1)
+    groups = [list(range(k, len(members), n_chunks)) for k in range(n_chunks)]
+
+    tmp = path + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    manifest = {"format": FORMAT, "version": VERSION, "codec": codec,
+                "n_members": len(members), "chunks": []}
+    with ThreadPoolExecutor(max_workers=n_jobs or os.cpu_count()) as pool:
+        parts = [(_dump(model, min_array_bytes, members), [])]
+        parts += [(_dump([members[i] for i in group], min_array_bytes), group)
+                  for group in groups]
+        for k, ((skeleton, buffers), group) in enumerate(parts):
+            entry = _write_chunk(os.path.join(tmp, f"chunk_{k}.bin"), skeleton, buffers,
+                                 codec, level, pool)
+            entry["members"] = group
+            manifest["chunks"].append(entry)
+    with open(os.path.join(tmp, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=1)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    if verbose:
+        print(f"Transformation Pipeline and Model Successfully Saved to {path}")
+    return model, path
+
+
+def _read_chunk(path, entry, use_mmap):
+    """Unpickle-ready ``(skeleton, buffers)`` of one chunk."""
+    with open(path, "rb") as f:
+        if use_mmap:
+            # copy-on-write: arrays are writable, pages are read lazily
+            data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY))
+        else:
+            data = memoryview(bytearray(f.read()))
+    buffers = []
+    for b in entry["buffers"]:
+        stored = data[b["offset"]:b["offset"] + b["stored"]]
+        if b["codec"] is None:
+            buffers.append(stored)
+        else:
+            buffers.append(CODECS[b["codec"]][1]()[1](stored))
+    return data[:entry["skeleton"]], buffers
+
+
+def load_model(model_name, n_jobs=None, use_mmap=True, verbose=True):
+    """
+    Load a model saved by ``save_model`` of this module.
+
+
+    model_name: str
+        Name of the model, ``.pcm`` is appended.
+
+
+    n_jobs: int, default = None
+        Threads loading the chunks. None uses the number of CPUs.
+
+
+    use_mmap: bool, default = True
+        Memory-map the chunk files. When False they are read in memory.
+
+
+    verbose: bool, default = True
+        Success message is not printed when verbose is set to False.
+
+
+    Returns:
+        The model.
+
+    """
+    path = f"{model_name}.pcm"
+    with open(os.path.join(path, "manifest.json")) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != FORMAT or manifest.get("version") != VERSION:
+        raise ValueError(f"{path} is not a chunked model of version {VERSION}.")
+
+    def load_chunk(k):
+        entry = manifest["chunks"][k]
+        skeleton, buffers = _read_chunk(os.path.join(path, entry["file"]), entry, use_mmap)
+        if k == 0:
+            return skeleton, buffers  # unpickled once all members are loaded
+        return pickle.loads(skeleton, buffers=buffers)
+
+    with ThreadPoolExecutor(max_workers=n_jobs or os.cpu_count()) as pool:
+        loaded = list(pool.map(load_chunk, range(len(manifest["chunks"]))))
+
+    members = [None] * manifest["n_members"]
+    for entry, values in zip(manifest["chunks"][1:], loaded[1:]):
+        for i, member in zip(entry["members"], values):
+            members[i] = member
+    skeleton, buffers = loaded[0]
+    model = _RootUnpickler(io.BytesIO(skeleton), members, buffers=buffers).load()
+    if verbose:
+        print("Transformation Pipeline and Model Successfully Loaded")
+    return model
+
+
+def _size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(d, f)) for d, _, fs in os.walk(path) for f in fs)
+
+
+def _median_time(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def benchmark(model, model_name, codecs=("auto", None), repeat=3):
+    """
+    Compare the chunked format with pycaret's pickle (``joblib.dump``).
+
+
+    model: object
+        Trained model or pipeline.
+
+
+    model_name: str
+        Base name of the files written (``.pkl`` and ``_<codec>.pcm``).
+
+
+    codecs: tuple, default = ('auto', None)
+        Codecs of the chunked format to measure.
+
+
+    repeat: int, default = 3
+        Number of loads timed per format; the median is reported. Files are
+        in the OS cache after the first save, so this measures warm loads.
+
+
+    Returns:
+        List of dicts with the format, size on disk (MB), save time and load
+        time (seconds), and the load time on a single thread.
+
+    """
+    import joblib
+
+    records = []
+    start = time.perf_counter()
+    joblib.dump(model, f"{model_name}.pkl")
+    records.append({
+        "format": "pickle",
+        "size_mb": round(_size(f"{model_name}.pkl") / 2**20, 3),
+        "save_s": round(time.perf_counter() - start, 4),
+        "load_s": round(_median_time(lambda: joblib.load(f"{model_name}.pkl"), repeat), 4),
+    })
+    for codec in codecs:
+        name = f"{model_name}_{resolve_codec(codec) or 'raw'}"
+        start = time.perf_counter()
+        save_model(model, name, codec=codec, verbose=False)
+        save_s = time.perf_counter() - start
+        records.append({
+            "format": f"chunked ({resolve_codec(codec) or 'no compression'})",
+            "size_mb": round(_size(f"{name}.pcm") / 2**20, 3),
+            "save_s": round(save_s, 4),
+            "load_s": round(_median_time(lambda: load_model(name, verbose=False), repeat), 4),
+            "load_1_thread_s": round(_median_time(
+                lambda: load_model(name, n_jobs=1, verbose=False), repeat), 4),
+        })
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert = commands.add_parser("convert", help="convert a pickle saved by save_model")
+    convert.add_argument("model", help="model name passed to load_model (without .pkl)")
+    convert.add_argument("--codec", default="auto")
+    bench = commands.add_parser("benchmark", help="size and load time vs the pickle format")
+    bench.add_argument("model", help="model name passed to load_model (without .pkl)")
+    bench.add_argument("--repeat", type=int, default=3)
+    bench.add_argument("--output", default=None, help="optional JSON file for the results")
+    args = parser.parse_args(argv)
+
+    import joblib
+
+    model = joblib.load(f"{args.model}.pkl")
+    if args.command == "convert":
+        save_model(model, args.model, codec=None if args.codec == "none" else args.codec)
+        return
+    records = benchmark(model, f"{args.model}_bench", repeat=args.repeat)
+    for r in records:
+        print("{format:<28}{size_mb:>10.2f} MB {save_s:>8.3f}s save {load_s:>8.3f}s load".format(**r))
+    if args.output:
+        from benchmark_regression import write_results
+
+        write_results(args.output, "chunked_model", records, model=args.model, repeat=args.repeat)
+
+
+if __name__ == "__main__":
+    main()
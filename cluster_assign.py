@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""Bulk cluster assignment for centroid models
+
+`assign_model(kmeans)` and `predict_model(kmeans, data=data)` transform the
+whole frame, call the model on it and return a copy of the data with a
+string `Cluster` column, which at millions of rows costs more memory and
+time than the assignment itself. `assign_clusters` computes only the labels:
+
+- the rows are preprocessed and assigned chunk by chunk (`chunksize`), so
+  the transformed data never exists in full,
+- the nearest centroid comes from one float32 matrix product per chunk
+  (BLAS sgemm), ``argmax(x . c - |c|^2 / 2)``, with the centroid norms
+  computed once,
+- chunks run on `n_jobs` threads (numpy releases the GIL in BLAS and the
+  reductions); BLAS is limited to one thread per chunk meanwhile,
+- labels are returned as the smallest unsigned integer type holding the
+  number of clusters (uint8 up to 256 clusters), optionally with the
+  distance of every row to its centroid (float32).
+
+Label ``i`` corresponds to ``'Cluster i'`` of `assign_model`. Any model with
+`cluster_centers_` is supported (KMeans, MiniBatchKMeans, Bisecting KMeans,
+...). Because distances are computed in float32, rows nearly equidistant to
+two centroids can get the other one than in float64; the benchmark reports
+how often.
+
+Usage:
+
+```
+from cluster_assign import assign_clusters
+
+labels = assign_clusters(get_current_experiment(), kmeans)
+labels, distances = assign_clusters(get_current_experiment(), kmeans, data = data, return_distance = True)
+```
+
+```
+python cluster_assign.py --rows 10000000 --features 50 --clusters 8
+```
+"""
+
+import argparse
+import collections
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+from threadpoolctl import threadpool_limits
+
+from streaming_predict import iter_chunks
+
+DEFAULT_CHUNKSIZE = 65_536
+
+
+def label_dtype(n_clusters):
+    """Smallest unsigned integer type holding the labels of ``n_clusters`` clusters."""
+    return np.min_scalar_type(max(n_clusters - 1, 0))
+
+
+class CentroidAssigner:
+    """Nearest-centroid kernel for fixed ``centers``, in ``dtype`` (float32)."""
+
+    def __init__(self, centers, dtype=np.float32):
+        centers = np.asarray(centers, dtype=dtype)
+        self.dtype = dtype
+        self.centers_t = np.ascontiguousarray(centers.T)
+        self.half_norms = 0.5 * np.einsum("ij,ij->i", centers, centers)
+        self.labels_dtype = label_dtype(len(centers))
+
+    def assign(self, X, labels=None, distances=None):
+        """Labels (and distances) of the rows of ``X``, written into the given arrays."""
+        X = np.asarray(X, dtype=self.dtype)
+        scores = X @ self.centers_t
+        scores -= self.half_norms
+        best = scores.argmax(axis=1)
+        if labels is None:
+            labels = np.empty(len(X), dtype=self.labels_dtype)
+        labels[:] = best
+        if distances is not None:
+            # |x - c|^2 = |x|^2 - 2 (x . c - |c|^2 / 2)
+            squared = np.einsum("ij,ij->i", X, X) - 2 * scores[np.arange(len(X)), best]
+            np.sqrt(np.maximum(squared, 0), out=distances)
+        return labels
+
+
+def _n_threads(n_jobs):
+    if n_jobs is None or n_jobs < 0:
+        return os.cpu_count() or 1
+    return max(n_jobs, 1)
+
+
+def nearest_centroids(X, centers, chunksize=DEFAULT_CHUNKSIZE, n_jobs=-1,
+                      return_distance=False, dtype=np.float32):
+    """
+    Index of the nearest of ``centers`` for every row of an array.
+
+
+    X: array-like of shape (n_rows, n_features)
+        Rows to assign. float32 input is not copied as a whole.
+
+
+    centers: array-like of shape (n_clusters, n_features)
+        Centroids.
+
+
+    chunksize: int, default = 65536
+        Rows per chunk.
+
+
+    n_jobs: int, default = -1
+        Number of threads; -1 uses all CPUs.
+
+
+    return_distance: bool, default = False
+        Also return the euclidean distance of every row to its centroid.
+
+
+    dtype: numpy dtype, default = np.float32
+        Precision of the distance computation.
+
+
+    Returns:
+        Labels array, or ``(labels, distances)``.
+
+    """
+    assigner = CentroidAssigner(centers, dtype)
+    labels = np.empty(len(X), dtype=assigner.labels_dtype)
+    distances = np.empty(len(X), dtype=dtype) if return_distance else None
+
+    def run(start):
+        stop = start + chunksize
+        assigner.assign(X[start:stop], labels[start:stop],
+                        None if distances is None else distances[start:stop])
+
+    starts = range(0, len(X), chunksize)
+    n_threads = _n_threads(n_jobs)
+    if n_threads == 1:
+        for start in starts:
+            run(start)
+    else:
+        with threadpool_limits(limits=1, user_api="blas"), \
+                ThreadPoolExecutor(n_threads) as executor:
+            list(executor.map(run, starts))
+    return (labels, distances) if return_distance else labels
+
+
+def _centers(model):
+    centers = getattr(model, "cluster_centers_", None)
+    if centers is None:
+        raise TypeError(
+            f"{type(model).__name__} has no cluster_centers_. Bulk assignment "
+            "supports centroid models such as kmeans."
+        )
+    return centers
+
+
+def assign_clusters(
+    exp,
+    model,
+    data=None,
+    chunksize=DEFAULT_CHUNKSIZE,
+    n_jobs=-1,
+    return_distance=False,
+):
+    """
+    Cluster labels of the training data or of new data, as `assign_model` /
+    `predict_model` compute them, without building the labeled frame.
+
+
+    exp: ClusteringExperiment
+        Experiment on which ``setup()`` has been run.
+
+
+    model: fitted estimator
+        Centroid model, e.g. ``create_model('kmeans')``.
+
+
+    data: DataFrame, str, iterator of DataFrames or np.ndarray, default = None
+        Raw data to assign, or anything ``streaming_predict.iter_chunks`` reads
+        (CSV / Parquet path, iterator of chunks). It is preprocessed with the
+        experiment pipeline chunk by chunk. A numpy array is taken as already
+        preprocessed. None assigns the training data, like ``assign_model``.
+
+
+    chunksize: int, default = 65536
+        Rows per chunk.
+
+
+    n_jobs: int, default = -1
+        Number of threads; -1 uses all CPUs.
+
+
+    return_distance: bool, default = False
+        Also return the distance of every row to its centroid.
+
+
+    Returns:
+        Labels array (label ``i`` is ``'Cluster i'``), or
+        ``(labels, distances)``.
+
+    """
+    if isinstance(data, np.ndarray):
+        return nearest_centroids(data, _centers(model), chunksize, n_jobs, return_distance)
+    assigner = CentroidAssigner(_centers(model))
+
+    def run(chunk):
+        X = exp.pipeline.transform(chunk)
+        X = X.to_numpy(dtype=assigner.dtype) if isinstance(X, pd.DataFrame) else X
+        distances = np.empty(len(X), dtype=assigner.dtype) if return_distance else None
+        return assigner.assign(X, distances=distances), distances
+
+    chunks = iter_chunks(exp.X_train if data is None else data, chunksize)
+    n_threads = _n_threads(n_jobs)
+    results = []
+    if n_threads == 1:
+        results = [run(chunk) for chunk in chunks]
+    else:
+        # at most two chunks per thread in flight, for sources read lazily
+        with threadpool_limits(limits=1, user_api="blas"), \
+                ThreadPoolExecutor(n_threads) as executor:
+            pending = collections.deque()
+            for chunk in chunks:
+                pending.append(executor.submit(run, chunk))
+                if len(pending) >= 2 * n_threads:
+                    results.append(pending.popleft().result())
+            results.extend(future.result() for future in pending)
+
+    labels = np.concatenate([r[0] for r in results]) if results else np.empty(
+        0, dtype=assigner.labels_dtype
+    )
+    if not return_distance:
+        return labels
+    return labels, np.concatenate([r[1] for r in results]) if results else np.empty(
+        0, dtype=assigner.dtype
+    )
+
+
+def _blobs(n_rows, n_features, centers, chunksize, rng):
+    """float32 rows around ``centers``, generated chunk by chunk."""
+    X = np.empty((n_rows, n_features), dtype=np.float32)
+    for start in range(0, n_rows, chunksize):
+        stop = min(start + chunksize, n_rows)
+        X[start:stop] = rng.standard_normal((stop - start, n_features), dtype=np.float32)
+        X[start:stop] += centers[rng.integers(len(centers), size=stop - start)]
+    return X
+
+
+def main(argv=None):
+    from sklearn.cluster import KMeans
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--features", type=int, default=50)
+    parser.add_argument("--clusters", type=int, default=8)
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE)
+    parser.add_argument("--n-jobs", type=int, default=-1)
+    parser.add_argument("--check-rows", type=int, default=1_000_000,
+                        help="rows compared with a float64 assignment")
+    parser.add_argument("--seed", type=int, default=123)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    centers = rng.uniform(-3, 3, (args.clusters, args.features)).astype(np.float32)
+    X = _blobs(args.rows, args.features, centers, args.chunksize, rng)
+    model = KMeans(args.clusters, init=centers, n_init=1, max_iter=1).fit(X[:10_000])
+
+    result = {"rows": args.rows, "features": args.features, "clusters": args.clusters,
+              "threads": _n_threads(args.n_jobs)}
+    start = time.perf_counter()
+    labels, distances = nearest_centroids(X, model.cluster_centers_, args.chunksize,
+                                          args.n_jobs, return_distance=True)
+    result["assign_s"] = round(time.perf_counter() - start, 3)
+    start = time.perf_counter()
+    nearest_centroids(X, model.cluster_centers_, args.chunksize, args.n_jobs)
+    result["assign_labels_only_s"] = round(time.perf_counter() - start, 3)
+    result["labels_mb"] = round(labels.nbytes / 2**20, 1)
+    result["distances_mb"] = round(distances.nbytes / 2**20, 1)
+
+    start = time.perf_counter()
+    reference = model.predict(X)
+    result["kmeans_predict_s"] = round(time.perf_counter() - start, 3)
+    result["differs_from_kmeans_predict"] = int((reference != labels).sum())
+
+    check = np.asarray(X[:args.check_rows], dtype=np.float64)
+    exact = nearest_centroids(check, model.cluster_centers_, args.chunksize, 1,
+                              dtype=np.float64)
+    result["float64_check_rows"] = len(check)
+    result["differs_from_float64"] = int((exact != labels[:len(check)]).sum())
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,544 @@
+# -*- coding: utf-8 -*-
+"""Scalable elbow and silhouette analysis for the clustering module
+
+`plot_model(kmeans, plot='elbow')` fits a full KMeans for every k from 2 to
+10 and `plot_model(kmeans, plot='silhouette')` computes the silhouette of
+every row, which needs all n^2 pairwise distances. Neither finishes on tables
+with millions of rows. `analyze_k` computes both curves in one pass over k:
+
+- every k is fitted with `MiniBatchKMeans`, warm-started from the centroids
+  of the previous k plus one centroid drawn with the k-means++ rule, so
+  consecutive fits converge in a few batches,
+- the distortion (within-cluster sum of squares around the cluster means,
+  the `distortion` metric of yellowbrick's elbow plot) is exact, computed by
+  assigning the rows to the centroids chunk by chunk,
+- the silhouette is estimated on `n_repeats` random samples of
+  `sample_size` rows, with a confidence interval from the spread of the
+  sample means; every k is evaluated on the same samples, so the pairwise
+  distances of a sample are computed once for all k,
+- the fits are cached per experiment and shared by `plot_elbow` and
+  `plot_silhouette`; asking for more k later only fits the new ones.
+
+The elbow is located with the kneedle rule (largest gap between the
+normalized curve and its chord), as yellowbrick does with `locate_elbow`.
+
+Usage:
+
+```
+from cluster_count import analyze_k, plot_elbow, plot_silhouette
+
+analyze_k(get_current_experiment()).frame()
+plot_elbow(get_current_experiment())
+plot_silhouette(get_current_experiment(), kmeans)
+```
+
+```
+python cluster_count.py --rows 1000000 --features 20 --centers 6 --reference-rows 50000
+```
+"""
+
+import argparse
+import functools
+import json
+import time
+import weakref
+
+import joblib
+import numpy as np
+import pandas as pd
+from scipy import stats
+from sklearn.cluster import MiniBatchKMeans
+
+DEFAULT_BATCH_SIZE = 4096
+DEFAULT_SAMPLE_SIZE = 5000
+DEFAULT_N_REPEATS = 5
+DEFAULT_CHUNKSIZE = 100_000
+
+
+def assign_labels(X, centers, chunksize=DEFAULT_CHUNKSIZE):
+    """Index of the nearest center of every row, computed chunk by chunk."""
+    centers = np.asarray(centers, dtype=np.float64)
+    center_norms = (centers**2).sum(axis=1)
+    labels = np.empty(len(X), dtype=np.int32)
+    for start in range(0, len(X), chunksize):
+        chunk = np.asarray(X[start:start + chunksize], dtype=np.float64)
+        # |x - c|^2 up to the |x|^2 term, which does not change the argmin
+        labels[start:start + chunksize] = np.argmin(
+            center_norms - 2 * chunk @ centers.T, axis=1
+        )
+    return labels
+
+
+def distortion(X, centers, chunksize=DEFAULT_CHUNKSIZE):
+    """Within-cluster sum of squares around the cluster means, rows assigned to
+    the nearest of ``centers``. One pass, chunk by chunk."""
+    k = len(centers)
+    counts = np.zeros(k)
+    sums = np.zeros((k, X.shape[1]))
+    squares = np.zeros(k)
+    for start in range(0, len(X), chunksize):
+        chunk = np.asarray(X[start:start + chunksize], dtype=np.float64)
+        labels = assign_labels(chunk, centers, chunksize)
+        counts += np.bincount(labels, minlength=k)
+        squares += np.bincount(labels, weights=(chunk**2).sum(axis=1), minlength=k)
+        sums += np.eye(k)[labels].T @ chunk
+    used = counts > 0
+    return float((squares[used] - (sums[used] ** 2).sum(axis=1) / counts[used]).sum())
+
+
+def silhouette_values(X, labelings, block=1024):
+    """Silhouette of every row of ``X`` under each of ``labelings``, as
+    ``sklearn.metrics.silhouette_samples`` with the euclidean metric.
+
+    The pairwise distances are computed once, in blocks of rows, and summed
+    per cluster of every labeling with a single matrix product.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    codes, counts = [], []
+    for labels in labelings:
+        _, code, count = np.unique(labels, return_inverse=True, return_counts=True)
+        codes.append(code)
+        counts.append(count)
+    offsets = np.cumsum([0] + [len(c) for c in counts])
+    onehot = np.zeros((len(X), offsets[-1]))
+    for code, offset in zip(codes, offsets):
+        onehot[np.arange(len(X)), offset + code] = 1
+    norms = (X**2).sum(axis=1)
+    sums = np.empty((len(X), offsets[-1]))
+    for start in range(0, len(X), block):
+        stop = min(start + block, len(X))
+        squared = norms[start:stop, None] - 2 * X[start:stop] @ X.T + norms[None]
+        np.maximum(squared, 0, out=squared)
+        squared[np.arange(stop - start), np.arange(start, stop)] = 0
+        sums[start:stop] = np.sqrt(squared) @ onehot
+
+    rows = np.arange(len(X))
+    values = []
+    for code, count, offset in zip(codes, counts, offsets):
+        cluster_sums = sums[:, offset:offset + len(count)]
+        others = count[code] - 1
+        a = cluster_sums[rows, code] / np.maximum(others, 1)
+        cluster_sums[rows, code] = np.inf
+        b = (cluster_sums / count).min(axis=1)
+        with np.errstate(invalid="ignore"):
+            value = np.nan_to_num((b - a) / np.maximum(a, b))
+        # rows alone in their cluster have a silhouette of 0
+        values.append(np.where(others > 0, value, 0.0))
+    return values
+
+
+def sampled_silhouette(X, labelers, sample_size=DEFAULT_SAMPLE_SIZE,
+                       n_repeats=DEFAULT_N_REPEATS, confidence=0.95, random_state=None):
+    """
+    Silhouette of one or more clusterings estimated on random samples of the
+    rows. All clusterings are evaluated on the same samples, which share the
+    distance computations.
+
+
+    X: np.ndarray
+        Data.
+
+
+    labelers: list of callable
+        Each returns the cluster labels of an array of rows.
+
+
+    sample_size: int, default = 5000
+        Rows per sample. A sample costs ``sample_size ** 2`` distances.
+
+
+    n_repeats: int, default = 5
+        Number of independent samples. The confidence interval is computed
+        from the spread of their means.
+
+
+    confidence: float, default = 0.95
+        Confidence level of the interval.
+
+
+    random_state: int, default = None
+        Seed of the samples.
+
+
+    Returns:
+        One dictionary per labeler with the estimate (``silhouette``), the
+        interval (``low``, ``high``) and the per-row values and labels of
+        the first sample (``values``, ``labels``).
+
+    """
+    rng = np.random.default_rng(random_state)
+    size = min(sample_size, len(X))
+    means = [[] for _ in labelers]
+    first = [None] * len(labelers)
+    for _ in range(n_repeats):
+        rows = np.sort(rng.choice(len(X), size, replace=False))
+        sample = X[rows]
+        labelings = [np.asarray(labels_of(sample)) for labels_of in labelers]
+        valid = [i for i, labels in enumerate(labelings) if len(np.unique(labels)) > 1]
+        values = silhouette_values(sample, [labelings[i] for i in valid]) if valid else []
+        for i, value in zip(valid, values):
+            means[i].append(value.mean())
+            if first[i] is None:
+                first[i] = (value, labelings[i])
+
+    results = []
+    for sample_means, sample in zip(means, first):
+        if not sample_means:
+            results.append({"silhouette": np.nan, "low": np.nan, "high": np.nan,
+                            "values": None, "labels": None})
+            continue
+        estimate = float(np.mean(sample_means))
+        half = np.nan
+        if len(sample_means) > 1:
+            half = stats.t.ppf((1 + confidence) / 2, len(sample_means) - 1) * (
+                np.std(sample_means, ddof=1) / np.sqrt(len(sample_means))
+            )
+        results.append({"silhouette": estimate, "low": estimate - half,
+                        "high": estimate + half, "values": sample[0], "labels": sample[1]})
+    return results
+
+
+def locate_elbow(ks, scores):
+    """k of the largest gap between the normalized decreasing curve and its chord."""
+    ks, scores = np.asarray(ks, dtype=float), np.asarray(scores, dtype=float)
+    if len(ks) < 3 or scores[0] == scores[-1]:
+        return None
+    x = (ks - ks[0]) / (ks[-1] - ks[0])
+    y = (scores - scores[-1]) / (scores[0] - scores[-1])
+    gap = (1 - x) - y
+    best = int(np.argmax(gap))
+    return int(ks[best]) if gap[best] > 0 else None
+
+
+def _next_centers(X, centers, k, rng, n_candidates=10_000):
+    """Add centers up to ``k`` with the k-means++ rule on a sample of the rows."""
+    sample = np.asarray(X[rng.choice(len(X), min(n_candidates, len(X)), replace=False)],
+                        dtype=np.float64)
+    centers = [c for c in centers]
+    nearest = ((sample[:, None, :] - np.asarray(centers)[None]) ** 2).sum(-1).min(axis=1)
+    while len(centers) < k:
+        total = nearest.sum()
+        if total > 0:
+            index = rng.choice(len(sample), p=nearest / total)
+        else:
+            index = rng.integers(len(sample))
+        centers.append(sample[index])
+        nearest = np.minimum(nearest, ((sample - sample[index]) ** 2).sum(axis=1))
+    return np.asarray(centers)
+
+
+class KAnalysis:
+    """Cached fits of a range of k on one dataset.
+
+    ``fits`` maps each k to a dict with the ``centers``, the ``distortion``,
+    the silhouette estimate and interval, the silhouette sample and the
+    ``fit_time`` in seconds.
+    """
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, sample_size=DEFAULT_SAMPLE_SIZE,
+                 n_repeats=DEFAULT_N_REPEATS, chunksize=DEFAULT_CHUNKSIZE,
+                 warm_start=True, random_state=None):
+        self.batch_size = batch_size
+        self.sample_size = sample_size
+        self.n_repeats = n_repeats
+        self.chunksize = chunksize
+        self.warm_start = warm_start
+        self.random_state = random_state
+        self.fits = {}
+
+    def fit(self, X, ks):
+        """Fit the k of ``ks`` not fitted yet, in increasing order."""
+        rng = np.random.default_rng(self.random_state)
+        new = sorted(set(ks) - set(self.fits))
+        for k in new:
+            start = time.perf_counter()
+            previous = [j for j in self.fits if j < k]
+            if self.warm_start and previous:
+                init = _next_centers(X, self.fits[max(previous)]["centers"], k, rng)
+                n_init = 1
+            else:
+                init, n_init = "k-means++", 3
+            model = MiniBatchKMeans(
+                n_clusters=k, init=init, n_init=n_init, batch_size=self.batch_size,
+                random_state=self.random_state,
+            ).fit(X)
+            centers = model.cluster_centers_
+            self.fits[k] = {
+                "centers": centers,
+                "distortion": distortion(X, centers, self.chunksize),
+                "fit_time": time.perf_counter() - start,
+            }
+        if new:
+            # same samples for every k: the distances are computed once
+            labelers = [
+                functools.partial(assign_labels, centers=self.fits[k]["centers"])
+                for k in new
+            ]
+            results = sampled_silhouette(X, labelers, self.sample_size, self.n_repeats,
+                                         random_state=self.random_state)
+            for k, result in zip(new, results):
+                self.fits[k].update(result)
+        return self
+
+    def frame(self):
+        """Distortion, silhouette and its interval, and fit time per k."""
+        return pd.DataFrame(
+            [
+                {"k": k, "Distortion": f["distortion"], "Silhouette": f["silhouette"],
+                 "Silhouette Low": f["low"], "Silhouette High": f["high"],
+                 "Fit Time (s)": f["fit_time"]}
+                for k, f in sorted(self.fits.items())
+            ]
+        ).set_index("k")
+
+    @property
+    def elbow(self):
+        """k at the elbow of the distortion curve, None if there is none."""
+        frame = self.frame()
+        return locate_elbow(frame.index, frame["Distortion"])
+
+
+# fitted analyses per experiment, dropped together with the experiment
+_EXPERIMENT_ANALYSES = weakref.WeakKeyDictionary()
+
+
+def _k_values(k):
+    return list(range(2, k + 1)) if isinstance(k, int) else sorted(k)
+
+
+def analyze_k(
+    exp,
+    k=10,
+    batch_size=DEFAULT_BATCH_SIZE,
+    sample_size=DEFAULT_SAMPLE_SIZE,
+    n_repeats=DEFAULT_N_REPEATS,
+    chunksize=DEFAULT_CHUNKSIZE,
+    warm_start=True,
+    X=None,
+):
+    """
+    Fit the cluster counts ``k`` on the transformed training data of a
+    clustering experiment, reusing the fits cached for the experiment.
+
+
+    exp: ClusteringExperiment
+        Experiment on which ``setup()`` has been run.
+
+
+    k: int or sequence of int, default = 10
+        Cluster counts; an int means 2 to ``k``, as in ``plot_model``.
+
+
+    batch_size: int, default = 4096
+        Batch size of ``MiniBatchKMeans``.
+
+
+    sample_size: int, default = 5000
+        Rows per silhouette sample.
+
+
+    n_repeats: int, default = 5
+        Number of silhouette samples.
+
+
+    chunksize: int, default = 100000
+        Rows assigned at once when computing the distortion.
+
+
+    warm_start: bool, default = True
+        Initialize each k from the centroids of the previous one.
+
+
+    X: array-like, default = None
+        Data to analyze instead of ``exp.X_train_transformed``.
+
+
+    Returns:
+        KAnalysis.
+
+    """
+    if X is None:
+        X = exp.X_train_transformed
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    key = joblib.hash((X, batch_size, sample_size, n_repeats, chunksize, warm_start, exp.seed))
+    analyses = _EXPERIMENT_ANALYSES.setdefault(exp, {})
+    if key not in analyses:
+        analyses[key] = KAnalysis(batch_size, sample_size, n_repeats, chunksize, warm_start,
+                                  random_state=exp.seed)
+    return analyses[key].fit(X, _k_values(k))
+
+
+def _show(fig, name, save):
+    import matplotlib.pyplot as plt
+
+    if save:
+        filename = f"{name}.png" if save is True else f"{save}/{name}.png"
+        fig.savefig(filename, bbox_inches="tight")
+        plt.close(fig)
+        return filename
+    plt.show()
+    return None
+
+
+def plot_elbow(exp, k=10, save=False, **kwargs):
+    """
+    Elbow plot of the distortion, with the sampled silhouette and its
+    confidence interval on a second axis.
+
+
+    exp: ClusteringExperiment
+        Experiment on which ``setup()`` has been run.
+
+
+    k: int or sequence of int, default = 10
+        Cluster counts, as in ``analyze_k``.
+
+
+    save: bool or str, default = False
+        Save the plot as a png (in the directory ``save`` if a str) instead
+        of showing it.
+
+
+    **kwargs:
+        Passed to ``analyze_k``.
+
+
+    Returns:
+        Path of the saved file, or None.
+
+    """
+    import matplotlib.pyplot as plt
+
+    analysis = analyze_k(exp, k, **kwargs)
+    frame = analysis.frame().loc[_k_values(k)]
+    fig, ax = plt.subplots(figsize=(8, 5))
+    ax.plot(frame.index, frame["Distortion"], "o-", color="tab:blue")
+    ax.set_xlabel("k")
+    ax.set_ylabel("distortion score", color="tab:blue")
+    elbow = locate_elbow(frame.index, frame["Distortion"])
+    if elbow is not None:
+        ax.axvline(elbow, linestyle="--", color="black",
+                   label=f"elbow at k = {elbow}, score = {frame.loc[elbow, 'Distortion']:.3f}")
+        ax.legend(loc="center right")
+    right = ax.twinx()
+    right.plot(frame.index, frame["Silhouette"], "s:", color="tab:green")
+    right.fill_between(frame.index, frame["Silhouette Low"], frame["Silhouette High"],
+                       color="tab:green", alpha=0.2)
+    right.set_ylabel("silhouette (sampled)", color="tab:green")
+    right.grid(False)
+    ax.set_title("Distortion Score Elbow for MiniBatchKMeans Clustering")
+    return _show(fig, "Elbow Plot", save)
+
+
+def plot_silhouette(exp, model=None, k=10, save=False, **kwargs):
+    """
+    Silhouette plot of a sample of the rows, clusters from ``model`` (or from
+    the fit of the k with the best silhouette), with the mean silhouette and
+    its confidence interval.
+
+
+    exp: ClusteringExperiment
+        Experiment on which ``setup()`` has been run.
+
+
+    model: fitted estimator, default = None
+        Clustering model with a ``predict`` method, e.g. from ``create_model``.
+        None uses the cached fit of the k with the highest silhouette.
+
+
+    k: int or sequence of int, default = 10
+        Cluster counts analyzed when ``model`` is None.
+
+
+    save: bool or str, default = False
+        Save the plot as a png (in the directory ``save`` if a str) instead
+        of showing it.
+
+
+    **kwargs:
+        Passed to ``analyze_k``.
+
+
+    Returns:
+        Path of the saved file, or None.
+
+    """
+    import matplotlib.pyplot as plt
+
+    if model is None:
+        analysis = analyze_k(exp, k, **kwargs)
+        frame = analysis.frame().loc[_k_values(k)]
+        result = analysis.fits[int(frame["Silhouette"].idxmax())]
+        title = f"MiniBatchKMeans, k = {len(result['centers'])}"
+    else:
+        if not hasattr(model, "predict"):
+            raise TypeError("Plot Type not supported for this model.")
+        X = np.asarray(exp.X_train_transformed)
+        result = sampled_silhouette(
+            X, [model.predict], kwargs.get("sample_size", DEFAULT_SAMPLE_SIZE),
+            kwargs.get("n_repeats", DEFAULT_N_REPEATS), random_state=exp.seed,
+        )[0]
+        title = type(model).__name__
+    values, labels = result["values"], result["labels"]
+    if values is None:
+        raise ValueError("The sampled rows fall in a single cluster.")
+
+    fig, ax = plt.subplots(figsize=(8, 5))
+    lower = 0
+    for i, label in enumerate(np.unique(labels)):
+        cluster = np.sort(values[labels == label])
+        ax.fill_betweenx(np.arange(lower, lower + len(cluster)), 0, cluster,
+                         color=plt.cm.tab10(i % 10), alpha=0.7)
+        ax.text(-0.05, lower + len(cluster) / 2, str(label))
+        lower += len(cluster) + 10
+    ax.axvline(result["silhouette"], linestyle="--", color="red")
+    ax.axvspan(result["low"], result["high"], color="red", alpha=0.15)
+    ax.set_yticks([])
+    ax.set_xlabel("silhouette coefficient values")
+    ax.set_title(
+        f"Silhouette Plot of {title} on {len(values)} sampled rows, "
+        f"mean {result['silhouette']:.3f} [{result['low']:.3f}, {result['high']:.3f}]"
+    )
+    return _show(fig, "Silhouette Plot", save)
+
+
+def main(argv=None):
+    from sklearn.cluster import KMeans
+    from sklearn.datasets import make_blobs
+    from sklearn.metrics import silhouette_score
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--features", type=int, default=20)
+    parser.add_argument("--centers", type=int, default=6)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--sample-size", type=int, default=DEFAULT_SAMPLE_SIZE)
+    parser.add_argument("--reference-rows", type=int, default=0,
+                        help="also time KMeans refits + exact silhouette on this many rows")
+    parser.add_argument("--seed", type=int, default=123)
+    args = parser.parse_args(argv)
+
+    X, _ = make_blobs(args.rows, args.features, centers=args.centers,
+                      random_state=args.seed)
+    start = time.perf_counter()
+    analysis = KAnalysis(sample_size=args.sample_size, random_state=args.seed).fit(
+        X, _k_values(args.k)
+    )
+    result = {"rows": args.rows, "analyze_k_s": round(time.perf_counter() - start, 3),
+              "elbow": analysis.elbow}
+    print(analysis.frame().round(4))
+    if args.reference_rows:
+        rows = X[:args.reference_rows]
+        start = time.perf_counter()
+        reference = {}
+        for k in _k_values(args.k):
+            labels = KMeans(n_clusters=k, random_state=args.seed).fit_predict(rows)
+            reference[k] = silhouette_score(rows, labels)
+        result["reference_rows"] = len(rows)
+        result["reference_s"] = round(time.perf_counter() - start, 3)
+        result["reference_silhouette"] = {k: round(v, 4) for k, v in reference.items()}
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
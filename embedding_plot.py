@@ -0,0 +1,433 @@
+# -*- coding: utf-8 -*-
+"""Subsampled, disk-cached t-SNE / UMAP plots for anomaly and clustering models
+
+`plot_model(iforest, plot = 'tsne')` and `plot_model(kmeans, plot = 'tsne')`
+run a 3d t-SNE over every row of the training data, for every model plotted,
+which takes hours past ~50k rows. `plot_embedding` embeds a bounded sample
+instead:
+
+- at most `max_rows` rows are embedded (5000 by default). Every row an
+  anomaly model flags is kept; the other rows are sampled per label
+  (inliers, or each cluster in proportion to its size, with a floor so that
+  small clusters stay visible),
+- the rows are drawn in a fixed random order derived from `session_id`, so
+  the samples of different models on the same setup mostly overlap,
+- the embedding is Barnes-Hut t-SNE from scikit-learn (`method = 'tsne'`)
+  or UMAP (`method = 'umap'`, requires umap-learn), after a PCA down to 50
+  components for wider data,
+- the coordinates are cached on disk, keyed by a fingerprint of the
+  transformed training data, `max_rows` and the embedding parameters (a
+  larger `max_rows` is a new embedding, not a few placed rows). Re-plotting the
+  same or another model on the same setup reuses them; rows not embedded
+  yet (e.g. the anomalies only the new model flags) are placed at the
+  distance-weighted mean of their nearest embedded neighbours and added to
+  the cache, instead of re-running the embedding.
+
+Placed rows are an approximation of where a full re-run would put them;
+`EmbeddingCache().clear()` drops the cached coordinates.
+
+Usage:
+
+```
+from embedding_plot import plot_embedding
+
+plot_embedding(get_current_experiment(), iforest)
+plot_embedding(get_current_experiment(), histogram)  # same setup: no new embedding
+```
+
+```
+python embedding_plot.py --rows 1000000 --features 10
+```
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from setup_cache import fingerprint_frame
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pycaret_embedding")
+DEFAULT_MAX_ROWS = 5000
+DEFAULT_MIN_PER_LABEL = 50
+DEFAULT_N_NEIGHBORS = 10
+PCA_COMPONENTS = 50
+METHODS = ("tsne", "umap")
+
+
+def sample_order(n_rows, random_state=None):
+    """Random rank of every row; samples take the lowest ranks first."""
+    order = np.empty(n_rows, dtype=np.int64)
+    order[np.random.default_rng(random_state).permutation(n_rows)] = np.arange(n_rows)
+    return order
+
+
+def stratified_sample(labels, max_rows=DEFAULT_MAX_ROWS, keep=None, order=None,
+                      min_per_label=DEFAULT_MIN_PER_LABEL, random_state=None):
+    """
+    Sorted indices of at most ``max_rows`` rows (more if ``keep`` alone has
+    more), sampled per label.
+
+
+    labels: array-like of shape (n_rows,)
+        Strata, e.g. cluster labels.
+
+
+    max_rows: int, default = 5000
+        Size of the sample.
+
+
+    keep: boolean array-like of shape (n_rows,), default = None
+        Rows always in the sample, e.g. the flagged anomalies. They count
+        towards ``max_rows``.
+
+
+    order: array-like of shape (n_rows,), default = None
+        Rank of every row, lowest first. None uses ``sample_order``.
+
+
+    min_per_label: int, default = 50
+        Rows taken from every label (or all its rows if it has fewer),
+        before the rest is split in proportion to the label sizes.
+
+
+    random_state: int, default = None
+        Seed of the order when ``order`` is None.
+
+
+    Returns:
+        numpy array of row indices.
+
+    """
+    labels = np.asarray(labels)
+    order = sample_order(len(labels), random_state) if order is None else np.asarray(order)
+    kept = np.zeros(len(labels), dtype=bool) if keep is None else np.asarray(keep, dtype=bool)
+    rest = np.flatnonzero(~kept)
+    budget = max(max_rows - int(kept.sum()), 0)
+    if len(rest) <= budget:
+        return np.arange(len(labels))
+
+    values, inverse, counts = np.unique(labels[rest], return_inverse=True, return_counts=True)
+    floor = np.minimum(counts, min(min_per_label, budget // len(values)))
+    share = np.floor((budget - floor.sum()) * counts / counts.sum()).astype(np.int64)
+    quota = np.minimum(counts, floor + share)
+    # rows of every label by rank, the first `quota` of each are taken
+    ranked = rest[np.lexsort((order[rest], inverse))]
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    position = np.arange(len(ranked)) - np.repeat(starts, counts)
+    taken = ranked[position < np.repeat(quota, counts)]
+    return np.sort(np.concatenate([np.flatnonzero(kept), taken]))
+
+
+def embed(X, method="tsne", n_components=2, random_state=None, **params):
+    """Embedding of the rows of ``X``, float32 of shape (n_rows, n_components)."""
+    from sklearn.decomposition import PCA
+
+    if method not in METHODS:
+        raise ValueError(f"method must be one of {METHODS}, got {method!r}.")
+    X = np.asarray(X, dtype=np.float32)
+    if X.shape[1] > PCA_COMPONENTS and len(X) > PCA_COMPONENTS:
+        X = PCA(PCA_COMPONENTS, random_state=random_state).fit_transform(X)
+    if method == "umap":
+        from pycaret.utils._dependencies import _check_soft_dependencies
+
+        _check_soft_dependencies("umap", extra="analysis", install_name="umap-learn",
+                                 severity="error")
+        import umap
+
+        reducer = umap.UMAP(n_components=n_components, random_state=random_state, **params)
+    else:
+        from sklearn.manifold import TSNE
+
+        params.setdefault("init", "pca")
+        params.setdefault("learning_rate", "auto")
+        params.setdefault("perplexity", min(30.0, (len(X) - 1) / 3))
+        reducer = TSNE(n_components=n_components, random_state=random_state, **params)
+    return np.asarray(reducer.fit_transform(X), dtype=np.float32)
+
+
+def place(X_embedded, Y, X_new, n_neighbors=DEFAULT_N_NEIGHBORS):
+    """Coordinates of ``X_new`` as the distance-weighted mean of its nearest rows of ``X_embedded`` (at ``Y``)."""
+    from sklearn.neighbors import NearestNeighbors
+
+    n_neighbors = min(n_neighbors, len(X_embedded))
+    distances, neighbors = NearestNeighbors(n_neighbors=n_neighbors).fit(
+        X_embedded).kneighbors(X_new)
+    weights = 1 / np.maximum(distances, 1e-12)
+    weights /= weights.sum(axis=1, keepdims=True)
+    return np.einsum("ij,ijk->ik", weights, Y[neighbors]).astype(np.float32)
+
+
+def embedding_key(data_fingerprint, method, n_components, max_rows, random_state, params):
+    """Cache key of an embedding of at most ``max_rows`` rows of the data with
+    this fingerprint."""
+    h = hashlib.sha256()
+    h.update(data_fingerprint.encode())
+    h.update(joblib.hash((method, n_components, max_rows, random_state, params)).encode())
+    return h.hexdigest()[:32]
+
+
+class EmbeddingCache:
+    """Directory of embeddings, one ``<key>.npz`` with the row indices (sorted)
+    and their coordinates per key."""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def load(self, key):
+        """``(rows, coordinates)`` stored under ``key``, or None."""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as stored:
+            return stored["rows"], stored["coordinates"]
+
+    def store(self, key, rows, coordinates):
+        tmp = self._path(key) + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, rows=rows, coordinates=coordinates)
+        os.replace(tmp, self._path(key))
+
+    def clear(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+
+def embed_rows(X, rows, key, cache, method="tsne", n_components=2, random_state=None,
+               n_neighbors=DEFAULT_N_NEIGHBORS, **params):
+    """
+    Coordinates of the (sorted) ``rows`` of ``X``, from the cache when it has
+    them. Without a cache entry the rows are embedded; rows missing from an
+    entry are placed with ``place`` and added to it.
+
+    Returns ``(coordinates, number of rows embedded or placed)``.
+    """
+    cached = cache.load(key)
+    if cached is None:
+        coordinates = embed(X[rows], method, n_components, random_state, **params)
+        cache.store(key, rows, coordinates)
+        return coordinates, len(rows)
+
+    cached_rows, cached_coordinates = cached
+    missing = np.setdiff1d(rows, cached_rows, assume_unique=True)
+    if len(missing):
+        placed = place(X[cached_rows], cached_coordinates, X[missing], n_neighbors)
+        cached_rows = np.concatenate([cached_rows, missing])
+        cached_coordinates = np.concatenate([cached_coordinates, placed])
+        by_row = np.argsort(cached_rows)
+        cached_rows, cached_coordinates = cached_rows[by_row], cached_coordinates[by_row]
+        cache.store(key, cached_rows, cached_coordinates)
+    return cached_coordinates[np.searchsorted(cached_rows, rows)], len(missing)
+
+
+def _labels(model, X):
+    labels = getattr(model, "labels_", None)
+    if labels is None or len(labels) != len(X):
+        labels = model.predict(X)
+    return np.asarray(labels)
+
+
+def embedding_frame(
+    exp,
+    model,
+    method="tsne",
+    n_components=2,
+    max_rows=DEFAULT_MAX_ROWS,
+    feature_name=None,
+    cache=None,
+    **params,
+):
+    """
+    Embedding of a sample of the training data, labeled by ``model``.
+
+
+    exp: AnomalyExperiment or ClusteringExperiment
+        Experiment on which ``setup()`` has been run.
+
+
+    model: fitted estimator
+        Model from ``create_model``.
+
+
+    method: str, default = 'tsne'
+        'tsne' (scikit-learn Barnes-Hut) or 'umap' (umap-learn).
+
+
+    n_components: int, default = 2
+        2 or 3. Barnes-Hut t-SNE is about three times slower in 3d.
+
+
+    max_rows: int, default = 5000
+        Rows embedded, besides the anomalies flagged beyond it.
+
+
+    feature_name: str, default = None
+        Column of the data shown on hover. None uses the first column.
+
+
+    cache: EmbeddingCache, default = None
+        Cache to use. None uses ``EmbeddingCache()`` in ``~/.cache/pycaret_embedding``.
+
+
+    **params:
+        Passed to ``sklearn.manifold.TSNE`` or ``umap.UMAP``.
+
+
+    Returns:
+        DataFrame with the coordinates (columns 0 .. n_components - 1), the
+        ``Anomaly`` or ``Cluster`` label, the hover ``Feature`` and the
+        position of the row in the training data, with ``attrs`` recording
+        the total number of rows and how many were embedded or placed.
+
+    """
+    from pycaret.utils.generic import MLUsecase
+
+    anomaly = exp._ml_usecase == MLUsecase.ANOMALY
+    X_frame = exp.X_train_transformed
+    X = np.asarray(X_frame)
+    labels = _labels(model, X)
+    rows = stratified_sample(
+        labels, max_rows, keep=labels == 1 if anomaly else None,
+        order=sample_order(len(X), exp.seed),
+    )
+    key = embedding_key(fingerprint_frame(X_frame), method, n_components, max_rows, exp.seed,
+                        params)
+    coordinates, computed = embed_rows(
+        X, rows, key, cache or EmbeddingCache(), method, n_components, exp.seed, **params
+    )
+
+    frame = pd.DataFrame(coordinates)
+    if anomaly:
+        frame["Anomaly"] = labels[rows]
+    else:
+        frame["Cluster"] = [f"Cluster {i}" for i in labels[rows]]
+    # matched by index: the data can hold rows that are not in X_train_transformed
+    feature = exp.data[feature_name or exp.data.columns[0]].loc[X_frame.index]
+    frame["Feature"] = feature.to_numpy()[rows]
+    frame["Row"] = rows
+    frame.attrs.update(rows=len(X), computed=computed)
+    return frame
+
+
+def plot_embedding(exp, model, method="tsne", n_components=2, max_rows=DEFAULT_MAX_ROWS,
+                   feature_name=None, label=False, scale=1, save=False, cache=None,
+                   **params):
+    """
+    Scatter plot of ``embedding_frame``, as ``plot_model(model, plot = 'tsne')``
+    draws it.
+
+
+    exp: AnomalyExperiment or ClusteringExperiment
+        Experiment on which ``setup()`` has been run.
+
+
+    model: fitted estimator
+        Model from ``create_model``.
+
+
+    label: bool, default = False
+        Show the feature values as text on the points.
+
+
+    scale: float, default = 1
+        Size of the figure.
+
+
+    save: bool or str, default = False
+        Save the plot as html (in the directory ``save`` if a str) instead of
+        showing it.
+
+
+    Other parameters are those of ``embedding_frame``.
+
+
+    Returns:
+        Path of the saved file, or None.
+
+    """
+    import plotly.express as px
+
+    frame = embedding_frame(exp, model, method, n_components, max_rows, feature_name,
+                            cache, **params)
+    color = "Anomaly" if "Anomaly" in frame else "Cluster"
+    frame = frame.sort_values(color)
+    target = "Outliers" if color == "Anomaly" else "Clusters"
+    title = (f"{n_components}d {method.upper()} Plot for {target} "
+             f"({len(frame):,} of {frame.attrs['rows']:,} rows)")
+    common = dict(color=color, title=title, opacity=0.7, width=900 * scale,
+                  height=800 * scale)
+    if label:
+        common["text"] = "Feature"
+    else:
+        common["hover_data"] = ["Feature"]
+    if n_components == 3:
+        fig = px.scatter_3d(frame, x=0, y=1, z=2, **common)
+    else:
+        fig = px.scatter(frame, x=0, y=1, **common)
+
+    if save:
+        name = f"{method.upper()}.html"
+        filename = name if save is True else os.path.join(save, name)
+        fig.write_html(filename)
+        return filename
+    fig.show()
+    return None
+
+
+def main(argv=None):
+    import tempfile
+
+    from sklearn.datasets import make_blobs
+
+    from pycaret.anomaly import AnomalyExperiment
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--features", type=int, default=10)
+    parser.add_argument("--fraction", type=float, default=0.001,
+                        help="share of rows the anomaly models flag")
+    parser.add_argument("--max-rows", type=int, default=DEFAULT_MAX_ROWS)
+    parser.add_argument("--n-components", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=123)
+    args = parser.parse_args(argv)
+
+    X, _ = make_blobs(args.rows, args.features, centers=5, random_state=args.seed)
+    data = pd.DataFrame(X, columns=[f"f{i}" for i in range(args.features)])
+    exp = AnomalyExperiment()
+    exp.setup(data, session_id=args.seed, verbose=False)
+    cache = EmbeddingCache(tempfile.mkdtemp())
+
+    result = {"rows": args.rows, "features": args.features}
+    for name in ("iforest", "histogram", "pca", "iforest"):
+        start = time.perf_counter()
+        model = exp.create_model(name, fraction=args.fraction, verbose=False)
+        fit_s = time.perf_counter() - start
+        start = time.perf_counter()
+        frame = embedding_frame(exp, model, n_components=args.n_components,
+                                max_rows=args.max_rows, cache=cache)
+        flagged = int(model.labels_.sum())
+        result.setdefault("runs", []).append({
+            "model": name,
+            "create_model_s": round(fit_s, 3),
+            "embedding_s": round(time.perf_counter() - start, 3),
+            "rows_plotted": len(frame),
+            "embedded_or_placed": frame.attrs["computed"],
+            "anomalies": flagged,
+            "anomalies_plotted": int(frame["Anomaly"].sum()),
+        })
+    print(json.dumps(result, indent=2))
+    shutil.rmtree(cache.cache_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
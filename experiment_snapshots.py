@@ -0,0 +1,501 @@
+# -*- coding: utf-8 -*-
+"""Incremental experiment snapshots with lazy model loading
+
+`save_experiment('my_experiment')` pickles the whole experiment every time,
+and `load_experiment('my_experiment', data=data)` runs `setup` again before
+anything can be used. Experiments grow with every `create_model`,
+`tune_model` or `compare_models` call, so saving along the way rewrites all
+the models each time and reloading pays for `setup` and for every model.
+
+`save_experiment` of this module writes a snapshot store, a directory of
+content-addressed objects plus `manifest.json`:
+
+- the configuration (everything pycaret's `save_experiment` pickles except
+  the model and display containers) is one object, written only when it
+  changed since the previous snapshot,
+- every entry of the model container is stored as its model and its
+  scores / CV metadata, and every leaderboard or score grid of the display
+  container as its own object; entries already in the store are recognized
+  by identity and neither pickled nor written again,
+- the prepared dataset is written once (keyed by its fingerprint), so loading
+  does not need to run `setup`.
+
+`load_experiment` restores the configuration and the display container and
+returns: the models are unpickled only when an entry's `model` (or its
+scores) is first accessed. Passing a `data` different from the one the
+experiment was set up with runs `setup` again, as pycaret does.
+
+Every snapshot is listed by `snapshots` and can be loaded with `snapshot=`.
+Objects are never deleted, a store can be removed as a whole.
+
+Usage:
+
+```
+import experiment_snapshots
+
+experiment_snapshots.save_experiment(s, 'my_experiment_snapshots')
+exp_from_disk = experiment_snapshots.load_experiment('my_experiment_snapshots')
+```
+"""
+
+import datetime
+import hashlib
+import importlib
+import io
+import json
+import os
+import pickle
+import weakref
+
+import cloudpickle
+
+from setup_cache import fingerprint_frame
+
+FORMAT = "pycaret-snapshots"
+VERSION = 1
+MANIFEST = "manifest.json"
+
+# attributes stored as their own objects instead of with the configuration
+_CONTAINERS = ("_master_model_container", "_display_container")
+_DATA = ("data", "test_data")
+_SCALARS = (type(None), bool, int, float, complex, str, bytes)
+
+# experiment -> {id(obj): (obj, key)} of the objects written or loaded, so
+# unchanged entries are not pickled again, and 'state' -> (key of the pickled
+# configuration, key it is stored under). The objects are kept alive while
+# they are tracked, which keeps their ids unique.
+_written = weakref.WeakKeyDictionary()
+# experiment -> {'data' / 'test_data': (frame passed to setup, fingerprint)}.
+# Loaded experiments do not keep the frames, only their fingerprints.
+_origins = weakref.WeakKeyDictionary()
+
+
+class _RefPickler(cloudpickle.CloudPickler):
+    """Pickler replacing attributes of the experiment by references to them.
+
+    Sets are written sorted, so that unchanged objects give the same bytes
+    (and key) whatever their insertion history and the hash seed.
+    """
+
+    def __init__(self, file, refs=None):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._refs = refs or {}
+
+    def persistent_id(self, obj):
+        # the C pickler does not call reducer_override for sets, persistent_id
+        # is called for every object
+        if type(obj) in (set, frozenset):
+            try:
+                return ("set", type(obj) is frozenset, sorted(obj))
+            except TypeError:
+                return None
+        name = self._refs.get(id(obj))
+        return None if name is None else ("state", name)
+
+
+class _RefUnpickler(pickle.Unpickler):
+    def __init__(self, file, refs=None):
+        super().__init__(file)
+        self._refs = refs or {}
+
+    def persistent_load(self, pid):
+        kind, *args = pid
+        if kind == "set":
+            frozen, items = args
+            return frozenset(items) if frozen else set(items)
+        if kind != "state":
+            raise pickle.UnpicklingError(f"Unknown persistent id {pid!r}.")
+        return self._refs[args[0]]
+
+
+def _state_refs(state):
+    """Map ``id`` -> attribute name for the non-scalar attributes of ``state``."""
+    return {id(v): k for k, v in state.items() if not isinstance(v, _SCALARS)}
+
+
+def _key(payload):
+    return hashlib.sha256(payload).hexdigest()[:32]
+
+
+class _Store:
+    """Content-addressed object files of a snapshot directory."""
+
+    def __init__(self, path):
+        self.path = path
+        self.objects = os.path.join(path, "objects")
+
+    def _file(self, key):
+        return os.path.join(self.objects, f"{key}.pkl")
+
+    def has(self, key):
+        return os.path.exists(self._file(key))
+
+    def put(self, payload):
+        """Write ``payload`` unless present. Returns ``(key, bytes written)``."""
+        key = _key(payload)
+        if self.has(key):
+            return key, 0
+        os.makedirs(self.objects, exist_ok=True)
+        tmp = f"{self._file(key)}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(payload)
+        os.replace(tmp, self._file(key))
+        return key, len(payload)
+
+    def get(self, key, refs=None):
+        with open(self._file(key), "rb") as f:
+            return _RefUnpickler(f, refs).load()
+
+    def manifest(self):
+        path = os.path.join(self.path, MANIFEST)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            manifest = json.load(f)
+        if manifest.get("format") != FORMAT:
+            raise ValueError(f"{self.path} is not an experiment snapshot store.")
+        return manifest
+
+    def write_manifest(self, manifest):
+        # written last and atomically: a snapshot exists once it is listed
+        path = os.path.join(self.path, MANIFEST)
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(path + ".tmp", path)
+
+
+class _LazyEntry(dict):
+    """Model container entry unpickled on first access.
+
+    ``entry['model']`` loads the model only, any other access loads the
+    scores and CV metadata. Copying or pickling the entry loads everything
+    and gives a plain dict.
+    """
+
+    def __init__(self, store, keys, refs):
+        super().__init__()
+        self._store = store
+        self._refs = refs
+        # part -> object key, removed once loaded
+        self._pending = {part: key for part, key in keys.items() if key is not None}
+        self._keys = dict(keys)
+
+    @property
+    def loaded(self):
+        return not self._pending
+
+    def _load(self, part):
+        key = self._pending.pop(part, None)
+        if key is not None:
+            value = self._store.get(key, self._refs)
+            dict.update(self, {"model": value} if part == "model" else value)
+
+    def _load_for(self, item):
+        self._load("model" if item == "model" else "meta")
+
+    def _load_all(self):
+        self._load("meta")
+        self._load("model")
+
+    def __getitem__(self, item):
+        self._load_for(item)
+        return dict.__getitem__(self, item)
+
+    def get(self, item, default=None):
+        self._load_for(item)
+        return dict.get(self, item, default)
+
+    def __contains__(self, item):
+        self._load_for(item)
+        return dict.__contains__(self, item)
+
+    def pop(self, item, *default):
+        self._load_for(item)
+        return dict.pop(self, item, *default)
+
+    def __iter__(self):
+        self._load_all()
+        return dict.__iter__(self)
+
+    def __len__(self):
+        self._load_all()
+        return dict.__len__(self)
+
+    def keys(self):
+        self._load_all()
+        return dict.keys(self)
+
+    def values(self):
+        self._load_all()
+        return dict.values(self)
+
+    def items(self):
+        self._load_all()
+        return dict.items(self)
+
+    def copy(self):
+        self._load_all()
+        return dict(dict.items(self))
+
+    def __eq__(self, other):
+        self._load_all()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        self._load_all()
+        return dict.__ne__(self, other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        self._load_all()
+        return dict.__repr__(self)
+
+    def __reduce_ex__(self, protocol):
+        return dict, (self.copy(),)
+
+
+def _dumps(obj, refs=None):
+    file = io.BytesIO()
+    _RefPickler(file, refs).dump(obj)
+    return file.getvalue()
+
+
+def _fingerprint(frame):
+    return None if frame is None else fingerprint_frame(frame)
+
+
+def _track(exp):
+    tracked = _written.get(exp)
+    if tracked is None:
+        tracked = _written[exp] = {}
+    return tracked
+
+
+def _origin_fingerprint(exp, name):
+    """Fingerprint of the ``data`` / ``test_data`` passed to ``setup``, cached by identity."""
+    origins = _origins.setdefault(exp, {})
+    frame = (exp._setup_params or {}).get(name)
+    cached = origins.get(name)
+    if cached is not None and (frame is None or cached[0] is frame):
+        return cached[1]
+    origins[name] = (frame, _fingerprint(frame))
+    return origins[name][1]
+
+
+def save_experiment(exp, path, save_data=True):
+    """
+    Add a snapshot of ``exp`` to the store in ``path``, writing only what
+    changed since the previous snapshot.
+
+
+    exp: experiment object
+        Experiment on which ``setup`` has been run, e.g. the object returned
+        by ``setup``.
+
+
+    path: str
+        Directory of the snapshot store. Created if needed.
+
+
+    save_data: bool, default = True
+        Store the prepared dataset (once per distinct dataset) so that
+        ``load_experiment`` does not need the data nor run ``setup``. When
+        False, the data is not saved, as with pycaret's ``save_experiment``.
+
+
+    Returns:
+        Manifest record of the snapshot (object keys, number of objects and
+        bytes written).
+
+    """
+    store = _Store(path)
+    manifest = store.manifest() or {
+        "format": FORMAT,
+        "version": VERSION,
+        "class": f"{type(exp).__module__}.{type(exp).__qualname__}",
+        "snapshots": [],
+    }
+    tracked = _track(exp)
+    current = {}
+    written = {"objects": 0, "bytes": 0}
+
+    def put(obj, dump):
+        entry = tracked.get(id(obj))
+        if entry is not None and entry[0] is obj:
+            keys = entry[1]
+            if all(store.has(k) for k in (keys.values() if isinstance(keys, dict) else [keys])
+                   if k is not None):
+                current[id(obj)] = entry
+                return keys
+        keys = dump(obj)
+        current[id(obj)] = (obj, keys)
+        return keys
+
+    def write(payload):
+        key, nbytes = store.put(payload)
+        written["objects"] += nbytes > 0
+        written["bytes"] += nbytes
+        return key
+
+    # __getstate__ drops the data, as pycaret's save_experiment does
+    state = exp.__getstate__()
+    for name in _CONTAINERS:
+        state.pop(name, None)
+    refs = _state_refs(state)
+
+    def dump_entry(entry):
+        if isinstance(entry, _LazyEntry):
+            entry._load_all()
+        meta = {k: v for k, v in dict.items(entry) if k != "model"}
+        model = dict.get(entry, "model")
+        return {
+            "meta": write(_dumps(meta, refs)),
+            "model": None if model is None else write(_dumps(model, refs)),
+        }
+
+    payload = _dumps(state)
+    # a configuration unpickled then pickled again does not give the same
+    # bytes, load_experiment records which key they stand for
+    alias = tracked.get("state")
+    if alias is not None and alias[0] == _key(payload) and store.has(alias[1]):
+        state_key = alias[1]
+        current["state"] = alias
+    else:
+        state_key = write(payload)
+
+    record = {
+        "time": datetime.datetime.now().isoformat(timespec="seconds"),
+        "state": state_key,
+        "models": [put(e, dump_entry) for e in exp._master_model_container],
+        "display": [put(d, lambda d: write(_dumps(d, refs)))
+                    for d in exp._display_container],
+    }
+    for name in _DATA:
+        frame = getattr(exp, name, None)
+        # fingerprint of what was passed to setup, to recognize it when loading
+        record[f"{name}_fingerprint"] = _origin_fingerprint(exp, name)
+        record[name] = None
+        if save_data and frame is not None:
+            record[name] = put(frame, lambda f: write(pickle.dumps(
+                f, protocol=pickle.HIGHEST_PROTOCOL)))
+    record.update(written)
+
+    manifest["snapshots"].append(record)
+    store.write_manifest(manifest)
+    tracked.clear()
+    tracked.update(current)
+    return record
+
+
+def snapshots(path):
+    """Manifest records of the snapshots in ``path``, oldest first."""
+    manifest = _Store(path).manifest()
+    if manifest is None:
+        raise FileNotFoundError(f"No experiment snapshots in {path}.")
+    return manifest["snapshots"]
+
+
+def _experiment_class(name):
+    module, _, qualname = name.rpartition(".")
+    return getattr(importlib.import_module(module), qualname)
+
+
+def load_experiment(path, data=None, data_func=None, test_data=None,
+                    preprocess_data=True, snapshot=-1):
+    """
+    Load a snapshot saved with ``save_experiment``. Models are unpickled
+    when first accessed.
+
+
+    path: str
+        Directory of the snapshot store.
+
+
+    data: dataframe-like, default = None
+        Same as in pycaret's ``load_experiment``. None uses the dataset stored
+        with the snapshot. If it is the data the experiment was set up with,
+        the stored prepared dataset is used and ``setup`` does not run.
+
+
+    data_func: Callable[[], DATAFRAME_LIKE], default = None
+        Same as in pycaret's ``load_experiment``.
+
+
+    test_data: dataframe-like, default = None
+        Same as in pycaret's ``load_experiment``.
+
+
+    preprocess_data: bool, default = True
+        When the data passed differs from the one of the snapshot (or was not
+        stored), run ``setup`` on it again. If False, the data is only
+        assigned, see pycaret's ``load_experiment``.
+
+
+    snapshot: int, default = -1
+        Position of the snapshot in ``snapshots(path)``. -1 loads the latest.
+
+
+    Returns:
+        loaded experiment
+
+    """
+    store = _Store(path)
+    manifest = store.manifest()
+    if manifest is None:
+        raise FileNotFoundError(f"No experiment snapshots in {path}.")
+    record = manifest["snapshots"][snapshot]
+    exp_class = _experiment_class(manifest["class"])
+
+    state = store.get(record["state"])
+    exp = exp_class.__new__(exp_class)
+    exp.__dict__.update(state)
+    exp.data = exp.test_data = exp.data_func = None
+    refs = dict(state)
+    exp._master_model_container = [
+        _LazyEntry(store, keys, refs) for keys in record["models"]
+    ]
+    exp._display_container = [store.get(key, refs) for key in record["display"]]
+
+    tracked = _track(exp)
+    tracked["state"] = (_key(_dumps(state)), record["state"])
+    for entry in exp._master_model_container:
+        tracked[id(entry)] = (entry, entry._keys)
+    for frame, key in zip(exp._display_container, record["display"]):
+        tracked[id(frame)] = (frame, key)
+
+    given = {"data": data, "test_data": test_data}
+    stored = data_func is None and record["data"] is not None and all(
+        value is None or _fingerprint(value) == record[f"{name}_fingerprint"]
+        for name, value in given.items()
+    )
+    if stored:
+        for name in _DATA:
+            if record[name] is not None:
+                frame = store.get(record[name])
+                setattr(exp, name, frame)
+                tracked[id(frame)] = (frame, record[name])
+        _origins[exp] = {name: (None, record[f"{name}_fingerprint"]) for name in _DATA}
+    elif data is None and data_func is None:
+        raise ValueError(
+            "The snapshot was saved without data, one of data and data_func must be set."
+        )
+    elif preprocess_data and not (exp._setup_params or {}).get("data_func"):
+        # what pycaret's load_experiment does: setup on the new data, then
+        # restore the saved state over it
+        original = dict(exp.__dict__)
+        setup_params = dict(exp._setup_params or {})
+        setup_params.update(data=data, data_func=data_func, test_data=test_data)
+        exp.setup(**setup_params)
+        for name in ("data", "test_data", "data_func"):
+            original.pop(name)
+        exp.__dict__.update(original)
+        _origins[exp] = {name: (None, _fingerprint(value)) for name, value in given.items()}
+    else:
+        if (data is None) == (data_func is None):
+            raise ValueError("One and only one of data and data_func must be set")
+        exp.data, exp.data_func = data, data_func
+        exp.test_data = test_data
+        exp._setup_params = dict(exp._setup_params or {}, data=data, data_func=data_func,
+                                 test_data=test_data)
+    return exp
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""Timing spans for experiment functions, exportable as a Chrome trace
+
+When `compare_models()` or `tune_model()` is slow, the progress bar does not
+say whether the time goes into preprocessing, fitting, predicting, scoring
+or rendering the grids. `enable()` installs hooks that record nested timing
+spans:
+
+- `api`: `setup`, `create_model`, `compare_models`, `tune_model`,
+  `predict_model`, `plot_model` (and the other public experiment methods
+  listed in `API_METHODS`),
+- `estimator`: every model an API call trains, with its id or class,
+- `fold`: every CV fold scikit-learn fits (in a search `split` and
+  `candidate` are in the span arguments); the compare_models variants of
+  this repository record their folds too,
+- `fit` / `predict`: the pipeline with the estimator; their self time (not
+  spent in child spans) is the estimator itself,
+- `preprocess`: every preprocessing step fitted or applied, by transformer,
+- `score`: metric scoring, `display`: rendering of the grids and monitors.
+
+Spans are appended to a bounded in-memory buffer (`max_events`), which costs
+a few microseconds per span, so tracing can stay on in production runs; when
+it is disabled the hooks are removed. `summary()` aggregates the spans
+(count, total and self time) and `export_chrome_trace()` writes them in the
+Chrome trace event format, to open in `chrome://tracing` or Perfetto.
+
+Folds run by joblib worker processes (`n_jobs` other than 1 on a multi-core
+machine) are not recorded, only the span of the call that dispatched them.
+
+Usage:
+
+```
+import experiment_trace
+
+experiment_trace.enable()
+best = compare_models()
+experiment_trace.summary()
+experiment_trace.export_chrome_trace('compare_models_trace.json')
+```
+"""
+
+import collections
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+DEFAULT_MAX_EVENTS = 1_000_000
+
+API_METHODS = (
+    "setup",
+    "create_model",
+    "compare_models",
+    "tune_model",
+    "ensemble_model",
+    "blend_models",
+    "stack_models",
+    "finalize_model",
+    "predict_model",
+    "plot_model",
+    "evaluate_model",
+    "interpret_model",
+)
+
+
+class Tracer:
+    """Bounded buffer of ``(name, category, start_ns, end_ns, thread, args)`` spans."""
+
+    def __init__(self, max_events=DEFAULT_MAX_EVENTS):
+        self.events = collections.deque(maxlen=max_events)
+        self.origin = time.perf_counter_ns()
+        self.pid = os.getpid()
+
+    def record(self, name, cat, start, end, args):
+        self.events.append((name, cat, start, end, threading.get_ident(), args))
+
+    def clear(self):
+        self.events.clear()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "cat", "args", "start")
+
+    def __init__(self, tracer, name, cat, args):
+        self.tracer, self.name, self.cat, self.args = tracer, name, cat, args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.name, self.cat, self.start, time.perf_counter_ns(), self.args)
+        return False
+
+
+_NULL_SPAN = contextlib.nullcontext()
+_tracer = None
+# (owner, attribute, original or _MISSING) of the installed hooks
+_patches = []
+_MISSING = object()
+
+
+def span(name, cat="user", **args):
+    """Context manager timing a block as a span. Does nothing while tracing is off."""
+    tracer = _tracer
+    if tracer is None:
+        return _NULL_SPAN
+    return _Span(tracer, name, cat, args or None)
+
+
+def tracer():
+    """The active ``Tracer``, None while tracing is off."""
+    return _tracer
+
+
+def _model_label(model):
+    if model is None or isinstance(model, str):
+        return model
+    model = getattr(model, "steps", [[None, model]])[-1][1]
+    return type(model).__name__
+
+
+def _patch(owner, attribute, make_wrapper):
+    original = owner.__dict__.get(attribute, _MISSING)
+    current = getattr(owner, attribute)
+    wrapper = functools.wraps(current)(make_wrapper(current))
+    wrapper.__traced__ = True
+    setattr(owner, attribute, wrapper)
+    _patches.append((owner, attribute, original))
+
+
+def _timed(name, cat, arguments=None):
+    """Wrapper factory recording every call of a function as a span."""
+
+    def make(function):
+        def wrapper(*args, **kwargs):
+            tracer = _tracer
+            if tracer is None:
+                return function(*args, **kwargs)
+            start = time.perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                tracer.record(
+                    name, cat, start, time.perf_counter_ns(),
+                    arguments(args, kwargs) if arguments else None,
+                )
+
+        return wrapper
+
+    return make
+
+
+def _estimator_args(args, kwargs):
+    # _create_model(self, estimator, ...)
+    estimator = kwargs.get("estimator", args[1] if len(args) > 1 else None)
+    return {"model": _model_label(estimator)}
+
+
+def _fold_args(args, kwargs):
+    args = {"model": _model_label(args[0] if args else kwargs.get("estimator"))}
+    for key, label in (("split_progress", "split"), ("candidate_progress", "candidate")):
+        progress = kwargs.get(key)
+        if progress is not None:
+            args[label] = int(progress[0])
+    return args
+
+
+def _transformer_args(args, kwargs):
+    return {"transformer": type(getattr(args[0], "transformer", args[0])).__name__}
+
+
+def _experiment_classes():
+    from pycaret.classification import ClassificationExperiment
+    from pycaret.regression import RegressionExperiment
+
+    classes = [ClassificationExperiment, RegressionExperiment]
+    for module, name in (("pycaret.clustering", "ClusteringExperiment"),
+                         ("pycaret.anomaly", "AnomalyExperiment")):
+        try:
+            classes.append(getattr(__import__(module, fromlist=[name]), name))
+        except ImportError:
+            pass
+    return classes
+
+
+def _install_hooks():
+    from sklearn.model_selection import _search, _validation
+
+    from pycaret.internal.display import CommonDisplay
+    from pycaret.internal.patches import sklearn as pycaret_sklearn
+    from pycaret.internal.pipeline import Pipeline
+    from pycaret.internal.preprocess.transformers import TransformerWrapper
+
+    for cls in _experiment_classes():
+        for method in API_METHODS:
+            if hasattr(cls, method):
+                _patch(cls, method, _timed(method, "api"))
+        if hasattr(cls, "_create_model"):
+            _patch(cls, "_create_model", _timed("estimator", "estimator", _estimator_args))
+    # create_model swaps in pycaret's wrapper, which calls the sklearn
+    # functions it imported by name
+    for module in (_validation, _search, pycaret_sklearn):
+        _patch(module, "_fit_and_score", _timed("fold", "fold", _fold_args))
+    for module in (_validation, pycaret_sklearn):
+        _patch(module, "_score", _timed("score", "score"))
+    _patch(Pipeline, "fit", _timed("fit", "fit"))
+    for method in ("predict", "predict_proba", "decision_function"):
+        _patch(Pipeline, method, _timed(method, "predict"))
+    for method in ("fit", "transform"):
+        _patch(TransformerWrapper, method, _timed(method, "preprocess", _transformer_args))
+    _patch(CommonDisplay, "display", _timed("display", "display"))
+
+
+def _remove_hooks():
+    while _patches:
+        owner, attribute, original = _patches.pop()
+        if original is _MISSING:
+            delattr(owner, attribute)
+        else:
+            setattr(owner, attribute, original)
+
+
+def enable(max_events=DEFAULT_MAX_EVENTS):
+    """
+    Start recording spans. Safe to call again, the buffer is then replaced.
+
+
+    max_events: int, default = 1000000
+        Size of the buffer; the oldest spans are dropped when it is full.
+
+
+    Returns:
+        The active ``Tracer``.
+
+    """
+    global _tracer
+    if not _patches:
+        _install_hooks()
+    _tracer = Tracer(max_events)
+    return _tracer
+
+
+def disable():
+    """Stop recording and remove the hooks. Returns the last ``Tracer`` (None if off)."""
+    global _tracer
+    last, _tracer = _tracer, None
+    _remove_hooks()
+    return last
+
+
+@contextlib.contextmanager
+def profile(path=None, max_events=DEFAULT_MAX_EVENTS):
+    """Trace the ``with`` block, writing a Chrome trace to ``path`` if given."""
+    active = enable(max_events)
+    try:
+        yield active
+    finally:
+        disable()
+        if path is not None:
+            export_chrome_trace(path, active)
+
+
+def _events(tracer_):
+    tracer_ = tracer_ or _tracer
+    if tracer_ is None:
+        raise RuntimeError("Tracing is not enabled, call enable() first.")
+    return tracer_, list(tracer_.events)
+
+
+def _self_times(events):
+    """Duration of every span minus the duration of its direct children, in ns."""
+    own = [end - start for _, _, start, end, _, _ in events]
+    by_thread = collections.defaultdict(list)
+    for i, event in enumerate(events):
+        by_thread[event[4]].append(i)
+    for indices in by_thread.values():
+        indices.sort(key=lambda i: (events[i][2], -events[i][3]))
+        stack = []
+        for i in indices:
+            start, end = events[i][2], events[i][3]
+            while stack and events[stack[-1]][3] <= start:
+                stack.pop()
+            if stack:
+                own[stack[-1]] -= end - start
+            stack.append(i)
+    return own
+
+
+def summary(tracer=None):
+    """
+    Aggregate the recorded spans by category and name.
+
+
+    tracer: Tracer, default = None
+        Tracer to summarize. None uses the active one.
+
+
+    Returns:
+        DataFrame with the number of spans, the total and self time in
+        seconds and the mean and max duration in ms, sorted by self time.
+
+    """
+    tracer, events = _events(tracer)
+    own = _self_times(events)
+    frame = pd.DataFrame({
+        "Category": [e[1] for e in events],
+        "Span": [e[0] for e in events],
+        "duration": [(e[3] - e[2]) / 1e9 for e in events],
+        "self": [s / 1e9 for s in own],
+    })
+    grouped = frame.groupby(["Category", "Span"])
+    out = pd.DataFrame({
+        "Count": grouped.size(),
+        "Total (s)": grouped["duration"].sum(),
+        "Self (s)": grouped["self"].sum(),
+        "Mean (ms)": grouped["duration"].mean() * 1e3,
+        "Max (ms)": grouped["duration"].max() * 1e3,
+    })
+    return out.sort_values("Self (s)", ascending=False).round(4)
+
+
+def _jsonable(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def export_chrome_trace(path, tracer=None):
+    """
+    Write the recorded spans to ``path`` in the Chrome trace event format.
+
+
+    path: str
+        Output JSON file.
+
+
+    tracer: Tracer, default = None
+        Tracer to export. None uses the active one.
+
+
+    Returns:
+        Number of spans written.
+
+    """
+    tracer, events = _events(tracer)
+    threads = {}
+    trace = []
+    for name, cat, start, end, thread, args in events:
+        tid = threads.setdefault(thread, len(threads))
+        event = {
+            "name": name, "cat": cat, "ph": "X", "pid": tracer.pid, "tid": tid,
+            "ts": (start - tracer.origin) / 1e3, "dur": (end - start) / 1e3,
+        }
+        if args:
+            event["args"] = {k: _jsonable(v) for k, v in args.items()}
+        trace.append(event)
+    for thread, tid in threads.items():
+        trace.append({"name": "thread_name", "ph": "M", "pid": tracer.pid, "tid": tid,
+                      "args": {"name": f"thread {thread}"}})
+    with open(path, "w") as f:
+        json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+    return len(events)
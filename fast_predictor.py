@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -*-
+"""Low-latency single-row inference for saved pipelines
+
+`load_model('my_first_pipeline')` returns the full sklearn Pipeline. Scoring a
+single record through it builds a pandas DataFrame and goes through every
+transformer's column bookkeeping, which costs milliseconds per row.
+
+`FastPredictor.from_pipeline` compiles the fitted steps of a loaded pipeline
+into precomputed array operations:
+
+- imputation: one fill vector for the numeric columns, one fill value per
+  categorical column,
+- encoding: one lookup table per categorical column mapping the raw value to
+  its ordinal code, one-hot block or target-encoded value,
+- scaling: vector operations over the model's feature vector,
+- linear models: a dot product (and the argmax of the class scores for linear
+  classifiers); any other estimator gets the feature vector as a 2D NumPy
+  array.
+
+It accepts a dict or a NumPy row in input column order. Steps without a fast
+path raise ``NotImplementedError`` at compile time so you can keep using the
+pipeline for those models. `check_parity` verifies the compiled predictor
+against the original pipeline and `latency_report` measures p50/p99 latency.
+
+Usage:
+
+```
+from fast_predictor import FastPredictor, check_parity, latency_report
+
+loaded_best_pipeline = load_model('my_first_pipeline')
+fast = FastPredictor.from_pipeline(loaded_best_pipeline)
+fast.predict({'age': 19, 'sex': 'female', 'bmi': 27.9, 'children': 0, 'smoker': 'yes', 'region': 'southwest'})
+check_parity(fast, loaded_best_pipeline, new_data)
+latency_report(fast, new_data)
+```
+"""
+
+import argparse
+import math
+import re
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+from sklearn.base import is_classifier
+
+_SCALERS = {"StandardScaler", "MinMaxScaler", "MaxAbsScaler", "RobustScaler"}
+_ENCODERS = {"OrdinalEncoder", "OneHotEncoder", "TargetEncoder"}
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def _ordinal_mapping(encoder, col):
+    """Return ``{raw value: ordinal code}`` of a category_encoders encoder for ``col``."""
+    mapping = next(m for m in encoder.mapping if m["col"] == col)["mapping"]
+    return {k: int(v) for k, v in mapping.items() if not _is_missing(k)}
+
+
+def _scaler_ops(scaler):
+    """Return ``(subtract, divide, multiply, add)`` reproducing ``scaler.transform``.
+
+    The operations are applied in the same order as sklearn does, so the
+    compiled features are bit-identical to the pipeline's (ill-conditioned
+    linear models amplify any rounding difference).
+    """
+    name = type(scaler).__name__
+    if name == "StandardScaler":
+        return scaler.mean_ if scaler.with_mean else None, scaler.scale_, None, None
+    if name == "MinMaxScaler":
+        return None, None, scaler.scale_, scaler.min_
+    if name == "MaxAbsScaler":
+        return None, scaler.scale_, None, None
+    return scaler.center_, scaler.scale_, None, None  # RobustScaler
+
+
+class FastPredictor:
+    """Single-row predictor compiled from a fitted pycaret pipeline.
+
+    Use ``FastPredictor.from_pipeline(pipeline)`` to build one.
+    """
+
+    def __init__(self, input_columns, feature_names, estimator):
+        self.input_columns = list(input_columns)
+        self.feature_names = list(feature_names)
+        self.estimator = estimator
+        self.classes = None
+
+        self._position = {f: i for i, f in enumerate(self.feature_names)}
+        self._scalers = []
+        self._num_cols = []
+        self._num_fill = np.array([])
+        self._num_pos = np.array([], dtype=int)
+        self._num_idx = np.array([], dtype=int)
+        self._cat_cols = []
+        self._cat_idx = []
+        self._cat_fill = {}
+        self._cat_tables = {}
+        self._cat_default = {}
+        self._linear = None
+        self._renames = []
+
+    # ----------------------------------------------------------------- compile
+
+    def _pos(self, name):
+        """Position of an intermediate column in the model's feature vector."""
+        for match in self._renames:
+            name = re.sub(match, "", str(name))
+        return self._position[name]
+
+    @classmethod
+    def from_pipeline(cls, pipeline):
+        """Compile ``pipeline`` (as returned by ``load_model``)."""
+        wrappers = list(pipeline.steps)
+        _, estimator = wrappers.pop()
+
+        first = wrappers[0][1] if wrappers else None
+        if first is not None and getattr(first, "_feature_names_in", None) is not None:
+            target = getattr(first, "target_name_", None)
+            input_columns = [c for c in first._feature_names_in if c != target]
+        else:
+            input_columns = list(estimator.feature_names_in_)
+
+        fast = cls(input_columns, estimator.feature_names_in_, estimator)
+        # column renames apply to every earlier step's output names
+        fast._renames = [
+            getattr(w, "transformer", w).match
+            for _, w in wrappers
+            if type(getattr(w, "transformer", w)).__name__ == "CleanColumnNames"
+        ]
+        num_fill = {}
+        cat_cols = set()
+
+        for name, wrapper in wrappers:
+            transformer = getattr(wrapper, "transformer", wrapper)
+            kind = type(transformer).__name__
+            if getattr(wrapper, "_include", None) == []:
+                continue  # the step had no columns to work on and was never fitted
+            if kind == "CleanColumnNames":
+                continue  # handled by _pos
+            elif kind == "LabelEncoder":
+                fast.classes = transformer.classes_
+            elif kind == "SimpleImputer":
+                for col, value in zip(transformer.feature_names_in_, transformer.statistics_):
+                    if isinstance(value, str) or not np.issubdtype(type(value), np.number):
+                        cat_cols.add(col)
+                        fast._cat_fill[col] = value
+                    else:
+                        num_fill[col] = float(value)
+            elif kind in _ENCODERS:
+                for col in transformer.cols:
+                    cat_cols.add(col)
+                    fast._compile_encoder(transformer, col)
+            elif kind in _SCALERS:
+                # scaling comes after encoding in pycaret pipelines, so it
+                # applies to the assembled feature vector
+                idx = np.array([fast._pos(c) for c in transformer.feature_names_in_])
+                fast._scalers.append((idx, *_scaler_ops(transformer)))
+            else:
+                raise NotImplementedError(
+                    f"Pipeline step '{name}' ({kind}) has no fast path, "
+                    "use the pipeline's predict for this model."
+                )
+
+        fast._num_cols = [c for c in input_columns if c not in cat_cols]
+        fast._num_fill = np.array([num_fill.get(c, np.nan) for c in fast._num_cols])
+        fast._num_pos = np.array([fast._pos(c) for c in fast._num_cols], dtype=int)
+        fast._num_idx = np.array([input_columns.index(c) for c in fast._num_cols], dtype=int)
+        fast._cat_cols = [c for c in input_columns if c in cat_cols]
+        fast._cat_idx = [input_columns.index(c) for c in fast._cat_cols]
+        fast._compile_estimator()
+        return fast
+
+    def _compile_encoder(self, encoder, col):
+        kind = type(encoder).__name__
+        if kind == "OrdinalEncoder":
+            pos = np.array([self._pos(col)])
+            table = {v: (pos, np.array([float(code)]))
+                     for v, code in _ordinal_mapping(encoder, col).items()}
+            default = (pos, np.array([-1.0]))
+        elif kind == "OneHotEncoder":
+            block = next(m for m in encoder.mapping if m["col"] == col)["mapping"]
+            pos = np.array([self._pos(c) for c in block.columns])
+            codes = _ordinal_mapping(encoder.ordinal_encoder, col)
+            table = {v: (pos, block.loc[code].to_numpy(dtype=float)) for v, code in codes.items()}
+            default = (pos, block.loc[-1].to_numpy(dtype=float))
+        else:  # TargetEncoder
+            values = encoder.mapping[col]
+            pos = np.array([self._pos(col)])
+            codes = _ordinal_mapping(encoder.ordinal_encoder, col)
+            table = {v: (pos, np.array([float(values.loc[code])])) for v, code in codes.items()}
+            default = (pos, np.array([float(values.loc[-1])]))
+
+        # a column encoded twice would need the first encoding's output as input
+        if col in self._cat_tables:
+            raise NotImplementedError(f"Column '{col}' is encoded by several steps.")
+        self._cat_tables[col] = table
+        self._cat_default[col] = default
+
+    def _compile_estimator(self):
+        est = self.estimator
+        if not (type(est).__module__.startswith("sklearn.linear_model") and hasattr(est, "coef_")):
+            return
+        if is_classifier(est):
+            # same decision rule as sklearn's LinearClassifierMixin.predict
+            self._linear = (np.atleast_2d(est.coef_).astype(float),
+                            np.ravel(est.intercept_).astype(float), est.classes_)
+        else:
+            self._linear = (np.ravel(est.coef_).astype(float),
+                            float(np.ravel(est.intercept_)[0]), None)
+
+    # ----------------------------------------------------------------- predict
+
+    def _call_estimator(self, method, X):
+        """``method`` of the estimator on the array ``X``."""
+        # the estimator was fitted on a DataFrame, the compiled path passes arrays
+        with warnings.catch_warnings():
+            warnings.filterwarnings("ignore", message="X does not have valid feature names")
+            return getattr(self.estimator, method)(X)
+
+    def transform(self, row):
+        """Return the model's feature vector for one record (dict or sequence)."""
+        x = np.zeros(len(self.feature_names))
+        if isinstance(row, dict):
+            num = np.array([row.get(c, np.nan) for c in self._num_cols], dtype=float)
+            cats = [row.get(c) for c in self._cat_cols]
+        else:
+            row = np.asarray(row, dtype=object)
+            num = row[self._num_idx].astype(float)
+            cats = row[self._cat_idx]
+
+        missing = np.isnan(num)
+        if missing.any():
+            num[missing] = self._num_fill[missing]
+        x[self._num_pos] = num
+
+        for col, value in zip(self._cat_cols, cats):
+            if _is_missing(value):
+                value = self._cat_fill.get(col, value)
+            pos, encoded = self._cat_tables[col].get(value, self._cat_default[col])
+            x[pos] = encoded
+
+        for idx, subtract, divide, multiply, add in self._scalers:
+            v = x[idx]
+            if subtract is not None:
+                v = v - subtract
+            if divide is not None:
+                v = v / divide
+            if multiply is not None:
+                v = v * multiply
+            if add is not None:
+                v = v + add
+            x[idx] = v
+        return x
+
+    def transform_frame(self, data):
+        """Return the model's feature matrix for a DataFrame of records.
+
+        Vectorized version of ``transform``: every distinct category is looked
+        up once per column.
+        """
+        X = np.zeros((len(data), len(self.feature_names)))
+        num = data[self._num_cols].to_numpy(dtype=float)
+        missing = np.isnan(num)
+        if missing.any():
+            num = np.where(missing, self._num_fill, num)
+        X[:, self._num_pos] = num
+
+        for col in self._cat_cols:
+            table, default = self._cat_tables[col], self._cat_default[col]
+            codes, uniques = pd.factorize(data[col])
+            # missing values (code -1) pick the last row: the imputed value's encoding
+            fill = table.get(self._cat_fill[col], default) if col in self._cat_fill else default
+            encoded = np.array([table.get(v, default)[1] for v in uniques] + [fill[1]])
+            X[:, default[0]] = encoded[codes]
+
+        for idx, subtract, divide, multiply, add in self._scalers:
+            v = X[:, idx]
+            if subtract is not None:
+                v = v - subtract
+            if divide is not None:
+                v = v / divide
+            if multiply is not None:
+                v = v * multiply
+            if add is not None:
+                v = v + add
+            X[:, idx] = v
+        return X
+
+    def predict_frame(self, data):
+        """Predict a DataFrame of records. Returns an array (labels for classifiers)."""
+        pred = self._call_estimator("predict", self.transform_frame(data))
+        if self.classes is not None:
+            return self.classes[np.asarray(pred).astype(int)]
+        return pred
+
+    def predict_proba_frame(self, data):
+        """Class probabilities of a DataFrame of records, one row per record."""
+        return self._call_estimator("predict_proba", self.transform_frame(data))
+
+    def predict(self, row):
+        """Predict one record. Returns a scalar (label for classifiers)."""
+        x = self.transform(row)
+        if self._linear is not None:
+            coef, intercept, est_classes = self._linear
+            if est_classes is None:
+                return float(x @ coef + intercept)
+            scores = coef @ x + intercept
+            pred = est_classes[int(scores[0] > 0) if len(scores) == 1 else int(scores.argmax())]
+        else:
+            pred = self._call_estimator("predict", x[None, :])[0]
+        if self.classes is not None:
+            return self.classes[int(pred)]
+        return pred
+
+    def predict_proba(self, row):
+        """Class probabilities of one record, in the order of ``self.classes``."""
+        return self._call_estimator("predict_proba", self.transform(row)[None, :])[0]
+
+
+def check_parity(fast, pipeline, data, rtol=1e-6, atol=1e-8):
+    """Compare ``fast`` row by row with ``pipeline`` on ``data``.
+
+    The feature vectors are compared with the output of the pipeline's
+    transformers, then the predictions with ``pipeline.predict(data)``.
+    Note that models with ill-conditioned coefficients (e.g. LinearRegression
+    on a full one-hot encoding) give slightly different results for a single
+    row and for a batch even inside sklearn; loosen ``rtol`` for those.
+
+    Returns a dict with the maximum feature difference and the maximum
+    prediction difference (regression) or the number of mismatching labels
+    (classification); raises ``AssertionError`` on a mismatch.
+    """
+    data = data[fast.input_columns]
+    records = data.to_dict(orient="records")
+
+    features = np.array([fast.transform(r) for r in records])
+    expected_features = pipeline[:-1].transform(data)[fast.feature_names].to_numpy(dtype=float)
+    np.testing.assert_allclose(features, expected_features, rtol=1e-9, atol=1e-12)
+    report = {"max_feature_diff": float(np.abs(features - expected_features).max())}
+
+    expected = np.asarray(pipeline.predict(data))
+    got = np.array([fast.predict(r) for r in records])
+    if is_classifier(fast.estimator):
+        mismatches = int((got != expected).sum())
+        assert mismatches == 0, f"{mismatches} labels differ from the pipeline"
+        report["label_mismatches"] = mismatches
+    else:
+        np.testing.assert_allclose(got, expected, rtol=rtol, atol=atol)
+        report["max_prediction_diff"] = float(np.abs(got - expected).max())
+    return report
+
+
+def _percentiles(samples):
+    samples = np.asarray(samples) * 1e6
+    return {
+        "p50_us": round(float(np.percentile(samples, 50)), 2),
+        "p99_us": round(float(np.percentile(samples, 99)), 2),
+        "max_us": round(float(samples.max()), 2),
+    }
+
+
+def latency_report(fast, data, n=10_000, pipeline=None, n_pipeline=200):
+    """Measure single-row latency of ``fast`` (and optionally of ``pipeline``)."""
+    records = data[fast.input_columns].to_dict(orient="records")
+    for r in records[:100]:  # warm up
+        fast.predict(r)
+    samples = []
+    for i in range(n):
+        r = records[i % len(records)]
+        start = time.perf_counter()
+        fast.predict(r)
+        samples.append(time.perf_counter() - start)
+    report = {"fast_path": _percentiles(samples)}
+
+    if pipeline is not None:
+        samples = []
+        for i in range(n_pipeline):
+            frame = pd.DataFrame([records[i % len(records)]])
+            start = time.perf_counter()
+            pipeline.predict(frame)
+            samples.append(time.perf_counter() - start)
+        report["pipeline"] = _percentiles(samples)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("model", help="model name passed to load_model (without .pkl)")
+    parser.add_argument("data", help="CSV file with records to check and time")
+    parser.add_argument("-n", type=int, default=10_000, help="number of timed predictions")
+    args = parser.parse_args(argv)
+
+    import lazy_imports
+
+    # scoring only: skip the experiment module and defer the plotting stack
+    lazy_imports.install()
+    from pycaret.internal.persistence import load_model
+
+    pipeline = load_model(args.model, verbose=False)
+    data = pd.read_csv(args.data)
+    fast = FastPredictor.from_pipeline(pipeline)
+    print("parity:", check_parity(fast, pipeline, data))
+    print(latency_report(fast, data, n=args.n, pipeline=pipeline))
+
+
+if __name__ == "__main__":
+    main()
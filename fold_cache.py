@@ -0,0 +1,499 @@
+# -*- coding: utf-8 -*-
+"""Fold-level result cache for create_model / compare_models
+
+The tutorials call `create_model('lr')`, then `create_model('lr', fold=3)`,
+then `create_model('lr', return_train_score=True)`, and `dt = create_model('dt')`
+shows up again before every tune. Identical (estimator, params, fold split,
+seed) combinations are retrained from scratch each time.
+
+`FoldCache` memoizes, per CV fold, the fitted pipeline and the metric rows it
+produced. The key is built from:
+
+- the untrained estimator and its parameters (including ``random_state``),
+- the preprocessing pipeline definition,
+- a fingerprint of the training data,
+- the exact train/test indices of the fold (which encode ``fold``,
+  ``fold_strategy`` and the seed).
+
+Metrics are not part of the key: a metric added with `add_metric` after a fold
+was cached, or train scores requested with `return_train_score=True`, are
+computed from the cached fitted fold without refitting it.
+
+With `retain_oof=True` the out-of-fold outputs of every cross validated model
+(predictions, and probabilities / decision scores when the estimator has
+them) are also kept in an `OOFStore`: one float32 array over the training
+rows per output, which outlives the fitted folds evicted from the LRU cache.
+`oof_ensemble.py` stacks and blends from it.
+
+Usage:
+
+```
+from fold_cache import cached_create_model, cached_compare_models
+
+exp = get_current_experiment()
+lr = cached_create_model(exp, 'lr')
+lr = cached_create_model(exp, 'lr', return_train_score=True)   # no refit
+best = cached_compare_models(exp)                              # reuses lr folds
+```
+"""
+
+import copy
+import weakref
+from collections import OrderedDict
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from parallel_compare import (
+    build_compare_grid,
+    cv_splits,
+    finalize_selection,
+    fit_fold,
+    library_estimators,
+    make_estimator,
+    score_pipeline,
+    scoring_metrics,
+)
+from setup_cache import fingerprint_frame
+
+
+class FoldCache:
+    """In-memory LRU store of per-fold results.
+
+    Each value is a dict with the fitted pipeline (``model``), its
+    ``fit_time`` and the ``test``/``train`` score dicts computed so far.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._store = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._store)
+
+    def get(self, key):
+        record = self._store.get(key)
+        if record is None:
+            self.misses += 1
+            return None
+        self._store.move_to_end(key)
+        self.hits += 1
+        return record
+
+    def put(self, key, record):
+        self._store[key] = record
+        self._store.move_to_end(key)
+        while len(self._store) > self.max_entries:
+            self._store.popitem(last=False)
+
+    def clear(self):
+        self._store.clear()
+        self.hits = self.misses = 0
+
+
+# one cache per experiment, dropped together with the experiment
+_EXPERIMENT_CACHES = weakref.WeakKeyDictionary()
+
+
+def get_fold_cache(exp):
+    """Return the FoldCache attached to ``exp``, creating it on first use."""
+    if exp not in _EXPERIMENT_CACHES:
+        _EXPERIMENT_CACHES[exp] = FoldCache()
+    return _EXPERIMENT_CACHES[exp]
+
+
+def _canonical_param(value):
+    if hasattr(value, "get_params") and not isinstance(value, type):
+        return estimator_fingerprint(value)
+    if isinstance(value, (list, tuple)):
+        return type(value)(_canonical_param(v) for v in value)
+    if isinstance(value, dict):
+        return {k: _canonical_param(v) for k, v in value.items()}
+    return value
+
+
+def estimator_fingerprint(estimator):
+    """Hash of the class and the parameters of an (unfitted) estimator.
+
+    ``repr`` is not usable: scikit-learn truncates it for long parameters and
+    estimators outside scikit-learn (e.g. CatBoost) show their address.
+    Nested estimators (pipeline steps, ensemble members) are replaced by their
+    own fingerprint.
+    """
+    cls = type(estimator)
+    params = estimator.get_params(deep=True)
+    return joblib.hash(
+        (
+            cls.__module__,
+            cls.__qualname__,
+            sorted((k, _canonical_param(v)) for k, v in params.items()),
+        )
+    )
+
+
+def experiment_fingerprint(exp, X=None, y=None):
+    """Hash of the training data and the (unfitted) preprocessing pipeline."""
+    X = exp.X_train if X is None else X
+    y = exp.y_train if y is None else y
+    return joblib.hash(
+        (fingerprint_frame(X), fingerprint_frame(y.to_frame()), estimator_fingerprint(exp.pipeline))
+    )
+
+
+def fold_key(data_fingerprint, estimator, train, test=None, fit_kwargs=None):
+    """Cache key of one fit of ``estimator`` on the rows ``train``."""
+    return joblib.hash(
+        (
+            data_fingerprint,
+            estimator_fingerprint(estimator),
+            np.asarray(train),
+            None if test is None else np.asarray(test),
+            fit_kwargs or {},
+        )
+    )
+
+
+class OOFStore:
+    """Out-of-fold outputs of cross validated models.
+
+    Each value is a dict ``{method: array}`` over the training rows, as the
+    final estimator returned them (encoded labels, transformed target), plus
+    ``fold``: the fold in which each row was held out, -1 if never. The
+    ``estimator_fingerprint`` of the model is kept next to every value, for
+    ``get`` to reject an entry that does not belong to the estimator asked for.
+    """
+
+    def __init__(self):
+        self._store = {}
+        self._estimators = {}
+
+    def __len__(self):
+        return len(self._store)
+
+    def get(self, key, estimator=None, splits=None):
+        """Stored outputs under ``key``, or None. With ``estimator`` / ``splits``
+        the entry is only returned if it was stored for the same estimator and
+        matches the rows and folds of ``splits``."""
+        oof = self._store.get(key)
+        if oof is None:
+            return None
+        if estimator is not None and self._estimators.get(key) != estimator_fingerprint(estimator):
+            return None
+        if splits is not None and not _matches_splits(oof, splits):
+            return None
+        return oof
+
+    def put(self, key, oof, estimator=None):
+        self._store[key] = oof
+        self._estimators[key] = None if estimator is None else estimator_fingerprint(estimator)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for oof in self._store.values() for a in oof.values())
+
+    def clear(self):
+        self._store.clear()
+        self._estimators.clear()
+
+
+def _matches_splits(oof, splits):
+    """Whether every array of ``oof`` covers the rows of ``splits`` with their fold."""
+    fold = oof["fold"]
+    n_rows = len(fold)
+    if any(len(values) != n_rows for values in oof.values()):
+        return False
+    for k, (train, test) in enumerate(splits):
+        train, test = np.asarray(train), np.asarray(test)
+        if (len(test) and (test.max() >= n_rows or np.any(fold[test] != k))) or (
+            len(train) and train.max() >= n_rows
+        ):
+            return False
+    return True
+
+
+_EXPERIMENT_OOF = weakref.WeakKeyDictionary()
+
+OOF_METHODS = ("predict", "predict_proba", "decision_function")
+
+
+def get_oof_store(exp):
+    """Return the OOFStore attached to ``exp``, creating it on first use."""
+    if exp not in _EXPERIMENT_OOF:
+        _EXPERIMENT_OOF[exp] = OOFStore()
+    return _EXPERIMENT_OOF[exp]
+
+
+def oof_key(data_fingerprint, estimator, splits):
+    """Store key of the out-of-fold outputs of ``estimator`` on ``splits``."""
+    return joblib.hash(
+        (
+            data_fingerprint,
+            estimator_fingerprint(estimator),
+            [(np.asarray(train), np.asarray(test)) for train, test in splits],
+        )
+    )
+
+
+def fold_predictions(model, X):
+    """Outputs of the estimator of a fitted fold pipeline on ``X``, before the
+    target transformers are inverted."""
+    estimator = model.steps[-1][1]
+    Xt = model[:-1].transform(X)
+    outputs = {}
+    for method in OOF_METHODS:
+        if hasattr(estimator, method):
+            values = np.asarray(getattr(estimator, method)(Xt))
+            if values.dtype.kind == "f":
+                values = values.astype(np.float32)
+            outputs[method] = values
+    return outputs
+
+
+def _missing(scores, metrics):
+    return {k: v for k, v in metrics.items() if k not in scores}
+
+
+def cached_fold(exp, cache, data_fingerprint, estimator, X, y, train, test, metrics,
+                return_train_score=False, fit_kwargs=None, oof=False):
+    """Fit (or fetch) one fold and return its record, completing missing scores
+    (and the held-out outputs, ``oof``, if requested)."""
+    key = fold_key(data_fingerprint, estimator, train, test, fit_kwargs)
+    record = cache.get(key)
+    if record is None:
+        model, fit_time = fit_fold(exp.pipeline, estimator, X, y, train, fit_kwargs)
+        record = {"model": model, "fit_time": fit_time, "test": {}, "train": {}}
+        cache.put(key, record)
+
+    model = record["model"]
+    missing = _missing(record["test"], metrics)
+    if missing and test is not None:
+        record["test"].update(score_pipeline(model, X.iloc[test], y.iloc[test], missing))
+    missing = _missing(record["train"], metrics)
+    if return_train_score and missing:
+        record["train"].update(score_pipeline(model, X.iloc[train], y.iloc[train], missing))
+    if oof and test is not None and "oof" not in record:
+        record["oof"] = fold_predictions(model, X.iloc[test])
+    return record
+
+
+def cached_cross_validate(exp, estimator, splits, cache=None, return_train_score=False,
+                          fit_kwargs=None, data_fingerprint=None, oof=False):
+    """Cross validate ``estimator`` on ``splits`` through the cache.
+
+    Returns the list of fold records, in fold order.
+    """
+    cache = cache if cache is not None else get_fold_cache(exp)
+    data_fingerprint = data_fingerprint or experiment_fingerprint(exp)
+    X, y = exp.X_train, exp.y_train
+    metrics = scoring_metrics(exp)
+    return [
+        cached_fold(exp, cache, data_fingerprint, estimator, X, y, train, test, metrics,
+                    return_train_score=return_train_score, fit_kwargs=fit_kwargs, oof=oof)
+        for train, test in splits
+    ]
+
+
+def store_oof(exp, estimator, splits, records, data_fingerprint=None):
+    """Assemble the held-out outputs of ``records`` and keep them in the OOFStore.
+
+    Returns the stored dict.
+    """
+    data_fingerprint = data_fingerprint or experiment_fingerprint(exp)
+    n_rows = len(exp.X_train)
+    oof = {"fold": np.full(n_rows, -1, dtype=np.int16)}
+    for k, ((_, test), record) in enumerate(zip(splits, records)):
+        oof["fold"][test] = k
+        for method, values in record["oof"].items():
+            if method not in oof:
+                oof[method] = np.zeros((n_rows,) + values.shape[1:], dtype=values.dtype)
+            oof[method][test] = values
+    get_oof_store(exp).put(oof_key(data_fingerprint, estimator, splits), oof, estimator)
+    return oof
+
+
+def _scores_frame(records, split, metric_names):
+    df = pd.DataFrame([{k: r[split][k] for k in metric_names} for r in records])
+    summary = pd.DataFrame([df.mean(), df.std(ddof=0)])
+    return pd.concat([df, summary], ignore_index=True)
+
+
+def create_model_grid(records, metric_names, return_train_score=False, train_scores=None,
+                      round=4):
+    """Build the scoring grid `create_model` displays from fold records."""
+    n = len(records)
+    folds = list(range(n)) + ["Mean", "Std"]
+    val = _scores_frame(records, "test", metric_names)
+    if not return_train_score:
+        val.index = pd.Index(folds, name="Fold")
+        return val.round(round)
+
+    train = _scores_frame(records, "train", metric_names)
+    grid = pd.concat([train.iloc[:n], val.iloc[:n], train.iloc[n:], val.iloc[n:]],
+                     ignore_index=True)
+    splits = ["CV-Train"] * n + ["CV-Val"] * n + ["CV-Train"] * 2 + ["CV-Val"] * 2
+    fold_labels = list(range(n)) * 2 + ["Mean", "Std"] * 2
+    if train_scores is not None:
+        grid = pd.concat([grid, pd.DataFrame([train_scores])], ignore_index=True)
+        splits.append("Train")
+        fold_labels.append(None)
+    grid.index = pd.MultiIndex.from_arrays([splits, fold_labels], names=["Split", "Fold"])
+    return grid.round(round)
+
+
+def cached_create_model(
+    exp,
+    estimator,
+    fold=None,
+    round=4,
+    cross_validation=True,
+    fit_kwargs=None,
+    groups=None,
+    return_train_score=False,
+    cache=None,
+    retain_oof=False,
+    **kwargs,
+):
+    """
+    `create_model` backed by the fold cache. Folds already computed for the
+    same estimator, parameters, data and split are reused instead of refit.
+
+
+    exp: ClassificationExperiment or RegressionExperiment
+        Experiment on which ``setup()`` has been run.
+
+
+    estimator, fold, round, cross_validation, fit_kwargs, groups, return_train_score, **kwargs
+        Same meaning as in ``create_model``.
+
+
+    cache: FoldCache, default = None
+        None uses the cache attached to ``exp``.
+
+
+    retain_oof: bool, default = False
+        Keep the out-of-fold outputs of the model in the experiment's
+        OOFStore, for ``oof_stack_models`` / ``oof_blend_models``.
+
+
+    Returns:
+        Trained model. The scoring grid is available with ``pull()``.
+
+    """
+    cache = cache if cache is not None else get_fold_cache(exp)
+    _, _, model = make_estimator(exp, estimator, **kwargs)
+    X, y = exp.X_train, exp.y_train
+    data_fingerprint = experiment_fingerprint(exp, X, y)
+    metrics = scoring_metrics(exp)
+
+    # the model fitted on the full training set is cached like any other fold
+    full = cached_fold(exp, cache, data_fingerprint, model, X, y, np.arange(len(X)), None,
+                       metrics, return_train_score=return_train_score, fit_kwargs=fit_kwargs)
+    fitted = copy.deepcopy(full["model"].steps[-1][1])
+
+    if not cross_validation:
+        results = pd.DataFrame(
+            [score_pipeline(full["model"], exp.X_test, exp.y_test, metrics)]
+        ).round(round)
+        exp._display_container.append(results)
+        return fitted
+
+    splits = cv_splits(exp, fold=fold, groups=groups)
+    records = cached_cross_validate(exp, model, splits, cache, return_train_score,
+                                    fit_kwargs, data_fingerprint, oof=retain_oof)
+    if retain_oof:
+        store_oof(exp, model, splits, records, data_fingerprint)
+    results = create_model_grid(
+        records,
+        list(metrics),
+        return_train_score=return_train_score,
+        train_scores=full["train"] if return_train_score else None,
+        round=round,
+    )
+    exp._display_container.append(results)
+    exp._master_model_container.append(
+        {"model": fitted, "scores": results, "cv": exp._get_cv_splitter(fold)}
+    )
+    return fitted
+
+
+def cached_compare_models(
+    exp,
+    include=None,
+    exclude=None,
+    fold=None,
+    round=4,
+    sort=None,
+    n_select=1,
+    turbo=True,
+    errors="ignore",
+    fit_kwargs=None,
+    groups=None,
+    cache=None,
+    retain_oof=False,
+):
+    """
+    `compare_models` backed by the fold cache: estimators already cross
+    validated with `cached_create_model` (or an earlier compare) on the same
+    folds are not refit.
+
+
+    exp: ClassificationExperiment or RegressionExperiment
+        Experiment on which ``setup()`` has been run.
+
+
+    include, exclude, fold, round, sort, n_select, turbo, errors, fit_kwargs, groups
+        Same meaning as in ``compare_models``. Models that fail are left out
+        of the grid with ``errors='ignore'``.
+
+
+    cache: FoldCache, default = None
+        None uses the cache attached to ``exp``.
+
+
+    retain_oof: bool, default = False
+        Keep the out-of-fold outputs of every model in the experiment's
+        OOFStore, for ``oof_stack_models`` / ``oof_blend_models``.
+
+
+    Returns:
+        Trained model or list of trained models, depending on ``n_select``.
+
+    """
+    if errors not in ("ignore", "raise"):
+        raise ValueError("errors parameter must be one of: ignore, raise.")
+    cache = cache if cache is not None else get_fold_cache(exp)
+    if sort is None:
+        sort = "R2" if "R2" in scoring_metrics(exp) else "Accuracy"
+    splits = cv_splits(exp, fold=fold, groups=groups)
+    data_fingerprint = experiment_fingerprint(exp)
+
+    models, names, fold_scores, fit_times = {}, {}, {}, {}
+    for model, model_id, name, estimator in library_estimators(exp, include, exclude, turbo):
+        try:
+            records = cached_cross_validate(exp, estimator, splits, cache,
+                                            fit_kwargs=fit_kwargs,
+                                            data_fingerprint=data_fingerprint,
+                                            oof=retain_oof)
+        except Exception as ex:
+            if errors == "raise":
+                raise RuntimeError(f"create_model() failed for model {model}. {ex}") from ex
+            exp.logger.warning(f"create_model() for {model} raised an exception: {ex}")
+            continue
+        models[model_id], names[model_id] = model, name
+        fold_scores[model_id] = [r["test"] for r in records]
+        fit_times[model_id] = sum(r["fit_time"] for r in records)
+        if retain_oof:
+            store_oof(exp, estimator, splits, records, data_fingerprint)
+
+    def fit(model_id):
+        _, _, estimator = make_estimator(exp, models[model_id])
+        X, y = exp.X_train, exp.y_train
+        full = cached_fold(exp, cache, data_fingerprint, estimator, X, y, np.arange(len(X)),
+                           None, {}, fit_kwargs=fit_kwargs)
+        return copy.deepcopy(full["model"].steps[-1][1])
+
+    grid = build_compare_grid(exp, fold_scores, names, fit_times, sort, round=round)
+    return finalize_selection(exp, grid, models, n_select=n_select, fit=fit)
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""Successive-halving compare_models
+
+`compare_models()` cross validates every estimator of the library on all
+folds, even the ones that are clearly behind after the first two folds.
+`halving_compare_models` races the candidates instead:
+
+- every candidate is evaluated on the first `min_folds` folds,
+- the bottom `drop_fraction` of them by the `sort` metric is pruned,
+- the survivors are evaluated on the next folds (the number of folds evaluated
+  grows by `factor` every round) until they have been scored on all folds.
+
+Ranking within a round is always done on the same folds for every remaining
+candidate, and at least `n_select` models survive to the last round, so the
+selected models are cross validated on all folds like in `compare_models`.
+`budget_time` stops the race when it runs out; models are then ranked on the
+folds evaluated so far.
+
+The grid returned by `pull()` lists the survivors first (ranked), followed by
+the pruned models with the mean of the folds they were scored on, the number
+of folds (`Folds`) and the round they were pruned in (`Pruned In`). Models
+that fail on every fold are left out, as in `parallel_compare_models`.
+
+Usage:
+
+```
+from halving_compare import halving_compare_models
+best = halving_compare_models(get_current_experiment(), n_select = 3)
+pull()
+```
+"""
+
+import math
+import time
+
+import numpy as np
+import pandas as pd
+
+from parallel_compare import (
+    build_compare_grid,
+    cv_splits,
+    failed_on_every_fold,
+    finalize_selection,
+    fit_and_score_fold,
+    library_estimators,
+    scoring_metrics,
+)
+
+
+def fold_schedule(n_folds, min_folds=2, factor=2):
+    """Cumulative number of folds evaluated at the end of each round.
+
+    e.g. ``fold_schedule(10) == [2, 4, 8, 10]``.
+    """
+    schedule = [min(max(min_folds, 1), n_folds)]
+    while schedule[-1] < n_folds:
+        schedule.append(min(max(int(schedule[-1] * factor), schedule[-1] + 1), n_folds))
+    return schedule
+
+
+def rank_candidates(fold_scores, metric, greater_is_better):
+    """Model ids ordered from best to worst by their mean ``metric``."""
+    means = {k: np.mean([s[metric] for s in v]) for k, v in fold_scores.items()}
+    return sorted(means, key=means.get, reverse=greater_is_better)
+
+
+def halving_compare_models(
+    exp,
+    include=None,
+    exclude=None,
+    fold=None,
+    round=4,
+    sort=None,
+    n_select=1,
+    budget_time=None,
+    turbo=True,
+    errors="ignore",
+    fit_kwargs=None,
+    groups=None,
+    min_folds=2,
+    drop_fraction=0.5,
+    factor=2,
+    verbose=True,
+):
+    """
+    Successive-halving version of `compare_models`: candidates that fall in
+    the bottom ``drop_fraction`` after a round are not evaluated on the
+    remaining folds.
+
+
+    exp: ClassificationExperiment or RegressionExperiment
+        Experiment on which ``setup()`` has been run. With the functional API
+        use ``get_current_experiment()``.
+
+
+    include, exclude, fold, round, sort, n_select, budget_time, turbo, errors, fit_kwargs, groups
+        Same meaning as in ``compare_models``. ``sort`` defaults to 'Accuracy'
+        for classification and 'R2' for regression. With a negative
+        ``n_select`` the worst models are kept in the race instead.
+
+
+    min_folds: int, default = 2
+        Number of folds every candidate is evaluated on in the first round.
+
+
+    drop_fraction: float, default = 0.5
+        Fraction of the remaining candidates pruned after each round.
+
+
+    factor: float, default = 2
+        Growth factor of the number of folds evaluated per round.
+
+
+    verbose: bool, default = True
+        When set to False, the pruning summary is not printed.
+
+
+    Returns:
+        Trained model or list of trained models, depending on ``n_select``.
+        The scoring grid, pruned models included, is available with ``pull()``.
+
+    """
+    if errors not in ("ignore", "raise"):
+        raise ValueError("errors parameter must be one of: ignore, raise.")
+    if not 0 <= drop_fraction < 1:
+        raise ValueError("drop_fraction must be in [0, 1).")
+    if sort is None:
+        sort = "R2" if "R2" in scoring_metrics(exp) else "Accuracy"
+    sort_metric = exp._get_metric_by_name_or_id(sort)
+    if sort_metric is None:
+        raise ValueError(
+            "Sort method not supported. See docstring for list of available parameters."
+        )
+    # keep the highest means unless lower is better, reversed for a negative n_select
+    keep_high = sort_metric.greater_is_better == (n_select >= 0)
+
+    X, y = exp.X_train, exp.y_train
+    splits = cv_splits(exp, fold=fold, groups=groups)
+    metrics = scoring_metrics(exp)
+    schedule = fold_schedule(len(splits), min_folds, factor)
+    deadline = None if budget_time is None else time.time() + budget_time * 60
+
+    models, names, estimators = {}, {}, {}
+    for model, model_id, name, estimator in library_estimators(exp, include, exclude, turbo):
+        models[model_id], names[model_id], estimators[model_id] = model, name, estimator
+
+    fold_scores = {model_id: [] for model_id in models}
+    fit_times = {model_id: 0.0 for model_id in models}
+    pruned_in = {}
+    alive = list(models)
+    out_of_time = False
+    n_fits = 0
+
+    for round_idx, n_folds in enumerate(schedule, start=1):
+        for model_id in alive:
+            for fold_idx in range(len(fold_scores[model_id]), n_folds):
+                if deadline is not None and time.time() > deadline:
+                    out_of_time = True
+                    break
+                train, test = splits[fold_idx]
+                try:
+                    scores, fit_time, _ = fit_and_score_fold(
+                        exp.pipeline, estimators[model_id], X, y, train, test, metrics,
+                        fit_kwargs,
+                    )
+                except Exception as ex:
+                    if errors == "raise":
+                        raise RuntimeError(
+                            f"create_model() failed for model {models[model_id]}. {ex}"
+                        )
+                    exp.logger.warning(f"{model_id} failed on fold {fold_idx}: {ex}")
+                    # same as compare_models(errors='ignore'), i.e. error_score=0.0
+                    scores, fit_time = {name: 0.0 for name in metrics}, 0.0
+                fold_scores[model_id].append(scores)
+                fit_times[model_id] += fit_time
+                n_fits += 1
+            if out_of_time:
+                break
+        if out_of_time:
+            exp.logger.info(
+                f"Time budget of {budget_time} minutes reached in round {round_idx}."
+            )
+            break
+        if n_folds == schedule[-1]:
+            break
+
+        # models that failed (or scored 0.0) on every fold are dropped, as in
+        # parallel_compare_models
+        alive = [k for k in alive if not failed_on_every_fold(fold_scores[k])]
+        ranked = rank_candidates(
+            {k: fold_scores[k] for k in alive},
+            sort_metric.display_name,
+            greater_is_better=keep_high,
+        )
+        n_keep = max(abs(n_select), math.ceil(len(ranked) * (1 - drop_fraction)))
+        for model_id in ranked[n_keep:]:
+            pruned_in[model_id] = round_idx
+        alive = ranked[:n_keep]
+
+    # models the budget did not leave time for, and models that failed (or
+    # scored 0.0) on every fold, are not part of the grid
+    evaluated = {k: v for k, v in fold_scores.items() if not failed_on_every_fold(v)}
+    skipped = [k for k in models if not fold_scores[k]]
+    if skipped:
+        exp.logger.info(f"Not evaluated within budget_time: {skipped}")
+    survivors = [k for k in evaluated if k not in pruned_in]
+
+    grid = build_compare_grid(
+        exp, {k: evaluated[k] for k in survivors}, names, fit_times, sort, round=round
+    )
+    models_out = finalize_selection(
+        exp, grid, models, n_select=n_select, fit_kwargs=fit_kwargs, groups=groups
+    )
+
+    pruned = build_compare_grid(
+        exp, {k: evaluated[k] for k in pruned_in}, names, fit_times, sort, round=round
+    )
+    pruned = pruned.loc[sorted(pruned.index, key=lambda k: -pruned_in[k])]
+    report = pd.concat([grid, pruned])
+    report["Folds"] = [len(evaluated[k]) for k in report.index]
+    report["Pruned In"] = pd.array([pruned_in.get(k) for k in report.index], dtype="Int64")
+    # replace the survivors-only grid finalize_selection published
+    exp._display_container[-1] = report
+
+    full_fits = len(models) * len(splits)
+    summary = (
+        f"{len(pruned_in)} of {len(models)} models pruned, "
+        f"{n_fits} of {full_fits} fold fits run "
+        f"({100 * (1 - n_fits / full_fits):.0f}% saved)" if full_fits else ""
+    )
+    exp.logger.info(summary)
+    if verbose:
+        print(summary)
+    return models_out
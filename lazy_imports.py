@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""Deferred imports of the plotting stack for faster pycaret startup
+
+`from pycaret.regression import *` / `from pycaret.classification import *`
+take several seconds, a good part of it in plotting and reporting modules
+(plotly, scikit-plot, statsmodels' formula API, ...) that are imported at
+module level by pycaret but only used by `plot_model`, `interpret_model`,
+`dashboard`, `deploy_model` or `create_app`. SHAP, explainerdashboard,
+MLflow, the cloud SDKs and FastAPI are already imported inside those
+functions by pycaret itself.
+
+`install()` registers an import hook that loads the modules listed in
+`DEFERRED_MODULES` lazily:
+
+- `import plotly.express as px` binds a placeholder module, nothing is
+  executed yet,
+- the module is executed the first time one of its attributes is used (e.g.
+  when `plot_model` calls `px.scatter`), transparently for the caller,
+- modules that another import needs right away (e.g. `from x import y`) are
+  loaded as usual, so correctness never depends on the list,
+- importing a deferred module again (pandas' Styler and yellowbrick both
+  `import matplotlib.pyplot`) returns the same placeholder without running it.
+
+A module is only deferred while nothing imports one of its submodules or
+names from it. The experiment modules import yellowbrick with
+`from ... import`, which still loads matplotlib itself, but `pyplot`, plotly,
+scikit-plot and statsmodels' formula API stay deferred. The tutorials install
+the hook before importing pycaret; it must be installed before pycaret is
+imported. `benchmark_import.py` measures the effect and fails when the
+deferred cold start is not below the eager one or a plotting module is loaded
+at import time again.
+
+Usage:
+
+```
+import lazy_imports
+lazy_imports.install()
+
+from pycaret.regression import *
+```
+"""
+
+import importlib.abc
+import importlib.util
+import sys
+import threading
+import types
+
+# modules imported by the experiment modules at import time but only used when
+# plotting / reporting
+DEFERRED_MODULES = (
+    "plotly.express",
+    "plotly.graph_objects",
+    "plotly.subplots",
+    "plotly.figure_factory",
+    "scikitplot",
+    "statsmodels.api",
+    "statsmodels.formula.api",
+    "statsmodels.tsa.api",
+    "matplotlib.pyplot",
+    "seaborn",
+    "wordcloud",
+    "umap",
+    "shap",
+    "explainerdashboard",
+    "mlflow",
+    "gradio",
+    "fastapi",
+    "uvicorn",
+    "boto3",
+)
+
+
+class DeferredModule(types.ModuleType):
+    """Placeholder that answers ``__spec__`` without executing the module.
+
+    Any other attribute hands the module back to the lazy module type of
+    ``importlib.util.LazyLoader``, which executes it.
+    """
+
+    def __getattribute__(self, attr):
+        spec = object.__getattribute__(self, "__spec__")
+        # every later ``import`` of the module reads __spec__ (to check it is
+        # not being initialized), which would otherwise execute it
+        if attr == "__spec__":
+            return spec
+        object.__setattr__(self, "__class__", spec.loader_state["lazy_type"])
+        return getattr(self, attr)
+
+    def __delattr__(self, attr):
+        spec = object.__getattribute__(self, "__spec__")
+        object.__setattr__(self, "__class__", spec.loader_state["lazy_type"])
+        delattr(self, attr)
+
+
+class DeferredLoader(importlib.util.LazyLoader):
+    """``LazyLoader`` creating ``DeferredModule`` placeholders."""
+
+    def exec_module(self, module):
+        super().exec_module(module)
+        # LazyLoader's module type is private; take it from the module instead
+        # of importing it, and keep its behaviour if the state is not a dict
+        state = object.__getattribute__(module, "__spec__").loader_state
+        if isinstance(state, dict):
+            state["lazy_type"] = type(module)
+            module.__class__ = DeferredModule
+
+
+class DeferringFinder(importlib.abc.MetaPathFinder):
+    """Meta path finder returning lazily executed module specs for ``modules``."""
+
+    def __init__(self, modules):
+        self.modules = frozenset(modules)
+        self._local = threading.local()
+
+    def find_spec(self, name, path, target=None):
+        if name not in self.modules or getattr(self._local, "busy", False):
+            return None
+        # let the regular finders locate the module, then wrap its loader
+        self._local.busy = True
+        try:
+            spec = importlib.util.find_spec(name)
+        finally:
+            self._local.busy = False
+        if spec is None or spec.loader is None or not hasattr(spec.loader, "exec_module"):
+            return None
+        spec.loader = DeferredLoader(spec.loader)
+        return spec
+
+
+_finder = None
+
+
+def install(modules=DEFERRED_MODULES):
+    """
+    Defer the execution of ``modules`` until their first attribute access.
+
+
+    modules: iterable of str, default = DEFERRED_MODULES
+        Fully qualified module names. Modules already imported are not
+        affected, so call this before importing pycaret.
+
+
+    Returns:
+        The installed ``DeferringFinder``.
+
+    """
+    global _finder
+    uninstall()
+    _finder = DeferringFinder(modules)
+    sys.meta_path.insert(0, _finder)
+    return _finder
+
+
+def uninstall():
+    """Remove the import hook. Modules already deferred stay lazy."""
+    global _finder
+    if _finder is not None and _finder in sys.meta_path:
+        sys.meta_path.remove(_finder)
+    _finder = None
+
+
+def deferred_modules():
+    """Names of the modules imported lazily and not executed yet."""
+    # type() does not go through the lazy module's __getattribute__, so this
+    # does not trigger the load
+    return sorted(
+        name for name, module in list(sys.modules.items())
+        if type(module) is DeferredModule
+    )
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""Load test for the prediction API
+
+Fires single-record `POST /predict` requests at a server started with
+`batch_server.py` (or an API generated by `create_api`) from a number of
+concurrent keep-alive connections, and reports:
+
+- throughput (requests per second),
+- p50 / p90 / p99 / max latency in milliseconds,
+- the number of failed requests,
+- the server's `/stats` (mean batch size) when it exposes them.
+
+Records are taken round-robin from a CSV file, columns passed with `--target`
+are dropped. Only the standard library is used on the client side so it does not
+compete with the server for numpy/pandas threads.
+
+Usage:
+
+`python load_test.py --url http://127.0.0.1:8000/predict --data new_data.csv --concurrency 64 --requests 10000`
+"""
+
+import argparse
+import asyncio
+import csv
+import datetime
+import json
+import os
+import platform
+import time
+from urllib.parse import urlsplit
+
+
+def _parse_value(value):
+    if value == "":
+        return None
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value
+
+
+def load_records(path, drop=None):
+    """Read ``path`` as a list of JSON-ready dicts, without the ``drop`` columns."""
+    drop = set(drop or [])
+    with open(path, newline="") as f:
+        return [
+            {k: _parse_value(v) for k, v in row.items() if k not in drop}
+            for row in csv.DictReader(f)
+        ]
+
+
+def write_results(path, benchmark, records, **params):
+    """Write the records and run parameters to ``path`` as JSON, in the ``benchmark_regression`` layout."""
+    payload = {
+        "benchmark": benchmark,
+        "environment": {
+            "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "params": params,
+        "stages": records,
+    }
+    with open(path, "w") as f:
+        json.dump(payload, f, indent=2, default=str)
+    return payload
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class _Connection:
+    """Minimal HTTP/1.1 keep-alive client for JSON requests."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, body=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        payload = b"" if body is None else json.dumps(body).encode()
+        head = (
+            f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n\r\n"
+        )
+        self.writer.write(head.encode() + payload)
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode().partition(":")
+            if name.strip().lower() == "content-length":
+                length = int(value)
+        return status, json.loads(await self.reader.readexactly(length) or b"null")
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+            self.writer = None
+
+
+async def run_load_test(url, records, n_requests=1000, concurrency=32, warmup=None):
+    """
+    Send ``n_requests`` single-record requests to ``url`` from ``concurrency``
+    connections and measure the latency of each.
+
+
+    url: str
+        Full URL of the prediction endpoint, e.g. ``http://127.0.0.1:8000/predict``.
+
+
+    records: list of dict
+        Request bodies, used round-robin.
+
+
+    n_requests: int, default = 1000
+        Number of measured requests.
+
+
+    concurrency: int, default = 32
+        Number of connections sending requests at the same time.
+
+
+    warmup: int, default = None
+        Requests sent before measuring. None sends one per connection.
+
+
+    Returns:
+        Dictionary with the throughput, latency percentiles (ms), error count
+        and the server's ``/stats`` if available.
+
+    """
+    parts = urlsplit(url)
+    host, port, path = parts.hostname, parts.port or 80, parts.path or "/"
+    warmup = concurrency if warmup is None else warmup
+    counter = iter(range(warmup + n_requests))
+    latencies, errors, first = [], [], []
+
+    async def client():
+        conn = _Connection(host, port)
+        try:
+            for i in counter:
+                start = time.perf_counter()
+                if i == warmup:
+                    first.append(start)
+                try:
+                    status, _ = await conn.request("POST", path, records[i % len(records)])
+                except (ConnectionError, asyncio.IncompleteReadError, ValueError) as ex:
+                    status = repr(ex)
+                    await conn.close()
+                if i < warmup:
+                    continue
+                if status == 200:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    errors.append(status)
+        finally:
+            await conn.close()
+
+    # warmup requests are taken from the same counter, the clock starts when
+    # the first measured request is issued
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - first[0] if first else 0.0
+
+    latencies_ms = sorted(t * 1000 for t in latencies)
+    result = {
+        "requests": len(latencies),
+        "errors": len(errors),
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "requests_per_s": round(len(latencies) / elapsed, 2) if elapsed > 0 else None,
+        "latency_ms": {
+            name: round(percentile(latencies_ms, q), 3) if latencies_ms else None
+            for name, q in [("p50", 50), ("p90", 90), ("p99", 99), ("max", 100)]
+        },
+    }
+
+    stats_path = path.rsplit("/", 1)[0] + "/stats"
+    conn = _Connection(host, port)
+    try:
+        status, stats = await conn.request("GET", stats_path)
+        if status == 200:
+            result["server_stats"] = stats
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        await conn.close()
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default="http://127.0.0.1:8000/predict")
+    parser.add_argument("--data", required=True, help="CSV file with the records to send")
+    parser.add_argument("--target", nargs="*", default=[],
+                        help="columns to drop from the records (e.g. the target)")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--warmup", type=int, default=None)
+    parser.add_argument("--output", default=None, help="optional JSON file for the results")
+    args = parser.parse_args(argv)
+
+    records = load_records(args.data, drop=args.target)
+    result = asyncio.run(
+        run_load_test(args.url, records, args.requests, args.concurrency, args.warmup)
+    )
+    print(json.dumps(result, indent=2))
+    if args.output:
+        write_results(args.output, "load_test", [result], url=args.url,
+                      requests=args.requests, concurrency=args.concurrency)
+    return result
+
+
+if __name__ == "__main__":
+    main()
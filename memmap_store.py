@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""Memory-mapped storage for the train/test matrices of setup()
+
+`get_config('X_train')`, `get_config('X_train_transformed')` and
+`get_config('y_train_transformed')` are rebuilt as new in-memory pandas
+objects on every access: the train split is sliced out of `data` and the
+transformed frames go through the whole preprocessing pipeline again. With a
+large training set several full copies end up resident next to `data`.
+
+`MemmapClassificationExperiment` / `MemmapRegressionExperiment` accept a
+`memmap_dir` option in `setup()`. When it is set, once setup is done:
+
+- `data`, the raw train/test splits and the transformed train/test matrices
+  are written once to uncompressed Arrow IPC files in `memmap_dir`,
+- `get_config(...)` and the CV loop of `create_model` / `compare_models` /
+  `tune_model` get frames whose numeric columns are zero-copy views of the
+  memory-mapped files (read-only, paged in by the OS and evictable), instead
+  of fresh copies.
+
+Only string/categorical columns are materialized when a file is read. Folds
+are still sliced by scikit-learn during cross validation, as usual.
+
+Usage:
+
+```
+from memmap_store import MemmapRegressionExperiment
+
+s = MemmapRegressionExperiment()
+s.setup(data, target = 'charges', session_id = 123, memmap_dir = 'pycaret_memmap')
+s.get_config('X_train_transformed')
+```
+"""
+
+import os
+import pickle
+
+from pycaret.classification import ClassificationExperiment
+from pycaret.regression import RegressionExperiment
+
+from streaming_predict import _check_pyarrow
+
+
+class ArrowStore:
+    """Directory of DataFrames/Series stored as memory-mappable Arrow files.
+
+    Frames Arrow cannot represent (e.g. object columns with mixed types) are
+    pickled instead and loaded fully in memory.
+    """
+
+    def __init__(self, path):
+        _check_pyarrow()
+        self.path = os.fspath(path)
+        os.makedirs(self.path, exist_ok=True)
+        self._frames = {}
+
+    def _file(self, name, ext="arrow"):
+        return os.path.join(self.path, f"{name}.{ext}")
+
+    def __contains__(self, name):
+        return os.path.exists(self._file(name)) or os.path.exists(self._file(name, "pkl"))
+
+    def write(self, name, obj):
+        """Write a DataFrame or Series under ``name``, replacing any previous version."""
+        import pyarrow as pa
+
+        self._frames.pop(name, None)
+        frame = obj.to_frame() if obj.ndim == 1 else obj
+        for stale in (self._file(name), self._file(name, "pkl")):
+            if os.path.exists(stale):
+                os.remove(stale)
+        try:
+            table = pa.Table.from_pandas(frame)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            with open(self._file(name, "pkl"), "wb") as f:
+                pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+            return
+        # Series are flagged in the schema so they can be restored as such
+        table = table.replace_schema_metadata(
+            {**table.schema.metadata, b"series": b"1" if obj.ndim == 1 else b"0"}
+        )
+        tmp = self._file(name) + ".tmp"
+        with pa.OSFile(tmp, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp, self._file(name))
+
+    def read(self, name):
+        """Return the frame stored under ``name``, backed by the memory-mapped file."""
+        if name not in self._frames:
+            self._frames[name] = self._load(name)
+        # new container around the same (read-only) arrays, so adding or
+        # replacing columns on the result does not leak into the store
+        return self._frames[name].copy(deep=False)
+
+    def _load(self, name):
+        if os.path.exists(self._file(name, "pkl")):
+            with open(self._file(name, "pkl"), "rb") as f:
+                obj = pickle.load(f)
+        else:
+            import pyarrow as pa
+
+            table = pa.ipc.open_file(pa.memory_map(self._file(name), "r")).read_all()
+            # split_blocks keeps one numpy array per column, so numeric columns
+            # are views of the mapped buffers instead of a consolidated copy
+            obj = table.to_pandas(split_blocks=True)
+            if table.schema.metadata.get(b"series") == b"1":
+                obj = obj.iloc[:, 0]
+        return obj
+
+    def nbytes(self):
+        """Size of the stored files in bytes."""
+        return sum(
+            os.path.getsize(os.path.join(self.path, f)) for f in os.listdir(self.path)
+        )
+
+    def __getstate__(self):
+        # mapped frames are reopened after unpickling (e.g. load_experiment)
+        return {"path": self.path, "_frames": {}}
+
+
+class MemmapMixin:
+    """Adds the ``memmap_dir`` option to ``setup()`` of a supervised experiment."""
+
+    _memmap_store = None
+
+    def setup(self, data=None, *args, memmap_dir=None, **kwargs):
+        """
+        Same as ``setup``, with one extra option.
+
+
+        memmap_dir: str, default = None
+            Directory the raw and transformed train/test matrices are written
+            to. When set, ``get_config`` and the CV loop use memory-mapped views
+            of these files. None keeps pycaret's in-memory behaviour.
+
+        """
+        self._memmap_store = None
+        super().setup(data, *args, **kwargs)
+        if memmap_dir is not None:
+            self.memmap(memmap_dir)
+        return self
+
+    def memmap(self, memmap_dir):
+        """Write the matrices of an experiment that already ran setup to ``memmap_dir``."""
+        store = ArrowStore(memmap_dir)
+        self._memmap_store = None
+        store.write("data", self.data)
+        for split in ("train", "test"):
+            store.write(f"X_{split}", getattr(self, f"X_{split}"))
+            store.write(f"y_{split}", getattr(self, f"y_{split}"))
+            transformed = getattr(self, f"{split}_transformed")
+            store.write(f"y_{split}_transformed", transformed[self.target_param])
+            store.write(f"X_{split}_transformed", transformed.drop(columns=self.target_param))
+            del transformed
+        self._memmap_store = store
+        self.data = store.read("data")
+        self.logger.info(f"Train/test matrices memory-mapped from {memmap_dir}")
+        return store
+
+    def _stored(self, name):
+        store = self._memmap_store
+        if store is None or name not in store:
+            return getattr(super(MemmapMixin, self), name)
+        return store.read(name)
+
+    @property
+    def X_train(self):
+        """Feature set of the training set."""
+        return self._stored("X_train")
+
+    @property
+    def y_train(self):
+        """Target column of the training set."""
+        return self._stored("y_train")
+
+    @property
+    def X_test(self):
+        """Feature set of the test set."""
+        return self._stored("X_test")
+
+    @property
+    def y_test(self):
+        """Target column of the test set."""
+        return self._stored("y_test")
+
+    @property
+    def X_train_transformed(self):
+        """Transformed feature set of the training set."""
+        return self._stored("X_train_transformed")
+
+    @property
+    def y_train_transformed(self):
+        """Transformed target column of the training set."""
+        return self._stored("y_train_transformed")
+
+    @property
+    def X_test_transformed(self):
+        """Transformed feature set of the test set."""
+        return self._stored("X_test_transformed")
+
+    @property
+    def y_test_transformed(self):
+        """Transformed target column of the test set."""
+        return self._stored("y_test_transformed")
+
+
+class MemmapClassificationExperiment(MemmapMixin, ClassificationExperiment):
+    """ClassificationExperiment with the ``memmap_dir`` setup option."""
+
+
+class MemmapRegressionExperiment(MemmapMixin, RegressionExperiment):
+    """RegressionExperiment with the ``memmap_dir`` setup option."""
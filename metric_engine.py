@@ -0,0 +1,506 @@
+# -*- coding: utf-8 -*-
+"""Batch metric computation for the CV scoring grid
+
+Every fold of `create_model` / `compare_models` calls each metric of
+`get_metrics()` (and every `add_metric` callable) separately: each scorer
+runs its own `predict` / `predict_proba` on the held-out part, and every
+classification metric rebuilds its own confusion matrix, every regression
+metric its own residuals. `score_batch` scores a fitted pipeline on all
+metrics at once:
+
+- the estimator is called once per response method (`predict`,
+  `predict_proba`, `decision_function`) and the output is shared by all
+  metrics that need it,
+- the per-fold intermediates (confusion matrix, sorted scores for AUC,
+  residual vectors) live on a `FoldInputs` object and are computed the first
+  time a metric asks for them,
+- Accuracy, Recall, Precision, F1, Kappa, MCC and AUC (classification) and
+  MAE, MSE, RMSE, R2, RMSLE, MAPE (regression) are derived from these
+  intermediates with a few numpy reductions, with the same averaging, label
+  handling and error scores as pycaret's scorers,
+- any other metric is called as usual, on the shared predictions.
+
+`score_pipeline` of `parallel_compare.py` uses it, so the parallel, cached,
+halving and resumable versions of `compare_models` / `create_model` /
+`tune_model` all score their folds through this module.
+
+Custom metrics opt in to the shared intermediates with the `shared_inputs`
+decorator. The decorated function receives the `FoldInputs` of the fold
+instead of `(y_true, y_pred)`, and still works as a regular score function
+when pycaret calls it directly.
+
+Usage:
+
+```
+from metric_engine import shared_inputs
+
+@shared_inputs
+def custom_metric(inputs):
+    cm = inputs.confusion_matrix(labels = [0, 1])
+    return 100 * cm[1, 1] - 5 * cm[0, 1]
+
+add_metric('custom_metric', 'Custom Metric', custom_metric)
+```
+"""
+
+import functools
+import traceback
+import warnings
+from functools import cached_property
+
+import numpy as np
+from sklearn import metrics as skm
+from sklearn.base import is_regressor
+from sklearn.exceptions import FitFailedWarning
+from sklearn.metrics._scorer import _check_response_method, _Scorer
+from sklearn.utils._response import _get_response_values
+
+
+class FoldInputs:
+    """Targets and predictions of one fold, with the intermediates shared by the metrics.
+
+    ``y_pred`` is the output of the response method the metric asked for:
+    labels for ``predict``, scores for ``predict_proba`` / ``decision_function``.
+    Every intermediate is computed on first access and cached.
+    """
+
+    def __init__(self, y_true, y_pred):
+        self.y_true = np.asarray(y_true)
+        self.y_pred = np.asarray(y_pred)
+        self._cache = {}
+
+    # classification
+
+    @cached_property
+    def labels(self):
+        """Sorted union of the labels in ``y_true`` and ``y_pred``."""
+        return np.union1d(self.y_true, self.y_pred)
+
+    @cached_property
+    def _codes(self):
+        labels = self.labels
+        return np.searchsorted(labels, self.y_true), np.searchsorted(labels, self.y_pred)
+
+    def _confusion(self, labels):
+        if labels is None or np.array_equal(labels, self.labels):
+            true_codes, pred_codes = self._codes
+            n = len(self.labels)
+            return np.bincount(true_codes * n + pred_codes, minlength=n * n).reshape(n, n)
+        # explicit labels: move the rows/columns of the present labels to their
+        # position in ``labels``
+        position = {label: i for i, label in enumerate(labels)}
+        index = np.array([position.get(label, -1) for label in self.labels.tolist()])
+        if (index < 0).any():
+            raise _Unsupported("y contains labels that are not in ``labels``")
+        n = len(labels)
+        matrix = np.zeros((n, n), dtype=np.int64)
+        matrix[np.ix_(index, index)] = self.confusion_matrix()
+        return matrix
+
+    def confusion_matrix(self, labels=None):
+        """Confusion matrix (rows: true, columns: predicted) over ``labels``.
+
+        Defaults to the sorted labels present in ``y_true`` or ``y_pred``.
+        """
+        key = ("confusion", None if labels is None else tuple(np.asarray(labels).tolist()))
+        if key not in self._cache:
+            self._cache[key] = self._confusion(key[1])
+        return self._cache[key]
+
+    # scores (AUC)
+
+    @cached_property
+    def _class_index(self):
+        classes, inverse = np.unique(self.y_true, return_inverse=True)
+        return classes, inverse
+
+    def sorted_scores(self, column=None):
+        """``(order, ranks)`` of the scores (of ``column`` for 2d scores).
+
+        ``order`` is the argsort of the scores, ``ranks`` their average rank
+        (tied scores share a rank).
+        """
+        key = ("sorted_scores", column)
+        if key not in self._cache:
+            self._cache[key] = self._sorted_scores(column)
+        return self._cache[key]
+
+    def _sorted_scores(self, column):
+        scores = self.y_pred if column is None else self.y_pred[:, column]
+        order = np.argsort(scores, kind="mergesort")
+        sorted_ = scores[order]
+        # average rank of each run of tied scores
+        boundaries = np.flatnonzero(np.diff(sorted_)) + 1
+        starts = np.concatenate([[0], boundaries])
+        ends = np.concatenate([boundaries, [len(sorted_)]])
+        ranks = np.empty(len(sorted_), dtype=float)
+        ranks[order] = np.repeat((starts + ends + 1) / 2, ends - starts)
+        return order, ranks
+
+    # regression
+    # kept as (n, 1) columns in the dtype of the targets (e.g. float32), so the
+    # reductions are done exactly like sklearn's and give the same floats
+
+    @cached_property
+    def residuals(self):
+        """``y_pred - y_true``, as a column."""
+        return (self.y_pred - self.y_true).reshape(-1, 1)
+
+    @cached_property
+    def abs_residuals(self):
+        return np.abs(self.residuals)
+
+    @cached_property
+    def squared_residuals(self):
+        return self.residuals**2
+
+    @cached_property
+    def squared_log_residuals(self):
+        """Squared residuals of ``log1p(|y|)``, as in pycaret's RMSLE."""
+        log_true = np.log1p(np.abs(self.y_true))
+        return ((log_true - np.log1p(np.abs(self.y_pred))) ** 2).reshape(-1, 1)
+
+
+class _Unsupported(Exception):
+    """Raised by a batch formula for arguments it does not implement."""
+
+
+def shared_inputs(func):
+    """Decorator letting a custom metric use the shared per-fold intermediates.
+
+    ``func(inputs, **kwargs)`` receives the `FoldInputs` of the fold. The
+    decorated function keeps the ``(y_true, y_pred, **kwargs)`` signature
+    expected by ``add_metric``.
+    """
+
+    @functools.wraps(func)
+    def score_func(y_true, y_pred, **kwargs):
+        return func(FoldInputs(y_true, y_pred), **kwargs)
+
+    score_func.from_inputs = func
+    return score_func
+
+
+def _check_kwargs(kwargs, **allowed):
+    """Raise `_Unsupported` unless every kwarg has one of the ``allowed`` values."""
+    for key, value in kwargs.items():
+        if key not in allowed or (allowed[key] is not None and value not in allowed[key]):
+            raise _Unsupported(f"{key}={value!r}")
+
+
+def _divide(numerator, denominator):
+    """Element-wise division with 0 where the denominator is 0 (sklearn's zero_division)."""
+    numerator = np.asarray(numerator, dtype=float)
+    denominator = np.asarray(denominator, dtype=float)
+    out = np.zeros_like(numerator)
+    np.divide(numerator, denominator, out=out, where=denominator != 0)
+    return out
+
+
+def _accuracy(inputs, **kwargs):
+    _check_kwargs(kwargs)
+    cm = inputs.confusion_matrix()
+    return np.trace(cm) / cm.sum()
+
+
+def _per_class(metric, tp, support, predicted):
+    if metric == "recall":
+        return _divide(tp, support)
+    if metric == "precision":
+        return _divide(tp, predicted)
+    return _divide(2 * tp, support + predicted)
+
+
+def _prf(metric, inputs, average="binary", pos_label=1, labels=None):
+    if average == "binary":
+        labels = inputs.labels if labels is None else np.asarray(labels)
+        if len(inputs.labels) > 2:
+            raise _Unsupported("average='binary' on a multiclass target")
+        if pos_label not in labels:
+            if len(inputs.labels) == 2:
+                raise _Unsupported("pos_label not in labels")
+            return 0.0
+        labels = np.union1d(labels, inputs.labels)
+        cm = inputs.confusion_matrix(labels)
+        i = int(np.flatnonzero(labels == pos_label)[0])
+        return float(_per_class(metric, cm[i, i], cm[i].sum(), cm[:, i].sum()))
+
+    cm = inputs.confusion_matrix(labels)
+    tp, support, predicted = np.diag(cm), cm.sum(axis=1), cm.sum(axis=0)
+    if average == "micro":
+        return float(_per_class(metric, tp.sum(), support.sum(), predicted.sum()))
+    scores = _per_class(metric, tp, support, predicted)
+    if average == "macro":
+        return float(scores.mean())
+    if average == "weighted":
+        return float(_divide(np.dot(scores, support), support.sum()))
+    raise _Unsupported(f"average={average!r}")
+
+
+def _recall(inputs, **kwargs):
+    _check_kwargs(kwargs, average=None, pos_label=None, labels=None)
+    return _prf("recall", inputs, **kwargs)
+
+
+def _precision(inputs, **kwargs):
+    _check_kwargs(kwargs, average=None, pos_label=None, labels=None)
+    return _prf("precision", inputs, **kwargs)
+
+
+def _f1(inputs, **kwargs):
+    _check_kwargs(kwargs, average=None, pos_label=None, labels=None)
+    return _prf("f1", inputs, **kwargs)
+
+
+def _kappa(inputs, **kwargs):
+    _check_kwargs(kwargs, weights=(None,))
+    cm = inputs.confusion_matrix().astype(float)
+    n = cm.sum()
+    expected = np.dot(cm.sum(axis=1), cm.sum(axis=0)) / n**2
+    observed = np.trace(cm) / n
+    return (observed - expected) / (1 - expected)
+
+
+def _mcc(inputs, **kwargs):
+    _check_kwargs(kwargs)
+    cm = inputs.confusion_matrix().astype(float)
+    t_sum, p_sum = cm.sum(axis=1), cm.sum(axis=0)
+    n, correct = cm.sum(), np.trace(cm)
+    cov_ytyp = correct * n - np.dot(t_sum, p_sum)
+    cov_ypyp = n**2 - np.dot(p_sum, p_sum)
+    cov_ytyt = n**2 - np.dot(t_sum, t_sum)
+    if cov_ypyp * cov_ytyt == 0:
+        return 0.0
+    return cov_ytyp / np.sqrt(cov_ytyt * cov_ypyp)
+
+
+def _binary_auc(positive, ranks):
+    n_pos = positive.sum()
+    n_neg = len(positive) - n_pos
+    if n_pos == 0 or n_neg == 0:
+        raise ValueError(
+            "Only one class present in y_true. ROC AUC score is not defined in that case."
+        )
+    # Mann-Whitney U statistic: equal to the area under the ROC curve, ties included
+    return (ranks[positive].sum() - n_pos * (n_pos + 1) / 2) / (n_pos * n_neg)
+
+
+def _auc(inputs, average="macro", multi_class="raise", **kwargs):
+    _check_kwargs(kwargs)
+    classes, inverse = inputs._class_index
+    if inputs.y_pred.ndim == 1:
+        if len(classes) > 2:
+            raise _Unsupported("multiclass target with 1d scores")
+        _, ranks = inputs.sorted_scores()
+        return _binary_auc(inverse == len(classes) - 1, ranks)
+
+    if multi_class != "ovr" or average not in ("macro", "weighted"):
+        raise _Unsupported(f"multi_class={multi_class!r}, average={average!r}")
+    if len(classes) != inputs.y_pred.shape[1]:
+        raise ValueError(
+            "Number of classes in y_true not equal to the number of columns in 'y_score'"
+        )
+    if not np.allclose(1, inputs.y_pred.sum(axis=1)):
+        raise ValueError(
+            "Target scores need to be probabilities for multiclass roc_auc, i.e. they "
+            "should sum up to 1.0 over classes"
+        )
+    aucs = np.array(
+        [_binary_auc(inverse == i, inputs.sorted_scores(i)[1]) for i in range(len(classes))]
+    )
+    if average == "macro":
+        return aucs.mean()
+    return np.average(aucs, weights=np.bincount(inverse, minlength=len(classes)))
+
+
+def _mae(inputs, **kwargs):
+    _check_kwargs(kwargs, multioutput=("uniform_average",))
+    return float(np.average(inputs.abs_residuals, axis=0)[0])
+
+
+def _mse(inputs, squared=True, **kwargs):
+    _check_kwargs(kwargs, multioutput=("uniform_average",))
+    mse = np.average(inputs.squared_residuals, axis=0)[0]
+    return float(mse if squared else np.sqrt(mse))
+
+
+def _rmse(inputs, **kwargs):
+    return _mse(inputs, squared=False, **kwargs)
+
+
+def _r2(inputs, **kwargs):
+    _check_kwargs(kwargs, multioutput=("uniform_average",), force_finite=(True,))
+    numerator = inputs.squared_residuals.sum(axis=0, dtype=np.float64)[0]
+    y_true = inputs.y_true.reshape(-1, 1)
+    denominator = ((y_true - np.average(y_true, axis=0)) ** 2).sum(axis=0, dtype=np.float64)[0]
+    if denominator == 0:
+        return 1.0 if numerator == 0 else 0.0
+    return float(1 - numerator / denominator)
+
+
+def _rmsle(inputs, **kwargs):
+    _check_kwargs(kwargs, multioutput=("uniform_average",))
+    return float(np.sqrt(np.average(inputs.squared_log_residuals, axis=0)[0]))
+
+
+def _mape(inputs, **kwargs):
+    _check_kwargs(kwargs, multioutput=("uniform_average",))
+    mask = inputs.y_true != 0
+    return float(np.average(inputs.abs_residuals[mask, 0] / np.abs(inputs.y_true[mask]), axis=0))
+
+
+# score function -> batch formula on FoldInputs
+BATCH_FORMULAS = {
+    skm.accuracy_score: _accuracy,
+    skm.recall_score: _recall,
+    skm.precision_score: _precision,
+    skm.f1_score: _f1,
+    skm.cohen_kappa_score: _kappa,
+    skm.matthews_corrcoef: _mcc,
+    skm.roc_auc_score: _auc,
+    skm.mean_absolute_error: _mae,
+    skm.mean_squared_error: _mse,
+    skm.r2_score: _r2,
+}
+if hasattr(skm, "root_mean_squared_error"):
+    BATCH_FORMULAS[skm.root_mean_squared_error] = _rmse
+
+# pycaret's RMSLE / MAPE are closures created with the metric containers
+_CONTAINER_FORMULAS = {
+    "RMSLEMetricContainer.__init__.<locals>.root_mean_squared_log_error": _rmsle,
+    "MAPEMetricContainer.__init__.<locals>.mean_absolute_percentage_error": _mape,
+}
+
+
+def _resolve(score_func, y_true, kwargs):
+    """Unwrap pycaret's score function wrappers.
+
+    Returns ``(score_func, kwargs)`` with the kwargs the wrappers would have
+    passed to the innermost score function for this ``y_true``.
+    """
+    from pycaret.internal.metrics import (
+        BinaryMulticlassScoreFunc,
+        EncodedDecodedLabelsReplaceScoreFunc,
+        EncodedDecodedLabelsScoreFunc,
+    )
+
+    kwargs = dict(kwargs)
+    while True:
+        if isinstance(score_func, BinaryMulticlassScoreFunc):
+            if score_func.response_method:
+                raise _Unsupported("response_method set on the score function")
+            if score_func.kwargs_if_binary:
+                labels = kwargs.get("labels", None)
+                is_binary = (
+                    len(labels) <= 2
+                    if labels is not None
+                    else ((y_true == 0) | (y_true == 1)).all()
+                )
+                if is_binary:
+                    kwargs.update(score_func.kwargs_if_binary)
+        elif isinstance(score_func, EncodedDecodedLabelsScoreFunc):
+            if score_func.labels and y_true[0] in score_func.labels:
+                kwargs["labels"] = score_func.labels
+                kwargs["pos_label"] = score_func.labels[-1]
+        elif not isinstance(score_func, EncodedDecodedLabelsReplaceScoreFunc):
+            return score_func, kwargs
+        score_func = score_func.score_func
+
+
+def batch_formula(score_func):
+    """Batch formula for ``score_func``, or None if it has to be called directly."""
+    if hasattr(score_func, "from_inputs"):
+        return score_func.from_inputs
+    formula = BATCH_FORMULAS.get(score_func)
+    if formula is None and getattr(score_func, "__module__", "").startswith(
+        "pycaret.containers.metrics"
+    ):
+        formula = _CONTAINER_FORMULAS.get(getattr(score_func, "__qualname__", None))
+    return formula
+
+
+def _score_one(scorer, inputs, y):
+    try:
+        score_func, kwargs = _resolve(scorer._score_func, inputs.y_true, scorer._kwargs)
+        formula = batch_formula(score_func)
+        if formula is not None:
+            try:
+                return formula(inputs, **kwargs)
+            except _Unsupported:
+                pass
+        return scorer._score_func(y, inputs.y_pred, **scorer._kwargs)
+    except Exception:
+        if not hasattr(scorer, "error_score"):
+            raise
+        # same behaviour as pycaret's ScorerWithErrorScore
+        warnings.warn(
+            f"Scoring failed for {scorer!r}. The score on this fold is set to "
+            f"{scorer.error_score}. Details:\n{traceback.format_exc()}",
+            FitFailedWarning,
+        )
+        return scorer.error_score
+
+
+def score_batch(pipeline_with_model, X, y, metrics):
+    """
+    Score a fitted pipeline on all ``metrics`` at once, with one call to each
+    response method and the per-fold intermediates shared between metrics.
+
+
+    pipeline_with_model: Pipeline
+        Fitted preprocessing pipeline + estimator.
+
+
+    X: pd.DataFrame
+        Features to score on.
+
+
+    y: pd.Series
+        Target values to score on.
+
+
+    metrics: dict
+        ``{display_name: (scorer, greater_is_better)}``, as returned by
+        ``scoring_metrics`` of ``parallel_compare.py``.
+
+
+    Returns:
+        Dictionary ``{display_name: score}``, with the sign of "lower is
+        better" metrics flipped back (e.g. a positive MAE).
+
+    """
+    y_true = np.asarray(y)
+    responses, inputs, scores = {}, {}, {}
+    for name, (scorer, greater_is_better) in metrics.items():
+        if type(scorer) is not _Scorer and not hasattr(scorer, "error_score"):
+            # not a plain sklearn scorer (e.g. a custom scorer class): call as is
+            scores[name] = scorer(pipeline_with_model, X, y) * (1 if greater_is_better else -1)
+            continue
+        # same response method and pos_label resolution as sklearn's _Scorer._score
+        pos_label = None if is_regressor(pipeline_with_model) else scorer._get_pos_label()
+        try:
+            method = _check_response_method(pipeline_with_model, scorer._response_method)
+        except AttributeError:
+            # e.g. AUC of a hard voting classifier
+            if not hasattr(scorer, "error_score"):
+                raise
+            scores[name] = scorer.error_score
+            continue
+        method = method.__name__
+        key = (method, pos_label)
+        if key not in responses:
+            try:
+                responses[key] = _get_response_values(
+                    pipeline_with_model, X, response_method=method, pos_label=pos_label
+                )[0]
+            except Exception as ex:
+                responses[key] = ex
+        if isinstance(responses[key], Exception):
+            if not hasattr(scorer, "error_score"):
+                raise responses[key]
+            scores[name] = scorer.error_score
+            continue
+        if key not in inputs:
+            inputs[key] = FoldInputs(y_true, responses[key])
+        scores[name] = _score_one(scorer, inputs[key], y)
+    return scores
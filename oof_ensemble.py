@@ -0,0 +1,418 @@
+# -*- coding: utf-8 -*-
+"""Stacking and blending from cached out-of-fold predictions
+
+`stack_models(best_mae_models_top3)` cross validates a StackingRegressor: in
+every fold each base model is fit once on the training part and
+`meta_model_fold` more times to produce the meta-features, although
+`compare_models(sort='MAE', n_select=3)` just cross validated the same models
+on the same folds. `blend_models` refits every base model in every fold too.
+
+With `retain_oof=True`, `cached_compare_models` / `cached_create_model` of
+`fold_cache.py` keep the out-of-fold outputs of every model they cross
+validate (predictions, probabilities, decision scores) in the experiment's
+`OOFStore`. `oof_stack_models` and `oof_blend_models` build on them instead
+of refitting the base learners:
+
+- the meta-features of a training row are the outputs of the base models of
+  the fold in which the row was held out,
+- the stack is cross validated by fitting the meta-learner on the cached
+  meta-features of the training folds and scoring it on the held-out fold;
+  the blend is scored by combining the cached outputs, without any fit,
+- the returned model is a regular Stacking / Voting estimator made of the
+  base models passed in (fitted on the full training set, as returned by
+  `compare_models`) and, for the stack, the meta-learner fitted on all the
+  out-of-fold meta-features,
+- models without cached outputs are cross validated once through the fold
+  cache, and kept for the next call.
+
+The stack is scored with the usual out-of-fold stacking scheme: the
+meta-features of the training folds come from base models that have seen
+the held-out fold, where `stack_models` nests a second CV inside each fold,
+so the scores can differ slightly. With `restack=True` the original features
+are taken from the preprocessing pipeline fitted on the whole training set.
+
+Usage:
+
+```
+from fold_cache import cached_compare_models
+from oof_ensemble import oof_blend_models, oof_stack_models
+
+exp = get_current_experiment()
+top3 = cached_compare_models(exp, sort = 'MAE', n_select = 3, retain_oof = True)
+stacker = oof_stack_models(exp, top3)
+blender = oof_blend_models(exp, top3)
+```
+"""
+
+import copy
+import time
+
+import numpy as np
+from pycaret.utils.generic import MLUsecase
+from sklearn.base import BaseEstimator, clone
+from sklearn.exceptions import NotFittedError
+from sklearn.preprocessing import LabelEncoder
+from sklearn.utils import Bunch
+from sklearn.utils.metaestimators import available_if
+from sklearn.utils.validation import check_is_fitted
+
+from fold_cache import (
+    cached_cross_validate,
+    cached_fold,
+    create_model_grid,
+    experiment_fingerprint,
+    get_fold_cache,
+    get_oof_store,
+    oof_key,
+    store_oof,
+)
+from metric_engine import score_batch
+from parallel_compare import cv_splits, scoring_metrics
+
+
+def _estimator_has(attr):
+    return lambda self: hasattr(self.estimator, attr)
+
+
+class _TargetDecoder(BaseEstimator):
+    """Scores an estimator fitted on the transformed target like the experiment
+    pipeline does: predictions go back through the target transformers."""
+
+    def __init__(self, pipeline, estimator):
+        self.pipeline = pipeline
+        self.estimator = estimator
+
+    @property
+    def _estimator_type(self):
+        return getattr(self.estimator, "_estimator_type", None)
+
+    @property
+    def classes_(self):
+        return self.estimator.classes_
+
+    def predict(self, X):
+        return np.asarray(self.pipeline.inverse_transform(self.estimator.predict(X)))
+
+    @available_if(_estimator_has("predict_proba"))
+    def predict_proba(self, X):
+        return self.estimator.predict_proba(X)
+
+    @available_if(_estimator_has("decision_function"))
+    def decision_function(self, X):
+        return self.estimator.decision_function(X)
+
+
+class _Vote(BaseEstimator):
+    """Combination rule of VotingRegressor / VotingClassifier applied to the
+    stacked outputs of its members (one column, or one block of class
+    probabilities, per member)."""
+
+    def __init__(self, n_members, voting=None, weights=None, classes=None):
+        self.n_members = n_members
+        self.voting = voting
+        self.weights = weights
+        self.classes = classes
+
+    @property
+    def _estimator_type(self):
+        return "regressor" if self.classes is None else "classifier"
+
+    @property
+    def classes_(self):
+        return self.classes
+
+    def _average(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        if self.classes is None:
+            return np.average(X, axis=1, weights=self.weights)
+        X = X.reshape(len(X), self.n_members, len(self.classes))
+        return np.average(X, axis=1, weights=self.weights)
+
+    def predict(self, X):
+        if self.classes is None:
+            return self._average(X)
+        if self.voting == "soft":
+            return self.classes[np.argmax(self._average(X), axis=1)]
+        codes = np.searchsorted(self.classes, np.asarray(X))
+        weights = np.ones(self.n_members) if self.weights is None else self.weights
+        votes = np.zeros((len(codes), len(self.classes)))
+        for member in range(self.n_members):
+            np.add.at(votes, (np.arange(len(codes)), codes[:, member]), weights[member])
+        return self.classes[np.argmax(votes, axis=1)]
+
+    @available_if(lambda self: self.voting == "soft")
+    def predict_proba(self, X):
+        return self._average(X)
+
+
+def _member_names(exp, estimator_list):
+    """``(name, estimator)`` pairs named like ``stack_models`` / ``blend_models`` do."""
+    named = {}
+    for estimator in estimator_list:
+        name = original = exp._get_model_name(estimator)
+        suffix = 1
+        while name in named:
+            name = f"{original}_{suffix}"
+            suffix += 1
+        named[name] = estimator
+    return list(named.items())
+
+
+def collect_oof(exp, estimator_list, splits, fit_kwargs=None, data_fingerprint=None):
+    """Out-of-fold outputs of every estimator on ``splits``, from the OOFStore.
+
+    Estimators without stored outputs are cross validated through the fold
+    cache and stored. Returns ``(oofs, n_reused, n_fits)``.
+    """
+    data_fingerprint = data_fingerprint or experiment_fingerprint(exp)
+    store, cache = get_oof_store(exp), get_fold_cache(exp)
+    misses = cache.misses
+    oofs, n_reused = [], 0
+    for estimator in estimator_list:
+        oof = store.get(oof_key(data_fingerprint, estimator, splits), estimator, splits)
+        if oof is not None and len(oof["fold"]) != len(exp.X_train):
+            oof = None
+        if oof is None:
+            records = cached_cross_validate(exp, clone(estimator), splits, cache,
+                                            fit_kwargs=fit_kwargs,
+                                            data_fingerprint=data_fingerprint, oof=True)
+            oof = store_oof(exp, estimator, splits, records, data_fingerprint)
+        else:
+            n_reused += 1
+        oofs.append(oof)
+    return oofs, n_reused, cache.misses - misses
+
+
+def _fitted_members(exp, estimator_list, fit_kwargs=None, data_fingerprint=None):
+    """The estimators, those not fitted yet fitted on the full training set.
+
+    Returns ``(members, n_fits)``.
+    """
+    members, n_fits = [], 0
+    X, y = exp.X_train, exp.y_train
+    for estimator in estimator_list:
+        try:
+            check_is_fitted(estimator)
+        except NotFittedError:
+            data_fingerprint = data_fingerprint or experiment_fingerprint(exp)
+            full = cached_fold(exp, get_fold_cache(exp), data_fingerprint, estimator, X, y,
+                               np.arange(len(X)), None, {}, fit_kwargs=fit_kwargs)
+            estimator = copy.deepcopy(full["model"].steps[-1][1])
+            n_fits += 1
+        members.append(estimator)
+    return members, n_fits
+
+
+def stack_features(oof, method="auto", classification=True):
+    """Meta-features of one base model from its out-of-fold outputs, as
+    ``StackingClassifier`` / ``StackingRegressor`` build them.
+
+    Returns ``(method, 2d array)``.
+    """
+    if not classification:
+        method = "predict"
+    elif method == "auto":
+        method = next(m for m in ("predict_proba", "decision_function", "predict") if m in oof)
+    elif method not in oof:
+        raise ValueError(f"The base model has no {method} method.")
+    values = oof[method]
+    if values.ndim == 1:
+        values = values.reshape(-1, 1)
+    elif method == "predict_proba" and values.shape[1] == 2:
+        # the probabilities of a binary problem sum to one
+        values = values[:, 1:]
+    return method, values
+
+
+def _cross_validate_combiner(exp, combiner, features, y_fit, splits, covered, metrics):
+    """Fold scores of ``combiner`` fitted (if ``y_fit`` is given) on the meta-features
+    of the training folds and scored on the held-out fold."""
+    y = exp.y_train
+    fold_scores = []
+    for train, test in splits:
+        train, test = train[covered[train]], test[covered[test]]
+        if y_fit is not None:
+            combiner = clone(combiner).fit(features[train], y_fit[train])
+        decoder = _TargetDecoder(exp.pipeline, combiner)
+        fold_scores.append({"test": score_batch(decoder, features[test], y.iloc[test], metrics)})
+    return fold_scores
+
+
+def _publish(exp, model, fold_scores, metrics, fold, round, summary, verbose):
+    results = create_model_grid(fold_scores, list(metrics), round=round)
+    exp._display_container.append(results)
+    exp._master_model_container.append(
+        {"model": model, "scores": results, "cv": exp._get_cv_splitter(fold)}
+    )
+    exp.logger.info(summary)
+    if verbose:
+        print(summary)
+
+
+def oof_stack_models(
+    exp,
+    estimator_list,
+    meta_model=None,
+    meta_model_fold=5,
+    fold=None,
+    round=4,
+    method="auto",
+    restack=False,
+    fit_kwargs=None,
+    groups=None,
+    verbose=True,
+):
+    """
+    `stack_models` built on cached out-of-fold predictions: the meta-learner
+    is trained on the base models' out-of-fold outputs, the base models are
+    not refit.
+
+
+    exp: ClassificationExperiment or RegressionExperiment
+        Experiment on which ``setup()`` has been run.
+
+
+    estimator_list, meta_model, meta_model_fold, fold, round, method, restack, fit_kwargs, groups
+        Same meaning as in ``stack_models``. ``meta_model_fold`` is only set
+        on the returned estimator, no inner CV is run.
+
+
+    verbose: bool, default = True
+        When set to False, the timing summary is not printed.
+
+
+    Returns:
+        Trained StackingClassifier or StackingRegressor. The scoring grid is
+        available with ``pull()``.
+
+    """
+    start = time.time()
+    classification = exp._ml_usecase == MLUsecase.CLASSIFICATION
+    if meta_model is None:
+        definition = exp._all_models_internal["lr"]
+        meta_model = definition.class_def(**definition.args)
+    else:
+        meta_model = clone(meta_model)
+
+    splits = cv_splits(exp, fold=fold, groups=groups)
+    data_fingerprint = experiment_fingerprint(exp)
+    oofs, n_reused, n_fits = collect_oof(exp, estimator_list, splits, fit_kwargs,
+                                         data_fingerprint)
+    methods, columns = zip(*(stack_features(oof, method, classification) for oof in oofs))
+    Xt, yt = exp.pipeline.transform(exp.X_train, exp.y_train)
+    if restack:
+        columns += (Xt.to_numpy(dtype=np.float32),)
+    features = np.hstack(columns)
+    covered = np.all([oof["fold"] >= 0 for oof in oofs], axis=0)
+    yt = np.asarray(yt)
+
+    metrics = scoring_metrics(exp)
+    fold_scores = _cross_validate_combiner(exp, meta_model, features, yt, splits, covered,
+                                           metrics)
+
+    members, n_full = _fitted_members(exp, estimator_list, fit_kwargs, data_fingerprint)
+    named = _member_names(exp, members)
+    stacking = exp._all_models_internal["Stacking"].class_def
+    kwargs = dict(estimators=named, final_estimator=meta_model, cv="prefit",
+                  n_jobs=exp.gpu_n_jobs_param, passthrough=restack)
+    if classification:
+        kwargs["stack_method"] = method
+    # "prefit" sets up the fitted stack around the members; the meta-learner
+    # is then refit on the out-of-fold meta-features
+    model = stacking(**kwargs).fit(Xt, yt)
+    model.final_estimator_ = clone(meta_model).fit(features[covered], yt[covered])
+    model.set_params(cv=meta_model_fold)
+
+    n_folds = len(splits)
+    naive = len(members) * (meta_model_fold + 1) * (n_folds + 1)
+    summary = (
+        f"Stacked {len(members)} models ({', '.join(sorted(set(methods)))}) on out-of-fold "
+        f"predictions, {n_reused} of {len(members)} cached: {n_fits + n_full} base model "
+        f"fits ({naive} for stack_models) in {time.time() - start:.1f}s"
+    )
+    _publish(exp, model, fold_scores, metrics, fold, round, summary, verbose)
+    return model
+
+
+def oof_blend_models(
+    exp,
+    estimator_list,
+    fold=None,
+    round=4,
+    method="auto",
+    weights=None,
+    fit_kwargs=None,
+    groups=None,
+    verbose=True,
+):
+    """
+    `blend_models` built on cached out-of-fold predictions: the blend is
+    scored by combining the base models' out-of-fold outputs, the base
+    models are not refit.
+
+
+    exp: ClassificationExperiment or RegressionExperiment
+        Experiment on which ``setup()`` has been run.
+
+
+    estimator_list, fold, round, method, weights, fit_kwargs, groups
+        Same meaning as in ``blend_models``.
+
+
+    verbose: bool, default = True
+        When set to False, the timing summary is not printed.
+
+
+    Returns:
+        Trained VotingClassifier or VotingRegressor. The scoring grid is
+        available with ``pull()``.
+
+    """
+    start = time.time()
+    classification = exp._ml_usecase == MLUsecase.CLASSIFICATION
+    if weights is not None and len(weights) != len(estimator_list):
+        raise ValueError("weights parameter must have the same length as the estimator_list.")
+
+    splits = cv_splits(exp, fold=fold, groups=groups)
+    data_fingerprint = experiment_fingerprint(exp)
+    oofs, n_reused, n_fits = collect_oof(exp, estimator_list, splits, fit_kwargs,
+                                         data_fingerprint)
+    Xt, yt = exp.pipeline.transform(exp.X_train, exp.y_train)
+    classes = None
+    if classification:
+        if method == "auto":
+            method = "soft" if all("predict_proba" in oof for oof in oofs) else "hard"
+        classes = LabelEncoder().fit(yt).classes_
+    response = "predict_proba" if method == "soft" else "predict"
+    features = np.hstack([oof[response].reshape(len(Xt), -1) for oof in oofs])
+    covered = np.all([oof["fold"] >= 0 for oof in oofs], axis=0)
+
+    metrics = scoring_metrics(exp)
+    combiner = _Vote(len(oofs), method if classification else None, weights, classes)
+    fold_scores = _cross_validate_combiner(exp, combiner, features, None, splits, covered,
+                                           metrics)
+
+    members, n_full = _fitted_members(exp, estimator_list, fit_kwargs, data_fingerprint)
+    named = _member_names(exp, members)
+    voting = exp._all_models_internal["Voting"].class_def
+    kwargs = dict(estimators=named, n_jobs=exp.gpu_n_jobs_param, weights=weights)
+    if classification:
+        kwargs["voting"] = method
+    model = voting(**kwargs)
+    # the fitted state VotingClassifier / VotingRegressor.fit would set
+    model.estimators_ = members
+    model.named_estimators_ = Bunch(**dict(named))
+    if hasattr(members[0], "feature_names_in_"):
+        model.feature_names_in_ = members[0].feature_names_in_
+    if classification:
+        model.le_ = LabelEncoder().fit(yt)
+        model.classes_ = model.le_.classes_
+
+    n_folds = len(splits)
+    summary = (
+        f"Blended {len(members)} models on out-of-fold predictions, {n_reused} of "
+        f"{len(members)} cached: {n_fits + n_full} base model fits "
+        f"({len(members) * (n_folds + 1)} for blend_models) in {time.time() - start:.1f}s"
+    )
+    _publish(exp, model, fold_scores, metrics, fold, round, summary, verbose)
+    return model
@@ -0,0 +1,526 @@
+# -*- coding: utf-8 -*-
+"""Out-of-core setup() from Parquet/CSV files or chunk iterators
+
+`setup(data, target = 'charges', session_id = 123)` needs the whole dataset
+as one pandas DataFrame, so the regression and classification workflows
+cannot start from data larger than memory.
+
+`OutOfCoreRegressionExperiment` / `OutOfCoreClassificationExperiment` also
+accept, as `data`, a CSV file, a Parquet file or directory of Parquet files,
+an iterator of DataFrames or a callable returning one of those. `setup` then:
+
+- reads the source chunk by chunk (`chunksize` rows) in one streaming pass
+  that accumulates the row count, the mean / variance / min / max of the
+  numeric columns and the category counts of the other columns and of the
+  target of a classification,
+- keeps a uniform random sample of `sample_size` rows (or the rows of one
+  `shard=(index, count)`, for one worker of a data-parallel job), plus one row
+  for every category of the columns with at most `max_encoding_ohe`
+  categories, so that the encoders learn the full vocabulary,
+- runs pycaret's `setup` on that sample only, then replaces the statistics
+  the mean / mode imputers learned on the sample by the ones of the full
+  stream,
+- when the source can be read again (files, callables), streams it a second
+  time through the fitted preprocessing steps to fit the `normalize` scaler
+  (z-score, min-max, max-abs) with `partial_fit` on all the rows.
+
+The split, cross validation and model training use the sample. Transformers
+without streaming statistics (median imputation, robust scaling, PCA, ...)
+are fitted on the sample as usual. DataFrames are passed to pycaret's
+`setup` unchanged.
+
+Usage:
+
+```
+from out_of_core import OutOfCoreRegressionExperiment
+
+s = OutOfCoreRegressionExperiment()
+s.setup('insurance.parquet', target = 'charges', session_id = 123, sample_size = 100_000)
+s.stream_statistics.numeric
+```
+
+`python out_of_core.py insurance_large.csv --target charges --sample-size 100000`
+"""
+
+import argparse
+import copy
+import inspect
+import itertools
+import json
+import os
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from pycaret.classification import ClassificationExperiment
+from pycaret.regression import RegressionExperiment
+from pycaret.utils.generic import MLUsecase
+from sklearn.base import BaseEstimator, TransformerMixin, clone
+from sklearn.impute import SimpleImputer
+from sklearn.preprocessing import MaxAbsScaler, MinMaxScaler, StandardScaler
+
+from streaming_predict import iter_chunks
+
+DEFAULT_CHUNKSIZE = 100_000
+DEFAULT_SAMPLE_SIZE = 100_000
+# category counts of a column are dropped beyond this many distinct values
+MAX_CATEGORIES = 10_000
+
+# scalers of the normalize step that can be fitted chunk by chunk
+_PARTIAL_FIT_SCALERS = (StandardScaler, MinMaxScaler, MaxAbsScaler)
+
+
+class FrozenTransformer(BaseEstimator, TransformerMixin):
+    """Fitted transformer that ``fit`` leaves as it is.
+
+    ``create_model`` and ``finalize_model`` clone the experiment pipeline and
+    refit it on the sample; the steps holding statistics of the full stream
+    are wrapped in this class so that clones and refits keep those values.
+    Fitted attributes (``statistics_``, ``mean_``, ...) are read from the
+    wrapped transformer.
+    """
+
+    def __init__(self, transformer):
+        self.transformer = transformer
+
+    def __sklearn_clone__(self):
+        return copy.deepcopy(self)
+
+    def __getattr__(self, name):
+        if name.startswith("__") or name == "transformer":
+            raise AttributeError(name)
+        return getattr(self.transformer, name)
+
+    def fit(self, X, y=None, **fit_params):
+        return self
+
+    def transform(self, X):
+        return self.transformer.transform(X)
+
+
+def _fitted_state(step):
+    """Hash of the fitted attributes of the transformer of a pipeline step."""
+    transformer = getattr(step, "transformer", step)
+    transformer = getattr(transformer, "transformer", transformer)
+    return joblib.hash(
+        {k: v for k, v in vars(transformer).items() if k.endswith("_") and not k.startswith("_")}
+    )
+
+
+def is_reiterable(source):
+    """Whether ``iter_chunks(source)`` can be called more than once."""
+    return callable(source) or isinstance(source, (str, os.PathLike, pd.DataFrame))
+
+
+class StreamingStatistics:
+    """Column statistics accumulated chunk by chunk.
+
+    Numeric columns keep their count, mean, sum of squared deviations (merged
+    per chunk, Chan et al.), min and max; the other columns (and
+    ``categorical`` ones) their category counts, until they have more than
+    ``max_categories`` distinct values.
+    """
+
+    def __init__(self, categorical=(), max_categories=MAX_CATEGORIES):
+        self.categorical = set(categorical)
+        self.max_categories = max_categories
+        self.n_rows = 0
+        self._moments = None  # DataFrame: count, mean, m2, min, max per column
+        self._counts = {}  # column -> Series of counts, None when dropped
+
+    def _is_numeric(self, column):
+        return (
+            column.name not in self.categorical
+            and pd.api.types.is_numeric_dtype(column)
+            and not pd.api.types.is_bool_dtype(column)
+        )
+
+    def update(self, chunk):
+        """Add the rows of a DataFrame."""
+        self.n_rows += len(chunk)
+        numeric = [c for c in chunk if self._is_numeric(chunk[c])]
+        if numeric:
+            self._update_moments(chunk[numeric].astype(float))
+        for name in chunk:
+            if name not in numeric:
+                self._update_counts(chunk[name])
+
+    def _update_moments(self, frame):
+        count = frame.count()
+        mean = frame.mean()
+        moments = pd.DataFrame({
+            "count": count,
+            "mean": mean.fillna(0.0),
+            "m2": ((frame - mean) ** 2).sum(),
+            "min": frame.min(),
+            "max": frame.max(),
+        })
+        if self._moments is None:
+            self._moments = moments
+            return
+        a, b = self._moments.align(moments, join="outer", axis=0)
+        a[["count", "mean", "m2"]] = a[["count", "mean", "m2"]].fillna(0.0)
+        b[["count", "mean", "m2"]] = b[["count", "mean", "m2"]].fillna(0.0)
+        n = a["count"] + b["count"]
+        delta = b["mean"] - a["mean"]
+        weight = (b["count"] / n).fillna(0.0)
+        self._moments = pd.DataFrame({
+            "count": n,
+            "mean": a["mean"] + delta * weight,
+            "m2": a["m2"] + b["m2"] + delta ** 2 * a["count"] * weight,
+            "min": np.fmin(a["min"], b["min"]),
+            "max": np.fmax(a["max"], b["max"]),
+        })
+
+    def _update_counts(self, column):
+        counts = self._counts.get(column.name, ...)
+        if counts is None:
+            return
+        chunk_counts = column.value_counts(dropna=True)
+        if counts is not ...:
+            chunk_counts = counts.add(chunk_counts, fill_value=0).astype(int)
+        if len(chunk_counts) > self.max_categories:
+            chunk_counts = None
+        self._counts[column.name] = chunk_counts
+
+    @property
+    def numeric(self):
+        """DataFrame of count, missing, mean, std, var, min and max per numeric column."""
+        m = self._moments
+        if m is None:
+            return pd.DataFrame(columns=["count", "missing", "mean", "std", "var", "min", "max"])
+        var = m["m2"] / (m["count"] - 1).where(m["count"] > 1)
+        return pd.DataFrame({
+            "count": m["count"].astype(int),
+            "missing": (self.n_rows - m["count"]).astype(int),
+            "mean": m["mean"].where(m["count"] > 0),
+            "std": np.sqrt(var),
+            "var": var,
+            "min": m["min"],
+            "max": m["max"],
+        })
+
+    def categories(self, column):
+        """Counts of the categories of ``column``, most frequent first (None if not tracked)."""
+        counts = self._counts.get(column)
+        return None if counts is None else counts.sort_values(ascending=False, kind="stable")
+
+    def mode(self, column):
+        """Most frequent category; ties go to the smallest value, as in ``SimpleImputer``."""
+        counts = self._counts.get(column)
+        if counts is None or not len(counts):
+            return None
+        tied = counts.index[counts == counts.max()]
+        try:
+            return min(tied)
+        except TypeError:
+            return tied[0]
+
+    def fill_value(self, column, strategy):
+        """Full-data statistic for a ``SimpleImputer`` strategy, None when not available."""
+        if strategy == "mean" and self._moments is not None and column in self._moments.index:
+            if self._moments.loc[column, "count"] > 0:
+                return float(self._moments.loc[column, "mean"])
+        if strategy == "most_frequent":
+            return self.mode(column)
+        return None
+
+
+def stream_sample(source, sample_size=DEFAULT_SAMPLE_SIZE, shard=None, chunksize=DEFAULT_CHUNKSIZE,
+                  categorical=(), coverage=25, seed=None):
+    """
+    One streaming pass over ``source``: statistics and training sample.
+
+
+    source: str, path-like, DataFrame, iterable of DataFrames or callable
+        See ``streaming_predict.iter_chunks``.
+
+
+    sample_size: int or None, default = 100000
+        Number of rows kept, drawn uniformly without replacement. None keeps
+        every row (of the shard).
+
+
+    shard: tuple of (int, int), default = None
+        ``(index, count)``: keep only the rows whose position modulo
+        ``count`` is ``index`` before sampling.
+
+
+    chunksize: int, default = 100000
+        Rows per chunk read from files.
+
+
+    categorical: iterable of str, default = ()
+        Columns counted as categories even when numeric (e.g. the target
+        of a classification).
+
+
+    coverage: int, default = 25
+        Categories of columns with at most this many distinct values get at
+        least one row in the sample.
+
+
+    seed: int, default = None
+        Seed of the sampling.
+
+
+    Returns:
+        ``(StreamingStatistics, DataFrame)``. The sample is indexed by row
+        position in the source.
+
+    """
+    stats = StreamingStatistics(categorical)
+    rng = np.random.default_rng(seed)
+    reservoir, keys = None, np.empty(0)
+    seen = {}  # column -> categories with a covering row
+    covering = []  # frames of the rows covering new categories
+    position = 0
+    for chunk in iter_chunks(source, chunksize):
+        chunk = chunk.set_axis(pd.RangeIndex(position, position + len(chunk)))
+        position += len(chunk)
+
+        # one row for every category not seen yet
+        rows = set()
+        for name in chunk:
+            if stats._is_numeric(chunk[name]) or stats._counts.get(name, ...) is None:
+                continue
+            known = seen.setdefault(name, set())
+            if len(known) > coverage:
+                continue
+            column = chunk[name].dropna()
+            new = column[~column.isin(known)].drop_duplicates()[:coverage + 1 - len(known)]
+            known.update(new)
+            rows.update(new.index)
+        if rows:
+            covering.append(chunk.loc[sorted(rows)])
+        stats.update(chunk)
+
+        if shard is not None:
+            index, count = shard
+            chunk = chunk[chunk.index % count == index]
+        if sample_size is None:
+            reservoir = chunk if reservoir is None else pd.concat([reservoir, chunk])
+            continue
+        # bottom-k of uniform keys: a uniform sample without replacement,
+        # rows with a key above the current k-th smallest cannot enter
+        chunk_keys = rng.random(len(chunk))
+        if len(keys) >= sample_size:
+            mask = chunk_keys < keys[-1]
+            chunk, chunk_keys = chunk[mask], chunk_keys[mask]
+        if reservoir is not None:
+            chunk = pd.concat([reservoir, chunk])
+            chunk_keys = np.concatenate([keys, chunk_keys])
+        order = np.argsort(chunk_keys, kind="stable")[:sample_size]
+        reservoir, keys = chunk.iloc[order], chunk_keys[order]
+
+    if reservoir is None:
+        raise ValueError("The data source is empty.")
+    sample = pd.concat([reservoir, *covering])
+    return stats, sample[~sample.index.duplicated()].sort_index()
+
+
+class OutOfCoreMixin:
+    """Lets ``setup()`` of a supervised experiment stream its data from files or iterators."""
+
+    _stream_source = None
+    _stream_statistics = None
+    _stream_steps = ()
+
+    def setup(self, data=None, *args, sample_size=DEFAULT_SAMPLE_SIZE, shard=None,
+              chunksize=DEFAULT_CHUNKSIZE, **kwargs):
+        """
+        Same as ``setup``; ``data`` can also be a file, an iterator of
+        DataFrames or a callable returning one.
+
+
+        sample_size: int or None, default = 100000
+            Number of rows of a streamed source the experiment is set up with.
+            None keeps all the rows.
+
+
+        shard: tuple of (int, int), default = None
+            ``(index, count)``: set up with the rows whose position modulo
+            ``count`` is ``index`` only.
+
+
+        chunksize: int, default = 100000
+            Number of rows read at a time.
+
+        """
+        self._stream_source = self._stream_statistics = None
+        if data is None or isinstance(data, pd.DataFrame):
+            return super().setup(data, *args, **kwargs)
+
+        params = inspect.signature(super().setup).bind_partial(None, *args, **kwargs).arguments
+        target = params.get("target", -1)
+        source = data
+        if not isinstance(target, str):
+            # the column name is needed before streaming, put the first chunk back
+            chunks = iter_chunks(data, chunksize)
+            first = next(chunks)
+            target = first.columns[target]
+            source = data if is_reiterable(data) else itertools.chain([first], chunks)
+        categorical = [
+            *(params.get("categorical_features") or []),
+            *(params.get("ordinal_features") or {}),
+        ]
+        if self._ml_usecase == MLUsecase.CLASSIFICATION:
+            categorical.append(target)
+
+        start = time.perf_counter()
+        stats, sample = stream_sample(
+            source,
+            sample_size=sample_size,
+            shard=shard,
+            chunksize=chunksize,
+            categorical=categorical,
+            coverage=params.get("max_encoding_ohe", 25),
+            seed=params.get("session_id"),
+        )
+        params = {k: v for k, v in params.items() if k not in ("data", "target")}
+        super().setup(sample.reset_index(drop=True), target=target, **params)
+        self._stream_statistics = stats
+        self._stream_source = data if is_reiterable(data) else None
+        self.logger.info(
+            f"Streamed {stats.n_rows} rows in {time.perf_counter() - start:.2f}s, "
+            f"set up on a sample of {len(sample)}"
+        )
+        self.apply_stream_statistics()
+        return self
+
+    @property
+    def stream_statistics(self):
+        """``StreamingStatistics`` of the streamed source, None after a regular setup."""
+        return self._stream_statistics
+
+    def apply_stream_statistics(self, chunksize=DEFAULT_CHUNKSIZE):
+        """
+        Replace the statistics the pipeline learned on the sample by the ones
+        of the full source: mean / mode imputation values, and the
+        ``normalize`` scaler when the source can be streamed again. The
+        updated transformers are wrapped in ``FrozenTransformer``, so the
+        models trained and finalized from the experiment keep them.
+
+
+        chunksize: int, default = 100000
+            Number of rows read at a time when fitting the scaler.
+
+
+        Returns:
+            List of the names of the updated pipeline steps.
+
+        """
+        stats = self._stream_statistics
+        updated = []
+        steps = self.pipeline.steps
+        for i, (name, step) in enumerate(steps):
+            transformer = getattr(step, "transformer", None)
+            if isinstance(transformer, FrozenTransformer):
+                transformer = step.transformer = transformer.transformer
+            if isinstance(transformer, SimpleImputer) and hasattr(transformer, "statistics_"):
+                values = transformer.statistics_.copy()
+                for j, column in enumerate(getattr(transformer, "feature_names_in_", [])):
+                    value = stats.fill_value(column, transformer.strategy)
+                    if value is not None:
+                        values[j] = value
+                transformer.statistics_ = values
+                step.transformer = FrozenTransformer(transformer)
+                updated.append(name)
+            elif isinstance(transformer, _PARTIAL_FIT_SCALERS) and self._stream_source is not None:
+                scaler = clone(transformer)
+                for X in self._transformed_chunks(steps[:i], chunksize):
+                    scaler.partial_fit(X[step._include])
+                # keep the fitted object, other references to it see the update
+                transformer.__dict__.update(scaler.__dict__)
+                step.transformer = FrozenTransformer(transformer)
+                updated.append(name)
+        self._stream_steps = tuple(updated)
+        self.logger.info(f"Statistics of the full data applied to {updated}")
+        return updated
+
+    def check_stream_statistics(self, pipeline):
+        """
+        Steps updated by ``apply_stream_statistics`` whose fitted values
+        ``pipeline`` does not carry.
+
+
+        pipeline: Pipeline
+            Pipeline from ``finalize_model``, ``save_model`` / ``load_model``
+            or ``create_model(...)`` with the pipeline.
+
+
+        Returns:
+            List of step names, empty when ``pipeline`` uses the statistics
+            of the full source.
+
+        """
+        steps = dict(pipeline.steps)
+        return [
+            name for name in self._stream_steps
+            if name not in steps
+            or _fitted_state(steps[name]) != _fitted_state(self.pipeline.named_steps[name])
+        ]
+
+    def _transformed_chunks(self, steps, chunksize):
+        """Stream the features of the source through ``steps`` of the pipeline."""
+        columns = list(self.X_train.columns)
+        for chunk in iter_chunks(self._stream_source, chunksize):
+            X = chunk[columns].astype(self.X_train.dtypes.to_dict(), errors="ignore")
+            for _, step in steps:
+                if getattr(step, "_train_only", False):
+                    continue
+                X = step.transform(X)
+                if isinstance(X, tuple):
+                    X = X[0]
+            yield X
+
+
+class OutOfCoreClassificationExperiment(OutOfCoreMixin, ClassificationExperiment):
+    """ClassificationExperiment whose ``setup`` can stream its data."""
+
+
+class OutOfCoreRegressionExperiment(OutOfCoreMixin, RegressionExperiment):
+    """RegressionExperiment whose ``setup`` can stream its data."""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("data", help="CSV file, Parquet file or directory")
+    parser.add_argument("--target", required=True)
+    parser.add_argument("--task", choices=("regression", "classification"), default="regression")
+    parser.add_argument("--sample-size", type=int, default=DEFAULT_SAMPLE_SIZE)
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE)
+    parser.add_argument("--normalize", action="store_true")
+    parser.add_argument("--session-id", type=int, default=123)
+    args = parser.parse_args(argv)
+
+    from benchmark_regression import PeakRSSSampler
+
+    experiment = {
+        "regression": OutOfCoreRegressionExperiment,
+        "classification": OutOfCoreClassificationExperiment,
+    }[args.task]()
+    sampler = PeakRSSSampler()
+    sampler.start()
+    start = time.perf_counter()
+    experiment.setup(args.data, target=args.target, session_id=args.session_id,
+                     normalize=args.normalize, sample_size=args.sample_size,
+                     chunksize=args.chunksize, verbose=False)
+    setup_s = time.perf_counter() - start
+    setup_peak_rss = sampler.stop()
+    # the statistics must survive the clone and refit of finalize_model
+    final = experiment.finalize_model(experiment.create_model("dummy", verbose=False))
+    print(json.dumps({
+        "rows": experiment.stream_statistics.n_rows,
+        "sample_rows": len(experiment.data),
+        "setup_s": round(setup_s, 3),
+        "setup_peak_rss_mb": round(setup_peak_rss / 2**20, 1),
+        "stream_steps": list(experiment._stream_steps),
+        "stream_steps_lost_by_finalize_model": experiment.check_stream_statistics(final),
+    }, indent=2))
+    print(experiment.stream_statistics.numeric)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""Process-pool compare_models
+
+`compare_models()` fits every estimator of the model library one after another,
+one CV fold at a time. `parallel_compare_models` schedules every
+(estimator, fold) pair as an independent task on a local process pool, merges
+the fold scores back into the same scoring grid that `pull()` returns and
+selects the best model(s) with the same ranking rule as the sequential path.
+
+Usage, after `setup()` in tutorial_binary_classification.py or
+tutorial_multiclass_classification.py:
+
+```
+from parallel_compare import parallel_compare_models
+best = parallel_compare_models(get_current_experiment(), n_jobs = -1)
+pull()
+```
+
+The helpers in this module (`model_library`, `make_estimator`,
+`library_estimators`, `cv_splits`, `fit_fold`, `score_pipeline` and
+`build_compare_grid`) are the building blocks of the other compare_models
+variants in this repository.
+"""
+
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.metrics import get_scorer
+
+from experiment_trace import span
+from metric_engine import score_batch
+
+
+def model_library(exp, include=None, exclude=None, turbo=True):
+    """Return the estimators compare_models would evaluate, in the same order."""
+    if include is not None and exclude is not None:
+        raise TypeError(
+            "Cannot use exclude parameter when include is used to compare models."
+        )
+    if include:
+        return list(include)
+    library = [k for k, v in exp._all_models.items() if v.is_turbo or not turbo]
+    if exclude:
+        library = [m for m in library if m not in exclude]
+    return library
+
+
+def make_estimator(exp, model, **kwargs):
+    """Return ``(model_id, full_name, untrained_estimator)`` for an id or estimator."""
+    if isinstance(model, str):
+        definition = exp._all_models_internal[model]
+        estimator = definition.class_def(**{**definition.args, **kwargs})
+        return model, definition.name, estimator
+    estimator = clone(model).set_params(**kwargs)
+    return exp._get_model_id(estimator), exp._get_model_name(estimator), estimator
+
+
+def library_estimators(exp, include=None, exclude=None, turbo=True):
+    """Yield ``(model, model_id, full_name, untrained_estimator)`` for every compared model.
+
+    Estimators that are not in pycaret's library (or are listed twice) get the
+    id ``f"{full_name}_{position}"``, so each keeps its own row in the grid.
+    """
+    taken = set()
+    for position, model in enumerate(model_library(exp, include, exclude, turbo)):
+        model_id, name, estimator = make_estimator(exp, model)
+        if model_id is None or model_id in taken:
+            model_id = f"{name}_{position}"
+        taken.add(model_id)
+        yield model, model_id, name, estimator
+
+
+def cv_splits(exp, fold=None, groups=None, X=None, y=None):
+    """Materialize the (train_idx, test_idx) pairs of the experiment's fold generator."""
+    X = exp.X_train if X is None else X
+    y = exp.y_train if y is None else y
+    cv = exp._get_cv_splitter(fold)
+    groups = exp._get_groups(groups, data=X)
+    return [(train, test) for train, test in cv.split(X, y, groups=groups)]
+
+
+def scoring_metrics(exp):
+    """Return ``{display_name: (scorer, greater_is_better)}`` for the active metrics."""
+    return {
+        v.display_name: (get_scorer(v.scorer), v.greater_is_better)
+        for v in exp._all_metrics.values()
+    }
+
+
+def fit_fold(pipeline, estimator, X, y, train, fit_kwargs=None):
+    """Fit a clone of ``pipeline + estimator`` on the rows ``train``.
+
+    Mirrors `create_model`: the preprocessing pipeline is refit inside the fold.
+
+    Returns ``(fitted_pipeline, fit_time)``.
+    """
+    from pycaret.internal.pipeline import estimator_pipeline, get_pipeline_fit_kwargs
+
+    with estimator_pipeline(pipeline, estimator) as pipeline_with_model:
+        pipeline_with_model = clone(pipeline_with_model)
+    fit_kwargs = get_pipeline_fit_kwargs(pipeline_with_model, fit_kwargs or {})
+
+    start = time.time()
+    pipeline_with_model.fit(X.iloc[train], y.iloc[train], **fit_kwargs)
+    return pipeline_with_model, time.time() - start
+
+
+def score_pipeline(pipeline_with_model, X, y, metrics):
+    """Score a fitted pipeline, flipping the sign of "lower is better" scorers back.
+
+    Predictions and per-fold intermediates are shared between the metrics, see
+    `metric_engine.score_batch`.
+    """
+    with span("score", "score", rows=len(X)):
+        return score_batch(pipeline_with_model, X, y, metrics)
+
+
+def fit_and_score_fold(pipeline, estimator, X, y, train, test, metrics, fit_kwargs=None):
+    """Fit ``pipeline + estimator`` on one fold and score it on the held-out part.
+
+    Returns ``(scores, fit_time, fitted_pipeline)``.
+    """
+    with span("fold", "fold", model=type(estimator).__name__, rows=len(train)):
+        pipeline_with_model, fit_time = fit_fold(pipeline, estimator, X, y, train, fit_kwargs)
+        scores = score_pipeline(pipeline_with_model, X.iloc[test], y.iloc[test], metrics)
+    return scores, fit_time, pipeline_with_model
+
+
+def failed_on_every_fold(fold_scores):
+    """Whether every fold of a model failed, i.e. was scored 0.0 on every metric."""
+    return not any(any(scores.values()) for scores in fold_scores)
+
+
+def build_compare_grid(exp, fold_scores, names, fit_times, sort, round=4, skipna=True):
+    """Average fold scores into the compare_models grid, sorted like the sequential path.
+
+    ``fold_scores`` maps model id to a list of per-fold score dicts, ``names``
+    and ``fit_times`` map model id to the full model name and total fit time.
+    With ``skipna=False`` a NaN fold score makes the mean NaN, as in the
+    time-series ``compare_models``.
+    """
+    metric = exp._get_metric_by_name_or_id(sort)
+    if metric is None:
+        raise ValueError(
+            "Sort method not supported. See docstring for list of available parameters."
+        )
+    rows = []
+    for model_id, scores in fold_scores.items():
+        row = pd.DataFrame(scores).mean(skipna=skipna).to_dict()
+        row["Model"] = names[model_id]
+        row["TT (Sec)"] = np.round(fit_times[model_id], 2)
+        rows.append(pd.Series(row, name=model_id))
+
+    columns = ["Model"] + [v.display_name for v in exp._all_metrics.values()] + ["TT (Sec)"]
+    grid = pd.DataFrame(rows, columns=columns)
+    grid[columns[1:]] = grid[columns[1:]].astype(float)
+    grid = grid.round(round)
+    return grid.sort_values(by=metric.display_name, ascending=not metric.greater_is_better)
+
+
+def finalize_selection(exp, grid, models, n_select=1, fit_kwargs=None, groups=None, fit=None):
+    """Refit the selected rows of ``grid`` on the full train set and publish the grid.
+
+    ``fit(model_id)`` can replace the default refit through ``create_model``.
+    The grid is appended to the experiment's display container so `pull()`
+    returns it, exactly like after a sequential `compare_models()`.
+    """
+    n = min(len(grid), abs(n_select))
+    selected = grid.index[:n] if n_select >= 0 else grid.index[len(grid) - n:]
+
+    sorted_models = []
+    for model_id in selected:
+        if fit is not None:
+            sorted_models.append(fit(model_id))
+            continue
+        model, _ = exp._create_model(
+            estimator=models[model_id],
+            system=False,
+            verbose=False,
+            cross_validation=False,
+            predict=False,
+            fit_kwargs=fit_kwargs,
+            groups=groups,
+        )
+        sorted_models.append(model)
+
+    exp._display_container.append(grid)
+    return sorted_models[0] if len(sorted_models) == 1 else sorted_models
+
+
+# state shipped once to every worker process by the pool initializer
+_WORKER_STATE = {}
+
+
+def _init_worker(pipeline, X, y, metrics, fit_kwargs):
+    _WORKER_STATE.update(
+        pipeline=pipeline, X=X, y=y, metrics=metrics, fit_kwargs=fit_kwargs
+    )
+
+
+def _run_task(model_id, fold_idx, estimator, train, test):
+    s = _WORKER_STATE
+    try:
+        scores, fit_time, _ = fit_and_score_fold(
+            s["pipeline"], estimator, s["X"], s["y"], train, test, s["metrics"], s["fit_kwargs"]
+        )
+        return model_id, fold_idx, scores, fit_time, None
+    except Exception:
+        return model_id, fold_idx, None, 0.0, traceback.format_exc()
+
+
+def parallel_compare_models(
+    exp,
+    include=None,
+    exclude=None,
+    fold=None,
+    round=4,
+    sort=None,
+    n_select=1,
+    turbo=True,
+    errors="ignore",
+    fit_kwargs=None,
+    groups=None,
+    n_jobs=None,
+):
+    """
+    Process-pool version of `compare_models`. Every (estimator, fold) pair is
+    an independent task, so short linear/kNN fits no longer wait on each other.
+
+
+    exp: ClassificationExperiment or RegressionExperiment
+        Experiment on which ``setup()`` has been run. With the functional API
+        use ``get_current_experiment()``.
+
+
+    include, exclude, fold, round, sort, n_select, turbo, errors, fit_kwargs, groups
+        Same meaning as in ``compare_models``. ``sort`` defaults to 'Accuracy'
+        for classification and 'R2' for regression.
+
+
+    n_jobs: int, default = None
+        Number of worker processes. None or -1 uses all CPUs. Estimators are
+        run single threaded inside the workers to avoid oversubscription.
+
+
+    Returns:
+        Trained model or list of trained models, depending on ``n_select``.
+        The scoring grid is available with ``pull()``.
+
+    """
+    if errors not in ("ignore", "raise"):
+        raise ValueError("errors parameter must be one of: ignore, raise.")
+    if sort is None:
+        sort = "R2" if "R2" in scoring_metrics(exp) else "Accuracy"
+    if n_jobs is None or n_jobs < 0:
+        n_jobs = os.cpu_count()
+
+    X, y = exp.X_train, exp.y_train
+    splits = cv_splits(exp, fold=fold, groups=groups)
+    metrics = scoring_metrics(exp)
+
+    models, names, tasks = {}, {}, []
+    for model, model_id, name, estimator in library_estimators(exp, include, exclude, turbo):
+        models[model_id], names[model_id] = model, name
+        worker_estimator = clone(estimator)
+        if "n_jobs" in worker_estimator.get_params():
+            worker_estimator.set_params(n_jobs=1)
+        for fold_idx, (train, test) in enumerate(splits):
+            tasks.append((model_id, fold_idx, worker_estimator, train, test))
+
+    results = {model_id: [None] * len(splits) for model_id in models}
+    fit_times = {model_id: 0.0 for model_id in models}
+    with ProcessPoolExecutor(
+        max_workers=n_jobs,
+        initializer=_init_worker,
+        initargs=(exp.pipeline, X, y, metrics, fit_kwargs),
+    ) as pool:
+        futures = [pool.submit(_run_task, *task) for task in tasks]
+        for future in futures:
+            model_id, fold_idx, scores, fit_time, error = future.result()
+            if error is not None:
+                if errors == "raise":
+                    raise RuntimeError(
+                        f"create_model() failed for model {models[model_id]}. {error}"
+                    )
+                exp.logger.warning(f"{model_id} failed on fold {fold_idx}:\n{error}")
+                # same as compare_models(errors='ignore'), i.e. error_score=0.0
+                scores = {name: 0.0 for name in metrics}
+            results[model_id][fold_idx] = scores
+            fit_times[model_id] += fit_time
+
+    # models that failed (or scored 0.0) on every fold are left out of the grid
+    fold_scores = {k: v for k, v in results.items() if not failed_on_every_fold(v)}
+    grid = build_compare_grid(exp, fold_scores, names, fit_times, sort, round=round)
+    return finalize_selection(
+        exp, grid, models, n_select=n_select, fit_kwargs=fit_kwargs, groups=groups
+    )
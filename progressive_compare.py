@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""Progressive-sampling compare_models
+
+On large training sets `compare_models()` spends most of its time cross
+validating estimators that a small sample already ranks poorly.
+`progressive_compare_models` screens them on growing samples instead:
+
+- every candidate is cross validated on a stratified sample of
+  `fractions[0]` of the training rows (classes, or deciles of the target for
+  regression, keep their proportions),
+- the best `top_k[0]` are cross validated again on `fractions[1]` of the rows,
+  and so on; the samples are nested, each one contains the previous,
+- only the models left after the last fraction (the finalists) are cross
+  validated on the full training set, as in `compare_models`.
+
+Between consecutive stages the Spearman and Kendall rank correlations of the
+`sort` metric are computed on the models evaluated in both, so you can check
+that the small samples rank the models like the larger ones. With
+`audit=True` every model is evaluated at every stage (no time saved, same
+selection) to measure the correlation on the whole library once.
+
+`pull()` returns the grid with the finalists first, followed by the screened
+out models with their scores on the last sample they were evaluated on, the
+number of training rows (`Rows`) and the stage (`Stage`). The correlations
+are in `pull().attrs['rank_correlation']`.
+
+Usage:
+
+```
+from progressive_compare import progressive_compare_models
+best = progressive_compare_models(get_current_experiment(), fractions = (0.05, 0.2), top_k = (6, 3))
+pull().attrs['rank_correlation']
+```
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+from pycaret.utils.generic import MLUsecase
+from scipy.stats import kendalltau, spearmanr
+
+from parallel_compare import (
+    build_compare_grid,
+    cv_splits,
+    failed_on_every_fold,
+    finalize_selection,
+    fit_and_score_fold,
+    library_estimators,
+    scoring_metrics,
+)
+
+
+def stratified_order(y, random_state=None, bins=None):
+    """Permutation of the rows whose prefixes are stratified samples of ``y``.
+
+    Classes (or ``bins`` quantile bins of a continuous target) are shuffled
+    and interleaved, so the first ``n`` positions of the order hold every
+    stratum in proportion for any ``n``.
+    """
+    rng = np.random.default_rng(random_state)
+    y = pd.Series(np.asarray(y))
+    if bins and pd.api.types.is_numeric_dtype(y) and y.nunique() > bins:
+        strata = pd.qcut(y.rank(method="first"), bins, labels=False)
+    else:
+        strata = y.astype(str)
+    # position of a row inside its shuffled stratum, scaled to [0, 1)
+    noise = rng.random(len(y))
+    within = pd.Series(noise).groupby(strata.to_numpy()).rank(method="first") - 1
+    sizes = strata.map(strata.value_counts()).to_numpy()
+    key = (within.to_numpy() + rng.random(len(y))) / sizes
+    return np.argsort(key, kind="stable")
+
+
+def stage_rows(n_rows, fractions, min_rows=500):
+    """Number of training rows of each sampling stage, the last one being ``n_rows``."""
+    rows = []
+    for fraction in fractions:
+        n = min(max(int(round(fraction * n_rows)), min_rows), n_rows)
+        if n < n_rows and (not rows or n > rows[-1]):
+            rows.append(n)
+    return rows + [n_rows]
+
+
+def rank_correlation(previous, current):
+    """Spearman and Kendall correlations of two ``{model_id: score}`` on their common models."""
+    common = [k for k in previous if k in current]
+    if len(common) < 3:
+        return {"Models": len(common), "Spearman": np.nan, "Kendall": np.nan}
+    a = [previous[k] for k in common]
+    b = [current[k] for k in common]
+    return {
+        "Models": len(common),
+        "Spearman": float(spearmanr(a, b)[0]),
+        "Kendall": float(kendalltau(a, b)[0]),
+    }
+
+
+def progressive_compare_models(
+    exp,
+    include=None,
+    exclude=None,
+    fold=None,
+    round=4,
+    sort=None,
+    n_select=1,
+    turbo=True,
+    errors="ignore",
+    fit_kwargs=None,
+    groups=None,
+    fractions=(0.05, 0.2),
+    top_k=(6, 3),
+    min_rows=500,
+    audit=False,
+    verbose=True,
+):
+    """
+    Progressive-sampling version of `compare_models`: all candidates are
+    cross validated on a small stratified sample, only the best ones on
+    larger samples and on the full training set.
+
+
+    exp: ClassificationExperiment or RegressionExperiment
+        Experiment on which ``setup()`` has been run. With the functional API
+        use ``get_current_experiment()``.
+
+
+    include, exclude, fold, round, sort, n_select, turbo, errors, fit_kwargs, groups
+        Same meaning as in ``compare_models``. ``sort`` defaults to 'Accuracy'
+        for classification and 'R2' for regression.
+
+
+    fractions: sequence of float, default = (0.05, 0.2)
+        Fractions of the training rows of the sampling stages, increasing.
+        Fractions reaching the full training set are dropped.
+
+
+    top_k: int or sequence of int, default = (6, 3)
+        Number of models kept after each stage (one value per fraction, an
+        int applies to all). At least ``abs(n_select)`` are always kept.
+
+
+    min_rows: int, default = 500
+        Minimum number of rows of a sample.
+
+
+    audit: bool, default = False
+        Evaluate every model at every stage. The selection is the same, the
+        rank correlations then cover the whole library.
+
+
+    verbose: bool, default = True
+        When set to False, the stage summary is not printed.
+
+
+    Returns:
+        Trained model or list of trained models, depending on ``n_select``.
+        The scoring grid is available with ``pull()``.
+
+    """
+    if errors not in ("ignore", "raise"):
+        raise ValueError("errors parameter must be one of: ignore, raise.")
+    if sort is None:
+        sort = "R2" if "R2" in scoring_metrics(exp) else "Accuracy"
+    sort_metric = exp._get_metric_by_name_or_id(sort)
+    if sort_metric is None:
+        raise ValueError(
+            "Sort method not supported. See docstring for list of available parameters."
+        )
+    keep_high = sort_metric.greater_is_better == (n_select >= 0)
+
+    X, y = exp.X_train, exp.y_train
+    metrics = scoring_metrics(exp)
+    rows = stage_rows(len(X), fractions, min_rows)
+    if isinstance(top_k, int):
+        top_k = [top_k] * (len(rows) - 1)
+    top_k = list(top_k)[:len(rows) - 1]
+    if len(top_k) < len(rows) - 1:
+        raise ValueError("top_k must have one value per fraction.")
+    classification = exp._ml_usecase == MLUsecase.CLASSIFICATION
+    order = stratified_order(y, random_state=exp.seed, bins=None if classification else 10)
+
+    models, names, estimators = {}, {}, {}
+    for model, model_id, name, estimator in library_estimators(exp, include, exclude, turbo):
+        models[model_id], names[model_id], estimators[model_id] = model, name, estimator
+
+    stage_scores = []  # per stage: {model_id: [fold scores]}
+    fit_times = {model_id: 0.0 for model_id in models}
+    eliminated_in = {}
+    alive = list(models)
+    correlations = []
+    n_fits = 0
+    start = time.time()
+
+    for stage, n_rows in enumerate(rows, start=1):
+        stage_groups = groups
+        if n_rows < len(X):
+            # nested: every sample holds the rows of the previous ones
+            index = np.sort(order[:n_rows])
+            X_stage, y_stage = X.iloc[index], y.iloc[index]
+            if groups is not None and not isinstance(groups, str):
+                # array-like groups have one value per training row
+                stage_groups = (groups.iloc[index] if hasattr(groups, "iloc")
+                                else np.asarray(groups)[index])
+        else:
+            X_stage, y_stage = X, y
+        splits = cv_splits(exp, fold=fold, groups=stage_groups, X=X_stage, y=y_stage)
+        evaluate = list(models) if audit else alive
+        scores = {}
+        for model_id in evaluate:
+            scores[model_id] = []
+            for fold_idx, (train, test) in enumerate(splits):
+                try:
+                    fold_result, fit_time, _ = fit_and_score_fold(
+                        exp.pipeline, estimators[model_id], X_stage, y_stage, train, test,
+                        metrics, fit_kwargs,
+                    )
+                except Exception as ex:
+                    if errors == "raise":
+                        raise RuntimeError(
+                            f"create_model() failed for model {models[model_id]}. {ex}"
+                        )
+                    exp.logger.warning(f"{model_id} failed on fold {fold_idx}: {ex}")
+                    fold_result, fit_time = {name: 0.0 for name in metrics}, 0.0
+                scores[model_id].append(fold_result)
+                fit_times[model_id] += fit_time
+                n_fits += 1
+        stage_scores.append(scores)
+
+        # models that failed (or scored 0.0) on every fold are dropped, as in
+        # parallel_compare_models
+        alive = [k for k in alive if not failed_on_every_fold(scores[k])]
+        means = {
+            k: np.mean([s[sort_metric.display_name] for s in v])
+            for k, v in scores.items() if not failed_on_every_fold(v)
+        }
+        if stage > 1:
+            previous = stage_scores[-2]
+            previous_means = {
+                k: np.mean([s[sort_metric.display_name] for s in v])
+                for k, v in previous.items()
+            }
+            correlations.append({
+                "From": stage - 1, "To": stage,
+                "Rows From": rows[stage - 2], "Rows To": n_rows,
+                **rank_correlation(previous_means, means),
+            })
+        if stage == len(rows):
+            break
+        ranked = sorted(alive, key=means.get, reverse=keep_high)
+        n_keep = max(abs(n_select), top_k[stage - 1])
+        for model_id in ranked[n_keep:]:
+            eliminated_in[model_id] = stage
+        alive = ranked[:n_keep]
+
+    final = stage_scores[-1]
+    grid = build_compare_grid(
+        exp, {k: final[k] for k in alive}, names, fit_times, sort, round=round
+    )
+    models_out = finalize_selection(
+        exp, grid, models, n_select=n_select, fit_kwargs=fit_kwargs, groups=groups
+    )
+
+    parts = [grid.assign(Rows=rows[-1], Stage=len(rows))]
+    for stage in sorted(set(eliminated_in.values()), reverse=True):
+        out = [k for k, s in eliminated_in.items() if s == stage]
+        screened = build_compare_grid(
+            exp, {k: stage_scores[stage - 1][k] for k in out}, names, fit_times, sort,
+            round=round,
+        )
+        parts.append(screened.assign(Rows=rows[stage - 1], Stage=stage))
+    report = pd.concat(parts)
+    report.attrs["rank_correlation"] = pd.DataFrame(
+        correlations,
+        columns=["From", "To", "Rows From", "Rows To", "Models", "Spearman", "Kendall"],
+    )
+    # replace the finalists-only grid finalize_selection published
+    exp._display_container[-1] = report
+
+    full_fits = len(models) * len(cv_splits(exp, fold=fold, groups=groups))
+    summary = (
+        f"Stages on {rows} rows, {len(alive)} of {len(models)} models cross validated "
+        f"on the full training set, {n_fits} fold fits ({full_fits} for compare_models) "
+        f"in {time.time() - start:.1f}s"
+    )
+    exp.logger.info(summary)
+    if verbose:
+        print(summary)
+        if correlations:
+            print(report.attrs["rank_correlation"].round(3).to_string(index=False))
+    return models_out
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+"""Content-addressed cache for setup()
+
+The tutorials call `setup(data, target = 'charges', session_id = 123)` several
+times on the same DataFrame with identical arguments, and every call refits the
+whole imputation/encoding/split pipeline. `cached_setup` keys a disk cache on a
+hash of the input data and the setup arguments:
+
+- on a miss it runs `setup` and stores the fitted experiment (split indices,
+  fold generator, fitted transformers) with `save_experiment`,
+- on a hit it restores the experiment with
+  `load_experiment(..., preprocess_data=False)` together with the prepared
+  dataset setup produced (dtype conversion, index handling), so nothing is
+  refit.
+
+The transformed train/test frames behind `get_config('X_train_transformed')`
+are computed lazily by pycaret through the pipeline's joblib `memory`.
+`cached_setup` points that memory at the same cache directory, so after the
+first access they are loaded from disk instead of being recomputed.
+
+Entries are evicted least-recently-used first once the cache grows past
+`max_size_mb`.
+
+Usage:
+
+```
+from pycaret.regression import *
+from setup_cache import cached_setup
+
+s = cached_setup(RegressionExperiment, data, target = 'charges', session_id = 123)
+set_current_experiment(s)
+```
+"""
+
+import hashlib
+import os
+import shutil
+import time
+
+import joblib
+import pandas as pd
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pycaret_setup")
+
+# setup arguments that change what is printed or logged, not what is fitted
+_IGNORED_SETUP_ARGS = {"verbose", "html", "memory", "log_experiment", "experiment_name"}
+
+
+def fingerprint_frame(df):
+    """Return a stable hex digest of a DataFrame's values, index, columns and dtypes."""
+    h = hashlib.sha256()
+    h.update(repr(list(df.columns)).encode())
+    h.update(repr([str(t) for t in df.dtypes]).encode())
+    h.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return h.hexdigest()
+
+
+def setup_key(exp_class, data, **setup_kwargs):
+    """Cache key for ``exp_class().setup(data, **setup_kwargs)``."""
+    import pycaret
+
+    kwargs = {k: v for k, v in setup_kwargs.items() if k not in _IGNORED_SETUP_ARGS}
+    for k, v in kwargs.items():
+        if isinstance(v, pd.DataFrame):
+            kwargs[k] = fingerprint_frame(v)
+    h = hashlib.sha256()
+    h.update(f"{exp_class.__module__}.{exp_class.__name__}".encode())
+    h.update(pycaret.__version__.encode())
+    h.update(fingerprint_frame(data).encode())
+    h.update(joblib.hash(kwargs).encode())
+    return h.hexdigest()[:32]
+
+
+def _dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class SetupCache:
+    """Directory of cached experiments with an LRU size cap.
+
+    Each entry is a sub directory named after its key holding
+    ``experiment.pkl`` and the prepared dataset ``data.pkl``. The entry's
+    modification time is refreshed on every hit and is what the LRU eviction
+    orders by. ``pipeline/`` holds pycaret's joblib memory (fitted
+    transformers and transformed frames) shared by all entries.
+    """
+
+    ENTRY_FILE = "experiment.pkl"
+    DATA_FILE = "data.pkl"
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size_mb=2048):
+        self.cache_dir = cache_dir
+        self.max_size_mb = max_size_mb
+        self.entries_dir = os.path.join(cache_dir, "entries")
+        self.memory_dir = os.path.join(cache_dir, "pipeline")
+        os.makedirs(self.entries_dir, exist_ok=True)
+        os.makedirs(self.memory_dir, exist_ok=True)
+
+    @property
+    def max_bytes(self):
+        return int(self.max_size_mb * 2**20)
+
+    def _entry_path(self, key):
+        return os.path.join(self.entries_dir, key, self.ENTRY_FILE)
+
+    def entries(self):
+        """Return ``[(key, last_used, size_bytes)]``, least recently used first."""
+        out = []
+        for key in os.listdir(self.entries_dir):
+            path = self._entry_path(key)
+            if os.path.exists(path):
+                out.append((key, os.path.getmtime(path), _dir_size(os.path.dirname(path))))
+        return sorted(out, key=lambda e: e[1])
+
+    def size(self):
+        """Total size of the cache in bytes."""
+        return _dir_size(self.cache_dir)
+
+    def memory(self):
+        """Joblib memory to pass as ``setup(memory=...)``, bounded by the remaining budget."""
+        from pycaret.internal.memory import FastMemory
+
+        entries_size = sum(e[2] for e in self.entries())
+        return FastMemory(
+            self.memory_dir, verbose=0, bytes_limit=max(self.max_bytes - entries_size, 0)
+        )
+
+    def load(self, exp_class, key):
+        path = self._entry_path(key)
+        if not os.path.exists(path):
+            return None
+        data = pd.read_pickle(os.path.join(os.path.dirname(path), self.DATA_FILE))
+        exp = exp_class.load_experiment(path, data=data, preprocess_data=False)
+        now = time.time()
+        os.utime(path, (now, now))
+        return exp
+
+    def store(self, exp, key):
+        path = self._entry_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        exp.data.to_pickle(os.path.join(os.path.dirname(path), self.DATA_FILE))
+        # the experiment file is written last, it marks the entry as complete
+        tmp = path + ".tmp"
+        exp.save_experiment(tmp)
+        os.replace(tmp, path)
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits in ``max_size_mb``.
+
+        The joblib memory is trimmed last, with its own LRU policy.
+        Returns the list of evicted keys.
+        """
+        evicted = []
+        total = self.size()
+        for key, _, size in self.entries():
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.entries_dir, key), ignore_errors=True)
+            total -= size
+            evicted.append(key)
+        if total > self.max_bytes:
+            self.memory().reduce_size()
+        return evicted
+
+    def clear(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.makedirs(self.entries_dir, exist_ok=True)
+        os.makedirs(self.memory_dir, exist_ok=True)
+
+
+def cached_setup(exp, data, cache=None, **setup_kwargs):
+    """
+    Run ``setup`` through the content-addressed cache.
+
+
+    exp: experiment class or instance
+        e.g. ``RegressionExperiment``. On a miss, ``setup`` runs on this
+        instance (or on a new one if a class is passed); on a hit a restored
+        experiment is returned instead.
+
+
+    data: pandas.DataFrame
+        Same as the ``data`` argument of ``setup``.
+
+
+    cache: SetupCache, default = None
+        Cache to use. None uses ``SetupCache()`` in ``~/.cache/pycaret_setup``.
+
+
+    **setup_kwargs:
+        Passed to ``setup``.
+
+
+    Returns:
+        Experiment object on which setup has been run.
+
+    """
+    cache = cache or SetupCache()
+    exp_class = exp if isinstance(exp, type) else type(exp)
+    key = setup_key(exp_class, data, **setup_kwargs)
+
+    loaded = cache.load(exp_class, key)
+    if loaded is not None:
+        return loaded
+
+    exp = exp_class() if isinstance(exp, type) else exp
+    setup_kwargs.setdefault("memory", cache.memory())
+    exp.setup(data, **setup_kwargs)
+    cache.store(exp, key)
+    return exp
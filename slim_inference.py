@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""Minimal-dependency inference for saved pipelines
+
+Scoring containers only run `load_model('my_first_pipeline')` and
+`predict_model`, but unpickling a pycaret pipeline imports the experiment
+machinery (pycaret, imbalanced-learn, category_encoders, the plotting stack,
+...). This module splits training and inference:
+
+- `export_model` (run once where pycaret is installed) compiles a loaded
+  pipeline with `FastPredictor.from_pipeline` into lookup tables, fill values
+  and scaler vectors plus the fitted estimator, and pickles that. The file
+  references only numpy, pandas, scikit-learn and the estimator's own library,
+  which is checked when exporting,
+- `load_model` / `predict_model` (the scoring side) import nothing else and
+  return the same `prediction_label` / `prediction_score` columns as pycaret's
+  `predict_model`,
+- `check_parity` compares the output with the full `predict_model` on a
+  dataset, and `footprint` measures import time, peak memory and size on disk
+  of the imported packages for both paths in fresh interpreters.
+
+Pipelines with a step `FastPredictor` cannot compile are rejected by
+`export_model` with ``NotImplementedError``.
+
+Usage:
+
+`python slim_inference.py export my_first_pipeline my_first_pipeline_slim`
+
+`python slim_inference.py predict my_first_pipeline_slim new_data.csv predictions.csv`
+
+`python slim_inference.py parity my_first_pipeline my_first_pipeline_slim new_data.csv`
+
+`python slim_inference.py footprint my_first_pipeline my_first_pipeline_slim new_data.csv`
+"""
+
+import argparse
+import io
+import json
+import os
+import pickle
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+from sklearn.base import is_classifier
+
+from fast_predictor import FastPredictor
+
+# packages the scoring side must not need
+TRAINING_MODULES = ("pycaret", "imblearn", "category_encoders")
+
+LABEL_COLUMN = "prediction_label"
+SCORE_COLUMN = "prediction_score"
+
+
+class _SlimUnpickler(pickle.Unpickler):
+    """Unpickler refusing classes of the training stack."""
+
+    def find_class(self, module, name):
+        if module.split(".")[0] in TRAINING_MODULES:
+            raise pickle.UnpicklingError(
+                f"{module}.{name} belongs to the training stack and cannot be loaded "
+                "by the slim inference loader."
+            )
+        return super().find_class(module, name)
+
+
+def export_model(pipeline, model_name):
+    """
+    Compile a pipeline returned by ``load_model`` / ``finalize_model`` and save
+    it for the slim loader.
+
+
+    pipeline: Pipeline
+        Fitted pycaret pipeline (preprocessing steps and estimator).
+
+
+    model_name: str
+        Name of the file, ``.pkl`` is appended like in ``save_model``.
+
+
+    Returns:
+        The compiled ``FastPredictor``.
+
+    """
+    model = FastPredictor.from_pipeline(pipeline)
+    payload = pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)
+    # fail at export time, not in the scoring container
+    _SlimUnpickler(io.BytesIO(payload)).load()
+    with open(f"{model_name}.pkl", "wb") as f:
+        f.write(payload)
+    return model
+
+
+def load_model(model_name):
+    """Load a model saved by ``export_model`` (``.pkl`` is appended to the name)."""
+    with open(f"{model_name}.pkl", "rb") as f:
+        return _SlimUnpickler(f).load()
+
+
+def predict_model(model, data, raw_score=False, round=4):
+    """
+    Score ``data`` with a model loaded by ``load_model``.
+
+
+    model: FastPredictor
+        Model loaded with ``load_model``.
+
+
+    data: pandas.DataFrame
+        Records to score. Columns the model was not trained on are kept in the
+        output but not used.
+
+
+    raw_score: bool, default = False
+        When set to True, the probability of every class is returned
+        (``prediction_score_<class>``) instead of the probability of the
+        predicted class. Ignored for regression.
+
+
+    round: int, default = 4
+        Number of decimal places the probabilities are rounded to.
+
+
+    Returns:
+        ``data`` with the ``prediction_label`` (and ``prediction_score``)
+        columns appended, as in pycaret's ``predict_model``.
+
+    """
+    X = data[model.input_columns]
+    features = model.transform_frame(X)
+    pred = np.nan_to_num(model.estimator.predict(features))
+    output = data.copy()
+    if not is_classifier(model.estimator):
+        output[LABEL_COLUMN] = pred
+        return output
+
+    proba = model.estimator.predict_proba(features)
+    if model.classes is not None:
+        output[LABEL_COLUMN] = model.classes[np.asarray(pred).astype(int)]
+    else:
+        output[LABEL_COLUMN] = pred
+    if raw_score:
+        # class names when the pipeline encoded the target, positions otherwise
+        labels = model.classes if model.classes is not None else range(proba.shape[1])
+        columns = [f"{SCORE_COLUMN}_{c}" for c in labels]
+        scores = pd.DataFrame(proba, index=output.index, columns=columns)
+        return pd.concat([output, scores.round(round)], axis=1)
+    # probability of the predicted class
+    column = np.searchsorted(model.estimator.classes_, pred)
+    output[SCORE_COLUMN] = np.round(proba[np.arange(len(proba)), column], round)
+    return output
+
+
+def check_parity(model, pipeline, data, raw_score=False, rtol=1e-6, atol=1e-8):
+    """Compare ``predict_model`` of this module with pycaret's on ``data``.
+
+    Needs pycaret. Returns a dict with the number of rows and the maximum
+    difference per prediction column; raises ``AssertionError`` on a mismatch.
+    """
+    from streaming_predict import experiment_for
+
+    kwargs = {"raw_score": raw_score} if is_classifier(model.estimator) else {}
+    expected = experiment_for(pipeline).predict_model(
+        pipeline, data=data, verbose=False, **kwargs
+    )
+    got = predict_model(model, data, raw_score=raw_score)
+    columns = [c for c in expected.columns if c.startswith(LABEL_COLUMN)
+               or c.startswith(SCORE_COLUMN)]
+    assert columns == [c for c in got.columns if c in columns], "prediction columns differ"
+    report = {"rows": len(got)}
+    for column in columns:
+        e, g = expected[column].to_numpy(), got[column].to_numpy()
+        if np.issubdtype(e.dtype, np.number) and np.issubdtype(g.dtype, np.number):
+            np.testing.assert_allclose(g, e, rtol=rtol, atol=atol, err_msg=column)
+            report[column] = float(np.abs(g - e).max()) if len(e) else 0.0
+        else:
+            mismatches = int((e.astype(str) != g.astype(str)).sum())
+            assert mismatches == 0, f"{mismatches} values of {column} differ"
+            report[column] = mismatches
+    return report
+
+
+_FOOTPRINT = """
+import json, os, resource, sys, time
+sys.path.insert(0, {repo!r})
+start = time.perf_counter()
+{imports}
+imported = time.perf_counter()
+import pandas as pd
+data = pd.read_csv({data!r})
+model = {load}
+loaded = time.perf_counter()
+{predict}
+done = time.perf_counter()
+
+sizes = {{}}
+for name in {{m.split(".")[0] for m in list(sys.modules)}} - set(sys.stdlib_module_names):
+    path = getattr(sys.modules.get(name), "__file__", None)
+    if not path or os.path.dirname(path) == {repo!r}:
+        continue
+    if os.path.basename(path).startswith("__init__."):
+        path = os.path.dirname(path)
+    files = [path] if os.path.isfile(path) else [
+        os.path.join(d, f) for d, _, fs in os.walk(path) for f in fs
+    ]
+    sizes[name] = sum(os.path.getsize(f) for f in files if os.path.isfile(f))
+print(json.dumps({{
+    "import_s": imported - start,
+    "load_s": loaded - imported,
+    "predict_s": done - loaded,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "modules": len(sys.modules),
+    "packages": sorted(sizes),
+    "packages_mb": sum(sizes.values()) / 2**20,
+}}))
+"""
+
+_PATHS = {
+    "full": dict(
+        imports="from pycaret.regression import load_model\n"
+                "from streaming_predict import experiment_for",
+        predict="experiment_for(model).predict_model(model, data=data, verbose=False)",
+    ),
+    "slim": dict(
+        imports="from slim_inference import load_model, predict_model",
+        predict="predict_model(model, data)",
+    ),
+}
+
+
+def footprint(pipeline_name, slim_name, data, python=None):
+    """
+    Measure the full and the slim scoring path, each in a fresh interpreter.
+
+
+    pipeline_name: str
+        Name of the pipeline saved with ``save_model``.
+
+
+    slim_name: str
+        Name of the same pipeline saved with ``export_model``.
+
+
+    data: str
+        CSV file to score.
+
+
+    python: str, default = None
+        Interpreter to run. None uses the current one.
+
+
+    Returns:
+        Dictionary ``{'full': {...}, 'slim': {...}}`` with import / load /
+        predict times, peak RSS (MB), number of modules, the third-party
+        packages imported and their size on disk (MB).
+
+    """
+    repo = os.path.dirname(os.path.abspath(__file__))
+    result = {}
+    for path, name in (("full", pipeline_name), ("slim", slim_name)):
+        code = _FOOTPRINT.format(
+            repo=repo,
+            data=os.path.abspath(data),
+            load=f"load_model({os.path.abspath(name)!r}"
+                 + (", verbose=False)" if path == "full" else ")"),
+            **_PATHS[path],
+        )
+        out = subprocess.run(
+            [python or sys.executable, "-c", code], capture_output=True, text=True, check=True
+        )
+        result[path] = json.loads(out.stdout.strip().splitlines()[-1])
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="compile a saved pipeline (needs pycaret)")
+    export.add_argument("model", help="model name passed to load_model (without .pkl)")
+    export.add_argument("output", help="name of the slim model (without .pkl)")
+    predict = commands.add_parser("predict", help="score a CSV file with a slim model")
+    predict.add_argument("model", help="slim model name (without .pkl)")
+    predict.add_argument("data")
+    predict.add_argument("output")
+    predict.add_argument("--raw-score", action="store_true")
+    for name in ("parity", "footprint"):
+        sub = commands.add_parser(name, help=f"{name} of the slim model vs the pipeline")
+        sub.add_argument("model", help="model name passed to load_model (without .pkl)")
+        sub.add_argument("slim", help="slim model name (without .pkl)")
+        sub.add_argument("data")
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        from pycaret.internal.persistence import load_model as load_pipeline
+
+        export_model(load_pipeline(args.model, verbose=False), args.output)
+        print(f"Slim model written to {args.output}.pkl")
+    elif args.command == "predict":
+        model = load_model(args.model)
+        predict_model(model, pd.read_csv(args.data), raw_score=args.raw_score).to_csv(
+            args.output, index=False
+        )
+    elif args.command == "parity":
+        from pycaret.internal.persistence import load_model as load_pipeline
+
+        pipeline = load_pipeline(args.model, verbose=False)
+        print(check_parity(load_model(args.slim), pipeline, pd.read_csv(args.data)))
+    else:
+        print(json.dumps(footprint(args.model, args.slim, args.data), indent=2))
+
+
+if __name__ == "__main__":
+    main()
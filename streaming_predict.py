@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""Streaming, chunked predict_model
+
+`predict_model(best, data = new_data)` needs the whole dataset in memory and
+returns a full copy of it. `predict_stream` scores a pipeline saved with
+`save_model` chunk by chunk:
+
+- the input is an iterator of DataFrames or a CSV/Parquet file path,
+- every chunk goes through the same `predict_model` as the tutorials,
+- predictions are appended to the output file as soon as a chunk is scored,
+
+so peak memory is bounded by the chunk size instead of the dataset size.
+
+Usage:
+
+```
+from streaming_predict import predict_stream
+
+loaded_best_pipeline = load_model('my_first_pipeline')
+predict_stream(loaded_best_pipeline, 'new_data.csv', 'predictions.csv', chunksize = 100_000)
+```
+
+or from the command line:
+
+`python streaming_predict.py my_first_pipeline new_data.csv predictions.parquet --chunksize 100000`
+"""
+
+import argparse
+import os
+import time
+
+import pandas as pd
+from sklearn.base import is_classifier
+
+PARQUET_SUFFIXES = (".parquet", ".pq")
+
+
+def _check_pyarrow():
+    from pycaret.utils._dependencies import _check_soft_dependencies
+
+    _check_soft_dependencies("pyarrow", extra=None, severity="error")
+
+
+def iter_chunks(source, chunksize=100_000, columns=None):
+    """Yield DataFrames of at most ``chunksize`` rows from ``source``.
+
+    ``source`` is a CSV file, a Parquet file or directory of Parquet files, a
+    single DataFrame, an iterable of DataFrames (which are passed through as
+    they are) or a callable returning one of those. ``columns`` restricts
+    what is read from files.
+    """
+    if callable(source):
+        source = source()
+    if isinstance(source, pd.DataFrame):
+        for start in range(0, len(source), chunksize):
+            yield source.iloc[start:start + chunksize]
+    elif isinstance(source, (str, os.PathLike)):
+        path = os.fspath(source)
+        if path.lower().endswith(PARQUET_SUFFIXES) or os.path.isdir(path):
+            _check_pyarrow()
+            import pyarrow.dataset as ds
+
+            dataset = ds.dataset(path, format="parquet")
+            for batch in dataset.to_batches(batch_size=chunksize, columns=columns):
+                if batch.num_rows:
+                    yield batch.to_pandas()
+        else:
+            yield from pd.read_csv(path, chunksize=chunksize, usecols=columns)
+    else:
+        yield from source
+
+
+class ChunkWriter:
+    """Append DataFrames to a CSV or Parquet file, one chunk at a time.
+
+    The schema of the first chunk is used for the whole file.
+    """
+
+    def __init__(self, path):
+        self.path = os.fspath(path)
+        self.parquet = self.path.lower().endswith(PARQUET_SUFFIXES)
+        self._writer = None
+        self._columns = None
+        if self.parquet:
+            _check_pyarrow()
+
+    def write(self, df):
+        if self._columns is None:
+            self._columns = list(df.columns)
+        df = df[self._columns]
+        if self.parquet:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            self._writer.write_table(table.cast(self._writer.schema))
+        else:
+            df.to_csv(self.path, mode="a" if self._writer else "w",
+                      header=self._writer is None, index=False)
+            self._writer = True
+
+    def close(self):
+        if self.parquet and self._writer is not None:
+            self._writer.close()
+        self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def experiment_for(pipeline):
+    """Return an empty experiment of the module that can score ``pipeline``."""
+    if is_classifier(pipeline._final_estimator):
+        from pycaret.classification import ClassificationExperiment
+
+        return ClassificationExperiment()
+    from pycaret.regression import RegressionExperiment
+
+    return RegressionExperiment()
+
+
+def predict_stream(
+    pipeline,
+    source,
+    output,
+    chunksize=100_000,
+    keep_columns=None,
+    raw_score=False,
+    experiment=None,
+    verbose=True,
+):
+    """
+    Score ``source`` chunk by chunk with a pipeline from ``load_model`` and
+    write the predictions incrementally to ``output``.
+
+
+    pipeline: sklearn.pipeline.Pipeline
+        Pipeline returned by ``load_model``.
+
+
+    source: str, pandas.DataFrame or iterable of pandas.DataFrame
+        CSV/Parquet path, frame or iterator of chunks to score.
+
+
+    output: str
+        CSV or Parquet (``.parquet`` or ``.pq``) file the predictions are written to.
+
+
+    chunksize: int, default = 100000
+        Number of rows read and scored at a time. Ignored when ``source`` is
+        already an iterator of chunks.
+
+
+    keep_columns: list of str, default = None
+        Input columns written next to the predictions. None keeps all of them.
+
+
+    raw_score: bool, default = False
+        Same as in ``predict_model`` (classification only).
+
+
+    experiment: ClassificationExperiment or RegressionExperiment, default = None
+        Experiment whose ``predict_model`` is used. None picks an empty one
+        from the type of the final estimator.
+
+
+    verbose: bool, default = True
+        When set to False, the summary is not printed.
+
+
+    Returns:
+        Dictionary with the number of rows and chunks scored, the elapsed
+        time and the throughput in rows per second.
+
+    """
+    experiment = experiment or experiment_for(pipeline)
+    predict_kwargs = {"raw_score": raw_score} if is_classifier(pipeline._final_estimator) else {}
+
+    rows = chunks = 0
+    start = time.perf_counter()
+    with ChunkWriter(output) as writer:
+        for chunk in iter_chunks(source, chunksize):
+            pred = experiment.predict_model(pipeline, data=chunk, verbose=False, **predict_kwargs)
+            if keep_columns is not None:
+                new_columns = [c for c in pred.columns if c not in chunk.columns]
+                pred = pred[list(keep_columns) + new_columns]
+            writer.write(pred)
+            rows += len(chunk)
+            chunks += 1
+    elapsed = time.perf_counter() - start
+
+    summary = {
+        "rows": rows,
+        "chunks": chunks,
+        "seconds": round(elapsed, 3),
+        "rows_per_s": round(rows / elapsed, 2) if elapsed > 0 else None,
+        "output": os.fspath(output),
+    }
+    if verbose:
+        print(f"{rows} rows in {chunks} chunks scored in {elapsed:.2f}s "
+              f"({summary['rows_per_s']} rows/s) -> {output}")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("model", help="model name passed to load_model (without .pkl)")
+    parser.add_argument("source", help="CSV or Parquet file to score")
+    parser.add_argument("output", help="CSV or Parquet file to write")
+    parser.add_argument("--chunksize", type=int, default=100_000)
+    parser.add_argument("--keep-columns", nargs="+", default=None)
+    parser.add_argument("--raw-score", action="store_true")
+    args = parser.parse_args(argv)
+
+    import lazy_imports
+
+    # scoring only: skip the experiment module and defer the plotting stack
+    lazy_imports.install()
+    from pycaret.internal.persistence import load_model
+
+    pipeline = load_model(args.model, verbose=False)
+    predict_stream(pipeline, args.source, args.output, chunksize=args.chunksize,
+                   keep_columns=args.keep_columns, raw_score=args.raw_score)
+
+
+if __name__ == "__main__":
+    main()
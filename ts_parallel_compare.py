@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""Process-pool compare_models for time series
+
+In tutorial_time_series_forecasting.py, `compare_models()` on the expanding
+window CV (`fold_strategy = 'expanding'`) fits ets, arima, theta and the
+reduced regressors (`dt_cds_dt`, ...) one CV window at a time, and a single
+slow model (ARIMA) holds up the rest of the library.
+`parallel_ts_compare_models` schedules every (model, CV window) pair as an
+independent task on a local process pool:
+
+- every window is fitted and scored with pycaret's own time-series
+  `_fit_and_score`, so metrics (MASE, RMSSE, coverage, ...) are computed
+  exactly as in `create_model`,
+- the results are put back in (model, window) order before the grid is built,
+  whatever order the workers finish in,
+- the global random state is re-seeded from `session_id` before every task,
+  so the scores do not depend on which worker ran which window.
+
+Usage, after `setup(data, fh = 3, session_id = 123, fold_strategy = 'expanding')`:
+
+```
+from ts_parallel_compare import parallel_ts_compare_models
+best = parallel_ts_compare_models(get_current_experiment(), n_jobs = -1)
+pull()
+```
+"""
+
+import os
+import random
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sklearn.base import clone
+
+from parallel_compare import build_compare_grid, finalize_selection, library_estimators
+
+
+def ts_cv_splits(exp, fold=None):
+    """Materialize the (train_idx, test_idx) windows of the experiment's fold generator."""
+    from pycaret.utils.time_series.forecasting.model_selection import get_folds
+
+    cv = exp.get_fold_generator(fold=fold)
+    return cv, list(get_folds(cv, exp.y_train))
+
+
+def _single_threaded(estimator):
+    """Clone ``estimator`` with every ``n_jobs`` parameter (nested ones too) set to 1."""
+    estimator = clone(estimator)
+    n_jobs = {k: 1 for k in estimator.get_params() if k == "n_jobs" or k.endswith("__n_jobs")}
+    return estimator.set_params(**n_jobs) if n_jobs else estimator
+
+
+# state shipped once to every worker process by the pool initializer
+_WORKER_STATE = {}
+
+
+def _init_worker(pipeline, y, X, scoring, fit_kwargs, alpha, coverage, scorer_kwargs):
+    _WORKER_STATE.update(
+        pipeline=pipeline,
+        y=y,
+        X=X,
+        scoring=scoring,
+        fit_kwargs=fit_kwargs,
+        alpha=alpha,
+        coverage=coverage,
+        scorer_kwargs=scorer_kwargs,
+    )
+
+
+def _run_task(model_id, fold_idx, estimator, train, test, seed):
+    from pycaret.utils.time_series.forecasting.model_selection import _fit_and_score
+    from pycaret.utils.time_series.forecasting.pipeline import _add_model_to_pipeline
+
+    s = _WORKER_STATE
+    np.random.seed(seed)
+    random.seed(seed)
+    try:
+        scores, fit_time, _, _ = _fit_and_score(
+            pipeline=_add_model_to_pipeline(pipeline=s["pipeline"], model=estimator),
+            y=s["y"],
+            X=s["X"],
+            scoring=s["scoring"],
+            train=train,
+            test=test,
+            parameters=None,
+            fit_params=s["fit_kwargs"],
+            return_train_score=False,
+            alpha=s["alpha"],
+            coverage=s["coverage"],
+            error_score=0,
+            **s["scorer_kwargs"],
+        )
+        return model_id, fold_idx, scores, fit_time, None
+    except Exception:
+        return model_id, fold_idx, None, 0.0, traceback.format_exc()
+
+
+def parallel_ts_compare_models(
+    exp,
+    include=None,
+    exclude=None,
+    fold=None,
+    round=4,
+    sort="MASE",
+    n_select=1,
+    turbo=True,
+    errors="ignore",
+    fit_kwargs=None,
+    n_jobs=None,
+):
+    """
+    Process-pool version of the time-series `compare_models`. Every
+    (model, CV window) pair is an independent task.
+
+
+    exp: TSForecastingExperiment
+        Experiment on which ``setup()`` has been run. With the functional API
+        use ``get_current_experiment()``.
+
+
+    include, exclude, fold, round, sort, n_select, turbo, errors, fit_kwargs
+        Same meaning as in ``compare_models``.
+
+
+    n_jobs: int, default = None
+        Number of worker processes. None or -1 uses all CPUs. Models are run
+        single threaded inside the workers to avoid oversubscription.
+
+
+    Returns:
+        Trained model or list of trained models, depending on ``n_select``.
+        The scoring grid is available with ``pull()``.
+
+    """
+    if errors not in ("ignore", "raise"):
+        raise ValueError("errors parameter must be one of: ignore, raise.")
+    if n_jobs is None or n_jobs < 0:
+        n_jobs = os.cpu_count()
+
+    cv, splits = ts_cv_splits(exp, fold=fold)
+    # same metric keys as create_model (metric ids), mapped back to display names below
+    metrics = exp._all_metrics
+    scoring = {k: v.scorer for k, v in metrics.items()}
+    cv_fit_kwargs = exp.update_fit_kwargs_with_fh_from_cv(dict(fit_kwargs or {}), cv)
+
+    models, names, tasks = {}, {}, []
+    for model, model_id, name, estimator in library_estimators(exp, include, exclude, turbo):
+        models[model_id], names[model_id] = model, name
+        worker_estimator = _single_threaded(estimator)
+        for fold_idx, (train, test) in enumerate(splits):
+            tasks.append((model_id, fold_idx, worker_estimator, train, test, exp.seed))
+
+    results = {model_id: [None] * len(splits) for model_id in models}
+    fit_times = {model_id: 0.0 for model_id in models}
+    with ProcessPoolExecutor(
+        max_workers=n_jobs,
+        initializer=_init_worker,
+        initargs=(
+            exp.pipeline,
+            exp.y_train,
+            exp.X_train,
+            scoring,
+            cv_fit_kwargs,
+            exp.point_alpha,
+            exp.coverage,
+            exp.get_additional_scorer_kwargs(),
+        ),
+    ) as pool:
+        futures = [pool.submit(_run_task, *task) for task in tasks]
+        for future in futures:
+            model_id, fold_idx, scores, fit_time, error = future.result()
+            if error is not None:
+                if errors == "raise":
+                    raise RuntimeError(
+                        f"create_model() failed for model {models[model_id]}. {error}"
+                    )
+                exp.logger.warning(f"{model_id} failed on window {fold_idx}:\n{error}")
+                scores = {k: np.nan for k in metrics}
+            results[model_id][fold_idx] = {
+                metrics[k].display_name: v for k, v in scores.items()
+            }
+            fit_times[model_id] += fit_time
+
+    # TT (Sec) of the time-series compare_models is the mean time per window
+    fit_times = {k: v / len(splits) for k, v in fit_times.items()}
+    # models that could not be fitted on any window are left out of the grid
+    fold_scores = {
+        k: v for k, v in results.items() if not all(np.isnan(list(s.values())).all() for s in v)
+    }
+    grid = build_compare_grid(exp, fold_scores, names, fit_times, sort, round=round,
+                              skipna=False)
+    return finalize_selection(exp, grid, models, n_select=n_select, fit_kwargs=fit_kwargs)
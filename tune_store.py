@@ -0,0 +1,508 @@
+# -*- coding: utf-8 -*-
+"""Resumable tune_model with a persistent trial store
+
+`tune_model(dt)` and `tune_model(dt, search_library = 'optuna')` start every
+search from nothing, and all scored trials are lost if the process dies.
+`resumable_tune_model` records every trial in a local SQLite file as soon as it
+is scored. Trials belong to a study identified by:
+
+- the estimator and its fixed parameters,
+- the search space (`custom_grid` or the library's default grid),
+- a fingerprint of the training data and of the preprocessing pipeline,
+- the CV folds and the metric being optimized.
+
+Calling it again on the same study resumes it:
+
+- configurations that were already scored are not fitted again,
+- with `search_library = 'scikit-learn'` the random search draws the same
+  sequence of configurations (seeded by `session_id`), so only the ones missing
+  from the store are evaluated,
+- with `search_library = 'optuna'` the TPE sampler is warm-started with every
+  stored trial before new ones are suggested.
+
+`n_iter` is the size of the study: a rerun with the same `n_iter` only finishes
+interrupted work, a larger `n_iter` extends the search.
+
+With `search_library = 'optuna'` and `pruner = 'median'` (or `'hyperband'`),
+the running mean of the `optimize` metric is reported to optuna after every
+fold, and a trial that is clearly worse than the others after a couple of
+folds is stopped. Pruned trials are stored with the folds they were scored on
+and are not retried by later pruned searches.
+
+Usage:
+
+```
+from tune_store import resumable_tune_model
+
+dt = create_model('dt')
+tuned_dt = resumable_tune_model(get_current_experiment(), dt, n_iter = 50)
+tuned_dt = resumable_tune_model(get_current_experiment(), dt, n_iter = 100)   # 50 new trials
+tuned_dt = resumable_tune_model(get_current_experiment(), dt, n_iter = 50,
+                                search_library = 'optuna', pruner = 'median')
+```
+"""
+
+import json
+import os
+import sqlite3
+import time
+
+import joblib
+import numpy as np
+from sklearn.base import clone
+
+from fold_cache import create_model_grid, estimator_fingerprint, experiment_fingerprint
+from parallel_compare import cv_splits, fit_and_score_fold, make_estimator, scoring_metrics
+
+DEFAULT_STORE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "pycaret_tune", "trials.db")
+
+# params of the untuned estimator, stored as a trial so choose_better is free on reruns
+BASELINE = {}
+
+
+def _json_default(o):
+    if isinstance(o, np.generic):
+        return o.item()
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def params_key(params):
+    """Canonical JSON text of a parameter dict."""
+    return json.dumps(params, sort_keys=True, default=_json_default)
+
+
+class TrialStore:
+    """SQLite table of scored tuning trials, grouped by study key.
+
+    Every trial is committed as soon as it is added, so an interrupted search
+    loses at most the trial that was running.
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = os.fspath(path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._connect() as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS trials ("
+                " study TEXT NOT NULL,"
+                " params TEXT NOT NULL,"
+                " score REAL,"
+                " fold_scores TEXT NOT NULL,"
+                " fit_time REAL NOT NULL,"
+                " created REAL NOT NULL,"
+                " state TEXT NOT NULL DEFAULT 'complete',"
+                " PRIMARY KEY (study, params))"
+            )
+            # stores created before pruning was supported
+            columns = [row[1] for row in con.execute("PRAGMA table_info(trials)")]
+            if "state" not in columns:
+                con.execute(
+                    "ALTER TABLE trials ADD COLUMN state TEXT NOT NULL DEFAULT 'complete'"
+                )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def add(self, study, params, score, fold_scores, fit_time, state="complete"):
+        """Store a trial. ``state`` is 'complete' or 'pruned' (scored on some folds only)."""
+        with self._connect() as con:
+            con.execute(
+                "INSERT OR REPLACE INTO trials"
+                " (study, params, score, fold_scores, fit_time, created, state)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    study,
+                    params_key(params),
+                    None if score is None or np.isnan(score) else float(score),
+                    json.dumps(fold_scores, default=_json_default),
+                    float(fit_time),
+                    time.time(),
+                    state,
+                ),
+            )
+
+    def get(self, study, params):
+        """Return the stored trial for ``params`` or None."""
+        with self._connect() as con:
+            row = con.execute(
+                "SELECT params, score, fold_scores, fit_time, state FROM trials"
+                " WHERE study = ? AND params = ?",
+                (study, params_key(params)),
+            ).fetchone()
+        return None if row is None else self._trial(row)
+
+    def trials(self, study):
+        """All trials of ``study``, oldest first."""
+        with self._connect() as con:
+            rows = con.execute(
+                "SELECT params, score, fold_scores, fit_time, state FROM trials"
+                " WHERE study = ? ORDER BY created",
+                (study,),
+            ).fetchall()
+        return [self._trial(row) for row in rows]
+
+    @staticmethod
+    def _trial(row):
+        params, score, fold_scores, fit_time, state = row
+        return {
+            "params": json.loads(params),
+            "score": np.nan if score is None else score,
+            "fold_scores": json.loads(fold_scores),
+            "fit_time": fit_time,
+            "state": state,
+        }
+
+    def delete(self, study=None):
+        """Remove the trials of ``study``, or every trial if None."""
+        with self._connect() as con:
+            if study is None:
+                con.execute("DELETE FROM trials")
+            else:
+                con.execute("DELETE FROM trials WHERE study = ?", (study,))
+
+
+def search_space(exp, model_id, custom_grid=None, search_library="scikit-learn"):
+    """Return the grid ``tune_model`` would search, without pipeline prefixes."""
+    if custom_grid is not None:
+        if not isinstance(custom_grid, dict):
+            raise TypeError(f"custom_grid must be a dict, got {type(custom_grid)}.")
+        grid = dict(custom_grid)
+    else:
+        definition = exp._all_models_internal[model_id]
+        grid = definition.tune_grid if search_library == "scikit-learn" else definition.tune_distribution
+    if not grid:
+        raise ValueError(
+            "parameter grid for tuning is empty. If passing custom_grid, make sure that "
+            "it is not empty. If not passing custom_grid, the passed estimator does not "
+            "have a built-in tuning grid."
+        )
+    return grid
+
+
+def study_key(exp, estimator, grid, splits, optimize, search_library):
+    """Identifier of a tuning study, see the module docstring."""
+    return joblib.hash(
+        (
+            experiment_fingerprint(exp),
+            estimator_fingerprint(estimator),
+            grid,
+            [(np.asarray(train), np.asarray(test)) for train, test in splits],
+            optimize,
+            search_library,
+        )
+    )
+
+
+def sample_params(grid, random_state):
+    """Draw one configuration: uniformly from lists, with ``rvs`` from distributions."""
+    from pycaret.internal.distributions import Distribution
+
+    params = {}
+    for name, values in grid.items():
+        if isinstance(values, Distribution):
+            values = values.get_base()
+        if hasattr(values, "rvs"):
+            params[name] = values.rvs(random_state=random_state)
+        else:
+            values = list(values)
+            params[name] = values[random_state.randint(len(values))]
+    return json.loads(params_key(params))
+
+
+def evaluate_trial(exp, estimator, params, splits, metrics, optimize, fit_kwargs=None,
+                   should_stop=None):
+    """Cross validate ``estimator`` with ``params`` and return the trial record.
+
+    ``should_stop(fold_idx, running_mean)`` is called after every fold; when
+    it returns True the remaining folds are skipped and the trial is 'pruned'.
+    """
+    estimator = clone(estimator).set_params(**params)
+    X, y = exp.X_train, exp.y_train
+    fold_scores, fit_time, state = [], 0.0, "complete"
+    for fold_idx, (train, test) in enumerate(splits):
+        scores, fold_fit_time, _ = fit_and_score_fold(
+            exp.pipeline, estimator, X, y, train, test, metrics, fit_kwargs
+        )
+        fold_scores.append(scores)
+        fit_time += fold_fit_time
+        running_mean = float(np.mean([s[optimize] for s in fold_scores]))
+        if (should_stop is not None and fold_idx < len(splits) - 1
+                and should_stop(fold_idx, running_mean)):
+            state = "pruned"
+            break
+    score = float(np.mean([s[optimize] for s in fold_scores]))
+    return {"params": params, "score": score, "fold_scores": fold_scores,
+            "fit_time": fit_time, "state": state}
+
+
+def _run_trial(exp, store, study, estimator, params, splits, metrics, optimize, fit_kwargs,
+               should_stop=None):
+    """Return the stored trial for ``params``, evaluating and storing it if missing.
+
+    A trial pruned by an earlier search is evaluated again on all folds when
+    no ``should_stop`` is given.
+    """
+    trial = store.get(study, params)
+    if trial is None or (trial["state"] == "pruned" and should_stop is None):
+        try:
+            trial = evaluate_trial(exp, estimator, params, splits, metrics, optimize,
+                                   fit_kwargs, should_stop)
+        except Exception as ex:
+            exp.logger.warning(f"Trial {params} failed: {ex}")
+            trial = {"params": params, "score": np.nan,
+                     "fold_scores": [{m: np.nan for m in metrics} for _ in splits],
+                     "fit_time": 0.0, "state": "complete"}
+        store.add(study, params, trial["score"], trial["fold_scores"], trial["fit_time"],
+                  trial["state"])
+        trial["new"] = True
+    return trial
+
+
+def _random_search(exp, store, study, estimator, grid, n_iter, run):
+    random_state = np.random.RandomState(exp.seed)
+    seen = set()
+    # finite grids can have fewer than n_iter distinct configurations
+    for _ in range(n_iter * 20):
+        if len(seen) >= n_iter:
+            break
+        params = sample_params(grid, random_state)
+        key = params_key(params)
+        if key in seen:
+            continue
+        seen.add(key)
+        run(params)
+
+
+def _suggest(trial, name, distribution):
+    import optuna
+
+    if isinstance(distribution, optuna.distributions.FloatDistribution):
+        return trial.suggest_float(name, distribution.low, distribution.high,
+                                   log=distribution.log, step=distribution.step)
+    if isinstance(distribution, optuna.distributions.IntDistribution):
+        return trial.suggest_int(name, distribution.low, distribution.high,
+                                 log=distribution.log, step=distribution.step)
+    return trial.suggest_categorical(name, distribution.choices)
+
+
+def make_pruner(pruner, n_folds):
+    """Return an optuna pruner for 'median', 'hyperband' or an optuna pruner object."""
+    import optuna
+
+    if pruner == "median":
+        # no pruning before 2 folds, nor before 5 trials have completed
+        return optuna.pruners.MedianPruner(n_startup_trials=5, n_warmup_steps=1)
+    if pruner == "hyperband":
+        return optuna.pruners.HyperbandPruner(min_resource=2, max_resource=n_folds)
+    if isinstance(pruner, optuna.pruners.BasePruner):
+        return pruner
+    raise ValueError("pruner must be one of: None, 'median', 'hyperband' or an optuna pruner.")
+
+
+def _running_means(fold_scores, optimize):
+    values = [s[optimize] for s in fold_scores]
+    return {i: float(np.mean(values[:i + 1])) for i in range(len(values))}
+
+
+def _optuna_search(exp, store, study, estimator, grid, n_iter, run, greater_is_better,
+                   optimize, pruner=None, n_folds=None):
+    from pycaret.internal.distributions import CategoricalDistribution, get_optuna_distributions
+    from pycaret.utils._dependencies import _check_soft_dependencies
+
+    _check_soft_dependencies("optuna", extra="tuners", severity="error")
+    import optuna
+    from optuna.trial import TrialState
+
+    distributions = get_optuna_distributions(
+        {k: v if hasattr(v, "get_optuna") else CategoricalDistribution(list(v))
+         for k, v in grid.items()}
+    )
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    optuna_study = optuna.create_study(
+        direction="maximize" if greater_is_better else "minimize",
+        sampler=optuna.samplers.TPESampler(seed=exp.seed),
+        pruner=None if pruner is None else make_pruner(pruner, n_folds),
+    )
+
+    # warm start: replay the stored history into the sampler
+    history = [t for t in store.trials(study) if t["params"] != BASELINE]
+    for t in history:
+        if np.isnan(t["score"]):
+            continue
+        pruned = t["state"] == "pruned"
+        try:
+            optuna_study.add_trial(
+                optuna.trial.create_trial(
+                    params=t["params"],
+                    distributions=distributions,
+                    value=None if pruned else t["score"],
+                    state=TrialState.PRUNED if pruned else TrialState.COMPLETE,
+                    intermediate_values=_running_means(t["fold_scores"], optimize),
+                )
+            )
+        except ValueError as ex:
+            exp.logger.warning(f"Stored trial {t['params']} not replayed: {ex}")
+
+    def objective(trial):
+        params = {k: _suggest(trial, k, d) for k, d in distributions.items()}
+
+        def should_stop(fold_idx, running_mean):
+            trial.report(running_mean, fold_idx)
+            return trial.should_prune()
+
+        result = run(params, should_stop if pruner is not None else None)
+        if result["state"] == "pruned" or np.isnan(result["score"]):
+            raise optuna.TrialPruned()
+        return result["score"]
+
+    remaining = n_iter - len(history)
+    if remaining > 0:
+        optuna_study.optimize(objective, n_trials=remaining)
+
+
+def resumable_tune_model(
+    exp,
+    estimator,
+    fold=None,
+    round=4,
+    n_iter=10,
+    custom_grid=None,
+    optimize=None,
+    search_library="scikit-learn",
+    choose_better=True,
+    fit_kwargs=None,
+    groups=None,
+    pruner=None,
+    store=None,
+    verbose=True,
+):
+    """
+    `tune_model` whose trials are persisted in a SQLite trial store and
+    reused by later calls on the same study.
+
+
+    exp: ClassificationExperiment or RegressionExperiment
+        Experiment on which ``setup()`` has been run.
+
+
+    estimator, fold, round, custom_grid, choose_better, fit_kwargs, groups
+        Same meaning as in ``tune_model``.
+
+
+    n_iter: int, default = 10
+        Total number of trials of the study. Trials already in the store count
+        towards it.
+
+
+    optimize: str, default = None
+        Metric to optimize. None uses 'Accuracy' for classification and 'R2'
+        for regression.
+
+
+    search_library: str, default = 'scikit-learn'
+        'scikit-learn' (seeded random search) or 'optuna' (TPE, warm-started
+        from the stored trials).
+
+
+    pruner: str or optuna.pruners.BasePruner, default = None
+        Only with ``search_library = 'optuna'``. The running mean of the
+        ``optimize`` metric is reported after every fold, and trials the pruner
+        flags ('median' or 'hyperband') are stopped before the remaining folds.
+        None evaluates every trial on all folds.
+
+
+    store: TrialStore, default = None
+        None uses ``TrialStore()`` in ``~/.cache/pycaret_tune/trials.db``.
+
+
+    verbose: bool, default = True
+        When set to False, the summary (trials reused, pruned and the fold
+        fits pruning saved) is not printed.
+
+
+    Returns:
+        Trained model. The CV grid of the best configuration is available
+        with ``pull()``.
+
+    """
+    if search_library not in ("scikit-learn", "optuna"):
+        raise ValueError("search_library must be one of: scikit-learn, optuna.")
+    if pruner is not None and search_library != "optuna":
+        raise ValueError("pruner is only supported with search_library = 'optuna'.")
+    store = store or TrialStore()
+    metrics = scoring_metrics(exp)
+    if optimize is None:
+        optimize = "R2" if "R2" in metrics else "Accuracy"
+    metric = exp._get_metric_by_name_or_id(optimize)
+    if metric is None:
+        raise ValueError("Optimize method not supported. See docstring for list of available parameters.")
+    optimize = metric.display_name
+
+    model_id, _, base = make_estimator(exp, estimator)
+    grid = search_space(exp, model_id, custom_grid, search_library)
+    splits = cv_splits(exp, fold=fold, groups=groups)
+    study = study_key(exp, base, grid, splits, optimize, search_library)
+
+    counts = {"new": 0, "reused": 0, "pruned": 0, "fold_fits": 0}
+
+    def run(params, should_stop=None):
+        trial = _run_trial(exp, store, study, base, params, splits, metrics, optimize,
+                           fit_kwargs, should_stop)
+        if trial.pop("new", False):
+            counts["new"] += 1
+            counts["fold_fits"] += len(trial["fold_scores"])
+            counts["pruned"] += trial["state"] == "pruned"
+        else:
+            counts["reused"] += 1
+        return trial
+
+    baseline = run(BASELINE)
+    if search_library == "optuna":
+        _optuna_search(exp, store, study, base, grid, n_iter, run, metric.greater_is_better,
+                       optimize, pruner=pruner, n_folds=len(splits))
+    else:
+        _random_search(exp, store, study, base, grid, n_iter, run)
+
+    trials = [
+        t for t in store.trials(study)
+        if t["state"] == "complete" and not np.isnan(t["score"])
+    ]
+    sign = 1 if metric.greater_is_better else -1
+    best = max(trials, key=lambda t: sign * t["score"]) if trials else baseline
+    if choose_better and not np.isnan(baseline["score"]) and sign * baseline["score"] >= sign * best["score"]:
+        best = baseline
+
+    summary = (
+        f"{counts['new']} new trial(s), {counts['reused']} reused from the store; "
+        f"best {optimize} = {best['score']:.{round}f} with {best['params'] or 'original parameters'}"
+    )
+    if pruner is not None and counts["new"]:
+        full = counts["new"] * len(splits)
+        summary += (
+            f"\n{counts['pruned']} of {counts['new']} new trial(s) pruned early, "
+            f"{counts['fold_fits']} of {full} fold fits run "
+            f"({100 * (1 - counts['fold_fits'] / full):.0f}% saved)"
+        )
+    exp.logger.info(summary)
+    if verbose:
+        print(summary)
+
+    # the CV grid of the winner comes from the store, only the final fit is run
+    records = [{"test": s} for s in best["fold_scores"]]
+    results = create_model_grid(records, list(metrics), round=round)
+    model, _ = exp._create_model(
+        estimator=clone(base).set_params(**best["params"]),
+        system=False,
+        verbose=False,
+        cross_validation=False,
+        predict=False,
+        fit_kwargs=fit_kwargs,
+        groups=groups,
+    )
+    exp._display_container.append(results)
+    exp._master_model_container.append(
+        {"model": model, "scores": results, "cv": exp._get_cv_splitter(fold)}
+    )
+    return model
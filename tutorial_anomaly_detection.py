@@ -42,6 +42,11 @@ or depending on your use-case you may install one of the following variant:
 - `pip install pycaret[test]`
 """
 
+# defer the plotting imports of pycaret until they are used (see lazy_imports.py),
+# must run before pycaret is imported
+import lazy_imports
+lazy_imports.install()
+
 # check installed version
 import pycaret
 pycaret.__version__
@@ -127,6 +132,12 @@ You can use the `plot_model` function to analyzes the performance of a trained m
 # tsne plot anomalies
 plot_model(iforest, plot = 'tsne')
 
+"""The t-SNE plot embeds every row, which takes hours past ~50k rows. `embedding_plot.py` embeds a sample that always keeps the flagged anomalies and caches the coordinates on disk, keyed by the transformed data, so plotting another model on the same setup does not run t-SNE again."""
+
+from embedding_plot import plot_embedding
+
+plot_embedding(get_current_experiment(), iforest)
+
 # check docstring to see available plots
 # help(plot_model)
 
@@ -156,6 +167,16 @@ save_model(iforest, 'iforest_pipeline')
 loaded_iforest_pipeline = load_model('iforest_pipeline')
 loaded_iforest_pipeline
 
+"""To score a continuous event feed, `anomaly_stream.py` takes micro-batches from an iterator, a queue or a local socket and scores each one through the saved pipeline once, yielding only `Anomaly` and `Anomaly_Score`. Memory stays bounded, and `StreamStats` reports events per second."""
+
+from anomaly_stream import score_stream, StreamStats
+
+stats = StreamStats()
+events = iter(data.to_dict('records'))
+for scored in score_stream(loaded_iforest_pipeline, events, batch_size = 200, stats = stats):
+    pass
+stats.summary()
+
 """# 👇 Detailed function-by-function overview
 
 ## ✅ Setup
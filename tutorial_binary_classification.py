@@ -42,6 +42,11 @@ or depending on your use-case you may install one of the following variant:
 - `pip install pycaret[test]`
 """
 
+# defer the plotting imports of pycaret until they are used (see lazy_imports.py),
+# must run before pycaret is imported
+import lazy_imports
+lazy_imports.install()
+
 # check installed version
 import pycaret
 pycaret.__version__
@@ -261,6 +266,27 @@ You can check the docstring of the function for more info.
 
 # help(compare_models)
 
+"""On machines with many cores the (estimator, fold) pairs of `compare_models` can also be fitted on a local process pool with `parallel_compare_models` from `parallel_compare.py`. It returns the same models and leaves the same scoring grid for `pull`."""
+
+from parallel_compare import parallel_compare_models
+
+best = parallel_compare_models(get_current_experiment(), n_jobs = -1)
+pull()
+
+"""Most of the time spent in `compare_models` goes to models that are already behind after two folds. `halving_compare_models` from `halving_compare.py` evaluates every model on a few folds, prunes the bottom half and only spends the remaining folds on the survivors. `pull` shows the round in which each model was pruned."""
+
+from halving_compare import halving_compare_models
+
+best = halving_compare_models(get_current_experiment(), n_select = 3)
+pull()
+
+"""On large datasets most models can be ranked on a small sample. `progressive_compare_models` from `progressive_compare.py` cross validates every model on a stratified sample, the best ones on a larger sample and only the finalists on the full training set. The rank correlations between the stages show whether the samples ranked the models like the larger data."""
+
+from progressive_compare import progressive_compare_models
+
+best = progressive_compare_models(get_current_experiment(), fractions = (0.05, 0.2), top_k = (6, 3), min_rows = 100)
+pull().attrs['rank_correlation']
+
 """## ✅ Set Custom Metrics"""
 
 # check available metrics used in CV
@@ -283,6 +309,24 @@ compare_models()
 # remove custom metric
 remove_metric('custom_metric')
 
+"""Custom metrics can also be computed from the confusion matrix the built-in metrics already share on every fold. Decorate them with `shared_inputs` from `metric_engine.py`; the function then receives the fold's `FoldInputs` instead of `(y, y_pred)`."""
+
+from metric_engine import shared_inputs
+
+@shared_inputs
+def custom_metric(inputs):
+    cm = inputs.confusion_matrix(labels = [0, 1])
+    return 100 * cm[1, 1] - 5 * cm[0, 1]
+
+add_metric('custom_metric', 'Custom Metric', custom_metric)
+
+# parallel_compare_models scores every fold through metric_engine, so the
+# custom metric reuses the confusion matrix of the built-in metrics
+parallel_compare_models(get_current_experiment(), n_jobs = -1)
+
+# remove custom metric
+remove_metric('custom_metric')
+
 """## ✅ Experiment Logging
 PyCaret integrates with many different type of experiment loggers (default = 'mlflow'). To turn on experiment tracking in PyCaret you can set `log_experiment` and `experiment_name` parameter. It will automatically track all the metrics, hyperparameters, and artifacts based on the defined logger.
 """
@@ -42,6 +42,11 @@ or depending on your use-case you may install one of the following variant:
 - `pip install pycaret[test]`
 """
 
+# defer the plotting imports of pycaret until they are used (see lazy_imports.py),
+# must run before pycaret is imported
+import lazy_imports
+lazy_imports.install()
+
 # check installed version
 import pycaret
 pycaret.__version__
@@ -134,6 +139,16 @@ plot_model(kmeans, plot = 'elbow')
 # plot silhouette
 plot_model(kmeans, plot = 'silhouette')
 
+"""Both plots refit KMeans for every k and compute the silhouette on all pairs of rows, which does not scale to millions of rows. `cluster_count.py` fits every k once with `MiniBatchKMeans`, computes the exact distortion chunk by chunk and estimates the silhouette on samples with a confidence interval. The fits are cached on the experiment and shared by both plots."""
+
+from cluster_count import analyze_k, plot_elbow, plot_silhouette
+
+analyze_k(get_current_experiment()).frame()
+
+plot_elbow(get_current_experiment())
+
+plot_silhouette(get_current_experiment(), kmeans)
+
 # check docstring to see available plots
 # help(plot_model)
 
@@ -149,6 +164,13 @@ The `predict_model` function returns `Cluster` label as a new column in the inpu
 kmeans_pred = predict_model(kmeans, data=data)
 kmeans_pred
 
+"""At millions of rows, the labeled copy of the data `predict_model` and `assign_model` return costs more than the assignment itself. `cluster_assign.py` preprocesses and assigns the rows chunk by chunk with a float32 matrix product on several threads and returns only compact integer labels (label `i` is `'Cluster i'`), optionally with the distance to the centroid. `data` can also be a CSV or Parquet path."""
+
+from cluster_assign import assign_clusters
+
+labels, distances = assign_clusters(get_current_experiment(), kmeans, data=data, return_distance=True)
+labels[:10], distances[:10]
+
 """## Save Model
 
 Finally, you can save the entire pipeline on disk for later use, using pycaret's `save_model` function.
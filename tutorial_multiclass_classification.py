@@ -42,6 +42,11 @@ or depending on your use-case you may install one of the following variant:
 - `pip install pycaret[test]`
 """
 
+# defer the plotting imports of pycaret until they are used (see lazy_imports.py),
+# must run before pycaret is imported
+import lazy_imports
+lazy_imports.install()
+
 # check installed version
 import pycaret
 pycaret.__version__
@@ -256,6 +261,13 @@ You can check the docstring of the function for more info.
 
 # help(compare_models)
 
+"""On machines with many cores the (estimator, fold) pairs of `compare_models` can also be fitted on a local process pool with `parallel_compare_models` from `parallel_compare.py`. It returns the same models and leaves the same scoring grid for `pull`."""
+
+from parallel_compare import parallel_compare_models
+
+best = parallel_compare_models(get_current_experiment(), n_jobs = -1)
+pull()
+
 """## ✅ Experiment Logging
 PyCaret integrates with many different type of experiment loggers (default = 'mlflow'). To turn on experiment tracking in PyCaret you can set `log_experiment` and `experiment_name` parameter. It will automatically track all the metrics, hyperparameters, and artifacts based on the defined logger.
 """
@@ -42,6 +42,11 @@ or depending on your use-case you may install one of the following variant:
 - `pip install pycaret[test]`
 """
 
+# defer the plotting imports of pycaret until they are used (see lazy_imports.py),
+# must run before pycaret is imported
+import lazy_imports
+lazy_imports.install()
+
 # check installed version (must be >3.0)
 import pycaret
 pycaret.__version__
@@ -182,6 +187,17 @@ save_model(best, 'my_first_pipeline')
 loaded_best_pipeline = load_model('my_first_pipeline')
 loaded_best_pipeline
 
+"""Scoring services do not need the training stack. `export_model` from `slim_inference.py` compiles the pipeline into a file that `slim_inference.load_model` / `predict_model` score with numpy, pandas, scikit-learn and the estimator's library only, with the same output columns as `predict_model`."""
+
+from slim_inference import export_model, check_parity
+import slim_inference
+
+export_model(loaded_best_pipeline, 'my_first_pipeline_slim')
+slim = slim_inference.load_model('my_first_pipeline_slim')
+slim_inference.predict_model(slim, data.drop('charges', axis = 1)).head()
+
+check_parity(slim, loaded_best_pipeline, data)
+
 """# 👇 Detailed function-by-function overview
 
 ## ✅ Setup
@@ -198,6 +214,30 @@ get_config()
 # lets access X_train_transformed
 get_config('X_train_transformed')
 
+"""Calling `setup` again with the same data and arguments refits the whole preprocessing pipeline. `cached_setup` from `setup_cache.py` keys a disk cache on the data and the arguments, so a repeated call loads the fitted experiment instead."""
+
+from setup_cache import cached_setup
+
+s = cached_setup(RegressionExperiment, data, target = 'charges', session_id = 123)
+set_current_experiment(s)
+
+"""Every `get_config('X_train_transformed')` builds a new in-memory copy. For large datasets, `MemmapRegressionExperiment` from `memmap_store.py` adds a `memmap_dir` option to `setup`: the raw and transformed train/test matrices are written once to Arrow files and returned as memory-mapped, zero-copy views."""
+
+from memmap_store import MemmapRegressionExperiment
+
+mm = MemmapRegressionExperiment()
+mm.setup(data, target = 'charges', session_id = 123, memmap_dir = 'pycaret_memmap', verbose = False)
+mm.get_config('X_train_transformed')
+
+"""When the data does not fit in memory at all, `OutOfCoreRegressionExperiment` from `out_of_core.py` sets up from a CSV/Parquet file or an iterator of chunks: imputation values, category vocabularies and scaling parameters are computed in a streaming pass over all the rows, and only a sample of `sample_size` rows is loaded for training."""
+
+from out_of_core import OutOfCoreRegressionExperiment
+
+data.to_parquet('insurance.parquet')
+ooc = OutOfCoreRegressionExperiment()
+ooc.setup('insurance.parquet', target = 'charges', session_id = 123, normalize = True, sample_size = 1000, verbose = False)
+ooc.stream_statistics.numeric
+
 # another example: let's access seed
 print("The current seed is: {}".format(get_config('seed')))
 
@@ -265,6 +305,15 @@ You can check the docstring of the function for more info.
 
 # help(compare_models)
 
+"""To see where the time of `compare_models` goes (preprocessing, fitting, predicting, scoring), `experiment_trace` records timing spans per API call, estimator and fold. `summary()` aggregates them and `export_chrome_trace` writes a trace you can open in `chrome://tracing` or Perfetto."""
+
+import experiment_trace
+
+with experiment_trace.profile('compare_models_trace.json') as tracer:
+    compare_models(include = ['lr', 'dt', 'rf'])
+
+experiment_trace.summary(tracer)
+
 """## ✅ Experiment Logging
 PyCaret integrates with many different type of experiment loggers (default = 'mlflow'). To turn on experiment tracking in PyCaret you can set `log_experiment` and `experiment_name` parameter. It will automatically track all the metrics, hyperparameters, and artifacts based on the defined logger.
 """
@@ -322,6 +371,13 @@ create_model('lr', fit_intercept = False)
 # train lr and return train score as well alongwith CV
 create_model('lr', return_train_score=True)
 
+"""Each of the calls above refits every fold from scratch. `cached_create_model` from `fold_cache.py` memoizes the fitted folds and their scores per experiment, so repeating a call (or asking for `return_train_score` afterwards) reuses the finished folds."""
+
+from fold_cache import cached_create_model
+
+lr = cached_create_model(get_current_experiment(), 'lr')
+lr = cached_create_model(get_current_experiment(), 'lr', return_train_score=True)
+
 """Some other parameters that you might find very useful in `create_model` are:
 
 - cross_validation
@@ -369,6 +425,17 @@ tuner
 # tune dt using optuna
 tuned_dt = tune_model(dt, search_library = 'optuna')
 
+"""Every `tune_model` call starts from scratch. `resumable_tune_model` from `tune_store.py` writes each trial to a SQLite store as soon as it is scored. Calling it again on the same model, grid and data skips the configurations already scored, and warm-starts the optuna sampler from the stored trials."""
+
+from tune_store import resumable_tune_model
+
+tuned_dt = resumable_tune_model(get_current_experiment(), dt, n_iter = 20, search_library = 'optuna')
+
+"""With `pruner = 'median'` (or `'hyperband'`) the running CV score is reported to optuna after every fold, and trials that are clearly behind after a couple of folds are stopped early. The summary shows how many fold fits pruning saved."""
+
+tuned_dt = resumable_tune_model(get_current_experiment(), dt, n_iter = 20, custom_grid = dt_grid,
+                                optimize = 'MAE', search_library = 'optuna', pruner = 'median')
+
 """For more details on all available `search_library` and `search_algorithm` please check the docstring. Some other parameters that you might find very useful in `tune_model` are:
 
 - choose_better
@@ -450,6 +517,23 @@ You can check the docstring of the function for more info.
 
 # help(stack_models)
 
+"""`stack_models` and `blend_models` refit the three models in every fold, although `compare_models` just cross validated them on the same folds. With `retain_oof=True`, `cached_compare_models` keeps their out-of-fold predictions, and `oof_ensemble.py` trains the meta-model on them without refitting the base models. The printed summary compares the number of base model fits."""
+
+from fold_cache import cached_compare_models
+from oof_ensemble import oof_blend_models, oof_stack_models
+
+top3 = cached_compare_models(get_current_experiment(), sort = 'MAE', n_select = 3, retain_oof = True)
+oof_stack_models(get_current_experiment(), top3)
+oof_blend_models(get_current_experiment(), top3)
+
+"""Stacked and blended pipelines get large on disk. `chunked_model.py` saves the members of the ensemble in separate compressed chunks that `load_model` reads in parallel, memory-mapping the arrays that are stored uncompressed."""
+
+import chunked_model
+
+stacker = finalize_model(stack_models(best_mae_models_top3))
+chunked_model.save_model(stacker, 'my_stacker')
+chunked_model.load_model('my_stacker')
+
 """## ✅ Plot Model
 
 The `plot_model` function analyzes the performance of a trained model on the hold-out set. It may require re-training the model in certain cases.
@@ -636,3 +720,11 @@ save_experiment('my_experiment')
 # load experiment from disk
 exp_from_disk = load_experiment('my_experiment', data=data)
 
+
+"""`save_experiment` rewrites every model each time it is called and `load_experiment` runs `setup` again. `experiment_snapshots.py` adds snapshots to a store incrementally (only new models, score grids and configuration changes are written) and loads them without `setup`, unpickling each model only when it is first accessed."""
+
+import experiment_snapshots
+
+experiment_snapshots.save_experiment(get_current_experiment(), 'my_experiment_snapshots')
+exp_from_disk = experiment_snapshots.load_experiment('my_experiment_snapshots', data=data)
+experiment_snapshots.snapshots('my_experiment_snapshots')
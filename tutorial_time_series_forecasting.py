@@ -42,6 +42,11 @@ or depending on your use-case you may install one of the following variant:
 - `pip install pycaret[test]`
 """
 
+# defer the plotting imports of pycaret until they are used (see lazy_imports.py),
+# must run before pycaret is imported
+import lazy_imports
+lazy_imports.install()
+
 # check installed version
 import pycaret
 pycaret.__version__
@@ -207,6 +212,13 @@ This function trains and evaluates the performance of all estimators available i
 
 best = compare_models()
 
+"""Each model is fitted on the expanding windows one after another, so slow models like `arima` hold up the others. `parallel_ts_compare_models` from `ts_parallel_compare.py` fits every (model, CV window) pair on a local process pool and gives the same scoring grid for the same `session_id`."""
+
+from ts_parallel_compare import parallel_ts_compare_models
+
+best = parallel_ts_compare_models(get_current_experiment(), n_jobs = -1)
+pull()
+
 """`compare_models` by default uses all the estimators in model library (all except models with `Turbo=False`) . To see all available models you can use the function `models()`"""
 
 # check available models